@@ -0,0 +1,48 @@
+"""
+JSON编解码模块
+安装了 orjson 时走其快速路径（C实现，编解码约快3~10倍），否则回退到标准库 json，
+两者输出的JSON语义一致，调用方无需关心底层实现
+
+    pip install orjson  # 可选，启用快速路径
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # 未安装时使用标准库
+    orjson = None
+
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+# orjson.JSONDecodeError 与 json.JSONDecodeError 都是 ValueError 的子类
+JSONDecodeError = ValueError
+
+
+def dumps(obj: Any) -> str:
+    """紧凑编码为 str（非ASCII字符原样输出）"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """紧凑编码为 UTF-8 bytes（写Redis/HTTP响应时免去一次 str 转换）"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_pretty(obj: Any) -> str:
+    """带2空格缩进的编码（与原 json.dumps(indent=2, ensure_ascii=False) 输出一致）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(obj, indent=2, ensure_ascii=False)
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """解码JSON（接受 str 或 bytes）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,82 @@
+"""
+账号密码校验模块
+账号密码认证（解密接口方式一、登录、查询次数）需要查询用户并 AES 解密数据库中的密码，
+校验成功后记录到短期缓存，同一账号密码的后续请求直接通过，不再查库和解密
+
+缓存键是 (用户名, 密码) 的 HMAC（进程启动时随机生成密钥），内存中不保存明文密码；
+管理员修改用户（密码、状态等）后用户缓存失效，该用户此前的校验记录随之作废
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+from typing import Optional, Tuple
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+from sqlalchemy import select
+
+from .config import settings
+from .db import execute_read
+from .models import SysUser
+from .ttl_cache import TTLCache
+from .user_cache import CachedUser, changed_since, current_generation, get_cached_user, remember_user
+
+# 校验结果
+AUTH_OK = "ok"
+AUTH_NOT_FOUND = "not_found"
+AUTH_BAD_PASSWORD = "bad_password"
+
+_HMAC_KEY = secrets.token_bytes(32)
+# {HMAC: 校验时的用户缓存失效次数}
+_verified = TTLCache("credential", maxsize=settings.credential_cache_size, ttl=settings.credential_cache_ttl)
+
+
+def decrypt_password(ciphertext_b64: str) -> str | None:
+    """解密密码（AES/CBC/PKCS5 Base64）"""
+    try:
+        key = settings.aes_key.encode("utf-8")
+        iv = settings.aes_iv.encode("utf-8")
+        cipher = AES.new(key, AES.MODE_CBC, iv)
+        plaintext = unpad(cipher.decrypt(base64.b64decode(ciphertext_b64)), AES.block_size)
+        return plaintext.decode("utf-8")
+    except Exception:
+        return None
+
+
+def _credential_key(username: str, password: str) -> bytes:
+    # 用户名长度作前缀，避免 ("ab", "c") 与 ("a", "bc") 拼接后相同
+    message = f"{len(username)}:{username}:{password}".encode("utf-8")
+    return hmac.new(_HMAC_KEY, message, hashlib.sha256).digest()
+
+
+async def _load_user_row(username: str) -> Optional[SysUser]:
+    res = await execute_read(select(SysUser).where(SysUser.user_name == username))
+    return res.scalar_one_or_none()
+
+
+async def authenticate(username: str, password: str) -> Tuple[Optional[CachedUser], str]:
+    """
+    校验账号密码
+
+    Returns:
+        (用户信息, 校验结果)：用户不存在时为 (None, AUTH_NOT_FOUND)；
+        密码错误时为 (用户信息, AUTH_BAD_PASSWORD)；账号状态由调用方检查
+    """
+    key = _credential_key(username, password)
+    generation = _verified.get(key)
+    if generation is not None and not changed_since(username, generation):
+        user = await get_cached_user(username)
+        if user is not None:
+            return user, AUTH_OK
+
+    generation = current_generation()
+    db_user = await _load_user_row(username)
+    if db_user is None:
+        return None, AUTH_NOT_FOUND
+    user = remember_user(db_user)
+    decrypted = decrypt_password(db_user.password)
+    if not decrypted or decrypted != password:
+        return user, AUTH_BAD_PASSWORD
+    _verified.set(key, generation)
+    return user, AUTH_OK
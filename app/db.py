@@ -1,7 +1,24 @@
+"""
+数据库连接
+主库承担所有写入；配置了只读副本（MYSQL_REPLICA_DSN）时，鉴权和查询接口的只读 SELECT 走副本，
+副本不可用或复制延迟超过 REPLICA_MAX_LAG 秒时回退到主库
+
+只读副本的数据可能落后主库最多 REPLICA_MAX_LAG 秒，需要读到最新数据的查询（配额计数初始化、
+更新前的查询等）仍使用 AsyncSessionLocal
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 from .config import settings
+from .logger import get_logger
+
+log = get_logger(__name__)
 
 
 engine = create_async_engine(
@@ -15,7 +32,103 @@ engine = create_async_engine(
 )
 AsyncSessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
+# 只读副本（未配置时为None，只读查询直接走主库）
+replica_engine = create_async_engine(
+    settings.mysql_replica_dsn,
+    echo=False,
+    pool_pre_ping=True,
+    pool_size=settings.replica_pool_size,
+    max_overflow=settings.replica_max_overflow,
+    pool_timeout=settings.replica_pool_timeout,  # 副本连接池耗尽时尽快回退到主库
+    pool_recycle=3600,
+) if settings.mysql_replica_dsn else None
+ReplicaSessionLocal = sessionmaker(
+    bind=replica_engine, class_=AsyncSession, expire_on_commit=False
+) if replica_engine is not None else None
+
+# 副本状态：不可用截止时间（time.monotonic()），最近一次检测到的复制延迟（秒，None表示未知）
+_replica_down_until = 0.0
+_replica_lag: Optional[float] = None
+
 
 async def get_db() -> AsyncSession:
     async with AsyncSessionLocal() as session:
         yield session
+
+
+def replica_usable() -> bool:
+    """只读副本当前是否可用（已配置、未处于故障回退期、复制延迟在允许范围内）"""
+    return ReplicaSessionLocal is not None and time.monotonic() >= _replica_down_until
+
+
+def _mark_replica_down(reason: str, **fields) -> None:
+    global _replica_down_until
+    if replica_usable():
+        log.warning("只读副本暂不可用，只读查询回退到主库", reason=reason,
+                    retry_after=settings.replica_retry_interval, **fields)
+    _replica_down_until = time.monotonic() + settings.replica_retry_interval
+
+
+async def execute_read(statement):
+    """
+    执行只读查询：优先发往只读副本，副本连接失败、连接池耗尽或查询失败时标记副本不可用并在主库重试
+
+    Returns:
+        已缓冲的查询结果（会话关闭后仍可读取）
+    """
+    if replica_usable():
+        try:
+            async with ReplicaSessionLocal() as db:
+                return await db.execute(statement)
+        except (DBAPIError, PoolTimeoutError, OSError, asyncio.TimeoutError) as e:
+            _mark_replica_down("query_failed", error=e)
+    async with AsyncSessionLocal() as db:
+        return await db.execute(statement)
+
+
+async def _read_replica_lag() -> Optional[float]:
+    """读取副本的复制延迟（秒）；复制线程停止时为None"""
+    async with ReplicaSessionLocal() as db:
+        try:
+            row = (await db.execute(text("SHOW REPLICA STATUS"))).mappings().first()
+        except DBAPIError:
+            # MySQL 8.0.22 之前的版本
+            await db.rollback()
+            row = (await db.execute(text("SHOW SLAVE STATUS"))).mappings().first()
+    if row is None:
+        return None
+    lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+    return float(lag) if lag is not None else None
+
+
+async def replica_lag_check_task() -> None:
+    """每隔 REPLICA_LAG_CHECK_INTERVAL 秒检测副本延迟，超过 REPLICA_MAX_LAG 或复制停止时回退到主库"""
+    global _replica_lag
+    while True:
+        try:
+            _replica_lag = await _read_replica_lag()
+            if _replica_lag is None:
+                _mark_replica_down("replication_stopped")
+            elif _replica_lag > settings.replica_max_lag:
+                _mark_replica_down("lag", lag=_replica_lag)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _replica_lag = None
+            _mark_replica_down("lag_check_failed", error=e)
+        await asyncio.sleep(settings.replica_lag_check_interval)
+
+
+def get_replica_status() -> Dict[str, Any]:
+    return {
+        "configured": ReplicaSessionLocal is not None,
+        "usable": replica_usable(),
+        "lag": _replica_lag,
+    }
+
+
+async def dispose_engines() -> None:
+    """释放主库和副本的连接池"""
+    await engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
@@ -2,23 +2,41 @@ import asyncio
 
 import httpx
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
 import redis.asyncio as redis
 
 from .config import settings
 from . import runtime
 from .routes.task_routes import router as task_router
 from .routes.user_routes import router as user_router
-from .worker import worker_loop, daily_cleanup_task, daily_cleanup_user_decrypt_log_task
-from .rate_limiter import TokenBucketRateLimiter
-from .load_balancer import init_servers, get_load_balancer_stats
-from .db import engine
+from .routes.admin_routes import router as admin_router
+from .worker_pool import create_worker_pool
+from .worker import get_dropped_stats
+from .retention import daily_retention_task
+from .rate_limiter import create_rate_limiter
+from .load_balancer import close_key_cache, init_key_cache, init_servers, get_all_servers, get_load_balancer_stats
+from .db import dispose_engines, get_replica_status, replica_engine, replica_lag_check_task
+from .logger import setup_logging, shutdown_logging
+from .metrics import render_metrics
+from .tracing import ServerTimingMiddleware
+from .user_cache import user_cache_sync_task
+from .quota import flush_quota_usage, quota_sync_task
+from .token_auth import revocation_sync_task
+from .ttl_cache import get_cache_stats
+from .warmup import get_warmup_report, is_ready, mark_not_ready, warm_up
 
 
 def create_app() -> FastAPI:
     app = FastAPI(title="Load-Balance FastAPI", version="1.0.0")
+    # 解密接口的阶段计时（Server-Timing 响应头 + 慢请求采集）
+    app.add_middleware(ServerTimingMiddleware, path_prefix="/api/yd/")
     @app.on_event("startup")
     async def on_startup():
+        # 日志由后台线程写出，先于其他组件启动
+        setup_logging()
         runtime.redis_client = redis.from_url(settings.redis_url, decode_responses=True)
+        # 队列成员为二进制编码，使用不解码响应的独立客户端
+        runtime.redis_queue_client = redis.from_url(settings.redis_url, decode_responses=False)
         # HTTP客户端优化配置：
         # - http2=True: 启用HTTP/2多路复用（如果服务器支持，可大幅减少连接数和延迟）
         # - verify=False: 禁用SSL证书验证（内网环境）
@@ -35,29 +53,49 @@ def create_app() -> FastAPI:
             )
         )
         runtime.b_concurrency_sema = asyncio.Semaphore(settings.b_max_concurrency)
-        runtime.b_rate_limiter = TokenBucketRateLimiter(settings.b_rate_limit)
+        runtime.b_rate_limiter = create_rate_limiter("upstream", settings.b_rate_limit)
         
         # 初始化负载均衡服务器列表（使用完整配置，包含账号密码）
         init_servers(settings.server_list)
+        init_key_cache()
+        if settings.b_server_rate_limit > 0:
+            runtime.b_server_rate_limiters = {
+                server.idx: create_rate_limiter(f"upstream:{server.idx}", settings.b_server_rate_limit)
+                for server in get_all_servers()
+            }
         
         # 不在启动时自动创建 task 表（任务不需要存 MySQL）
         # 若需要创建表请使用迁移工具（Alembic）或在此处明确调用
-        # 启动Worker并发处理密钥包任务
-        # 队列中只有密钥包，Worker数量与服务器数量匹配即可
-        server_count = len(settings.server_list)
-        worker_count = max(server_count, 2)  # 至少2个Worker
-        app.state.workers = [
-            asyncio.create_task(worker_loop())
-            for _ in range(worker_count)
-        ]
-        print(f"🚀 启动了 {worker_count} 个Worker并发处理任务")
-
-        # 启动每日定时清理任务（保存引用，shutdown时一并取消）
-        app.state.workers.append(asyncio.create_task(daily_cleanup_task()))
-        app.state.workers.append(asyncio.create_task(daily_cleanup_user_decrypt_log_task()))
+        # 启动Worker池并发处理密钥包任务
+        # 队列中只有密钥包，分发器按优先级派发到各服务器的本地队列，
+        # 每台服务器的消费者数量根据积压、空闲状态和上游延迟自动伸缩
+        runtime.worker_pool = create_worker_pool()
+        app.state.workers = [asyncio.create_task(runtime.worker_pool.run())]
+
+        # 启动每日数据保留任务（保存引用，shutdown时一并取消）
+        app.state.workers.append(asyncio.create_task(daily_retention_task()))
+
+        # 订阅用户缓存失效通知（管理员修改用户后各进程删除本地缓存）
+        app.state.workers.append(asyncio.create_task(user_cache_sync_task()))
+
+        # 配额用量定期写回数据库
+        app.state.workers.append(asyncio.create_task(quota_sync_task()))
+
+        # 同步token吊销信息（本地校验token时使用）
+        app.state.workers.append(asyncio.create_task(revocation_sync_task()))
+
+        # 检测只读副本的复制延迟（延迟过大时只读查询回退到主库）
+        if replica_engine is not None:
+            app.state.workers.append(asyncio.create_task(replica_lag_check_task()))
+
+        # 并发登录所有服务器并建立保活连接，完成后 /ready 返回就绪
+        app.state.workers.append(asyncio.create_task(warm_up()))
 
     @app.on_event("shutdown")
     async def on_shutdown():
+        # 0. 退出就绪状态，负载均衡器不再派发新请求
+        mark_not_ready()
+
         # 1. 先取消所有Worker任务
         workers = getattr(app.state, "workers", [])
         for worker in workers:
@@ -80,23 +118,55 @@ def create_app() -> FastAPI:
             except Exception:
                 pass
         
-        # 4. 释放数据库连接池（必须在事件循环关闭前执行，否则 aiomysql __del__ 报错）
-        await engine.dispose()
+        # 4. 写回剩余的配额用量（需在释放数据库连接池之前）
+        try:
+            await flush_quota_usage()
+        except Exception as e:
+            print(f"配额用量写回失败: {e}")
+
+        # 5. 释放数据库连接池（必须在事件循环关闭前执行，否则 aiomysql __del__ 报错）
+        await dispose_engines()
 
-        # 5. 最后关闭Redis连接
+        # 6. 最后关闭Redis连接
         if runtime.redis_client:
             await runtime.redis_client.close()
+        if runtime.redis_queue_client:
+            await runtime.redis_queue_client.close()
+
+        # 7. 解除密钥缓存的共享内存映射
+        close_key_cache()
+
+        # 8. 停止日志线程（写完队列中剩余的日志）
+        shutdown_logging()
 
     app.include_router(task_router)
     app.include_router(user_router)
+    app.include_router(admin_router)
 
     @app.get("/")
     async def root():
         return {"service": "Load-Balance FastAPI", "status": "ok"}
     
+    @app.get("/ready")
+    async def ready():
+        """就绪检查：启动预热完成后返回200，预热中或正在关闭时返回503"""
+        body = {"ready": is_ready(), "warmup": get_warmup_report()}
+        return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
     @app.get("/api/server/stats")
     async def lb_stats():
         """获取负载均衡统计信息"""
-        return await get_load_balancer_stats()
+        stats = await get_load_balancer_stats()
+        if runtime.worker_pool:
+            stats["worker_pool"] = runtime.worker_pool.stats()
+        stats["dropped_jobs"] = get_dropped_stats()
+        stats["caches"] = get_cache_stats()
+        stats["db_replica"] = get_replica_status()
+        return stats
+
+    @app.get("/metrics")
+    async def metrics():
+        """运行指标（Prometheus 文本格式）"""
+        return Response(content=await render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
     return app
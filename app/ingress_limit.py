@@ -0,0 +1,104 @@
+"""
+用户请求频率限制（解密接口入口）
+按用户做令牌桶限流（GCRA），速率和突发容量由用户优先级决定，超限请求在查库之前直接返回 429
+
+账号密码认证的请求在校验通过之前不计入该用户的额度（否则知道用户名的人可以用错误密码把该用户限流），
+校验失败的请求计入按 (用户名, 客户端IP) 区分的认证失败额度（AUTH_RATE_LIMIT），额度用尽后该来源的
+账号密码请求在校验之前直接返回429；校验通过的请求不消耗认证失败额度，只计入用户额度
+
+计数默认保存在本进程（有界缓存，空闲用户的状态自动过期）；
+USER_RATE_LIMIT_BACKEND=redis 时所有进程共享 Redis 上的计数，Redis 出错时回退到本进程计数
+"""
+import json
+import time
+from typing import Hashable, List, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from .config import settings
+from . import runtime
+from .logger import get_logger
+from .rate_limiter import RATE_LIMIT_KEY_PREFIX, gcra_reserve
+from .ttl_cache import TTLCache
+
+log = get_logger(__name__)
+
+USER_RATE_KEY_PREFIX = f"{RATE_LIMIT_KEY_PREFIX}user:"
+AUTH_RATE_KEY_PREFIX = f"{RATE_LIMIT_KEY_PREFIX}auth:"
+
+
+def _parse_budgets(raw: str) -> List[Tuple[int, float, int]]:
+    """解析 [[优先级上界, 每秒请求数, 突发容量], ...]，按优先级上界升序"""
+    try:
+        budgets = [(int(p), float(rate), int(burst)) for p, rate, burst in json.loads(raw)]
+    except Exception as e:
+        log.error("解析USER_RATE_LIMITS失败，使用默认配置", error=e)
+        budgets = [(9, 50.0, 100), (99, 20.0, 40), (999, 10.0, 20)]
+    return sorted(budgets)
+
+
+_budgets = _parse_budgets(settings.user_rate_limits)
+# {用户名 或 ("auth", 用户名, 客户端IP): 理论到达时间 TAT（time.monotonic()）}，TAT 过去后条目自然过期
+_local_tat = TTLCache("user_rate", maxsize=settings.user_rate_cache_size, ttl=60)
+
+
+def budget_for(priority: Optional[int]) -> Tuple[float, int]:
+    """用户优先级对应的 (每秒请求数, 突发容量)；优先级未知时按最低一档"""
+    if priority is not None:
+        for max_priority, rate, burst in _budgets:
+            if priority <= max_priority:
+                return rate, burst
+    return _budgets[-1][1], _budgets[-1][2]
+
+
+def _check_local(key: Hashable, interval: float, tolerance: float, count: int) -> float:
+    now = time.monotonic()
+    tat = max(_local_tat.get(key, now), now)
+    wait = tat - tolerance - now
+    if wait > 0:
+        return wait
+    if count:
+        tat += count * interval
+        _local_tat.set(key, tat, ttl=tat - now)
+    return 0.0
+
+
+async def _check(local_key: Hashable, redis_key: str, rate: float, burst: int, count: int = 1) -> float:
+    """count=0 时只检查额度是否已用尽，不计数"""
+    if settings.user_rate_limit_backend == "off" or rate <= 0:
+        return 0.0  # 关闭或该档位不限速
+    interval = 1.0 / rate
+    tolerance = (burst - 1) * interval
+    if settings.user_rate_limit_backend == "redis" and runtime.redis_client:
+        try:
+            ok, offset = await gcra_reserve(redis_key, interval, tolerance, count=count, max_wait=0)
+            return 0.0 if ok else offset
+        except (RedisError, OSError) as e:
+            log.error("Redis用户限流失败，回退到本进程计数", error=e, rate_limit=5)
+    return _check_local(local_key, interval, tolerance, count)
+
+
+async def check_user_rate(username: str, priority: Optional[int]) -> float:
+    """
+    记录一次请求并检查是否超过该用户的频率限制（只对已认证的用户调用）
+
+    Returns:
+        0 表示放行；大于0表示超限，值为需要等待的秒数（超限的请求不计数）
+    """
+    rate, burst = budget_for(priority)
+    return await _check(username, f"{USER_RATE_KEY_PREFIX}{username}", rate, burst)
+
+
+async def _auth_check(username: str, client: str, count: int) -> float:
+    return await _check(("auth", username, client), f"{AUTH_RATE_KEY_PREFIX}{username}:{client}",
+                        settings.auth_rate_limit, settings.auth_rate_burst, count)
+
+
+async def check_auth_rate(username: str, client: str) -> float:
+    """检查 (用户名, 客户端IP) 的认证失败额度是否已用尽（不计数），返回值同 check_user_rate"""
+    return await _auth_check(username, client, 0)
+
+
+async def record_auth_failure(username: str, client: str) -> None:
+    """账号密码校验失败时计入 (用户名, 客户端IP) 的认证失败额度"""
+    await _auth_check(username, client, 1)
@@ -15,6 +15,14 @@ from collections import OrderedDict
 from enum import Enum
 from datetime import datetime, timedelta
 
+from .config import settings
+from .logger import get_logger
+from .shm_key_cache import SharedKeyCache, server_fingerprint
+from .tracing import span
+
+
+log = get_logger(__name__)
+
 
 # ==================== 常量定义 ====================
 MAX_KEY_CACHE_SIZE = 4096           # 密钥缓存最大容量
@@ -129,6 +137,9 @@ _servers: List[ServerInfo] = []
 # 使用OrderedDict实现LRU淘汰
 _key_cache: OrderedDict[str, DroneKeyInfo] = OrderedDict()#表示这个有序字典的键（key）是字符串类型，值（value）是 DroneKeyInfo 类型的对象。每个键对应一个无人机密钥信息的数据对象，并且插入顺序会被保留。
 
+# 共享内存密钥缓存（KEY_CACHE_BACKEND=shm 时由 init_key_cache() 创建，替代 _key_cache）
+_shm_key_cache: Optional[SharedKeyCache] = None
+
 # 用于防止重复处理
 _processing_keys: OrderedDict[str, Tuple[int, float]] = OrderedDict()
 
@@ -201,15 +212,11 @@ def get_idle_server() -> Optional[ServerInfo]:
         check_idx = (start_idx + i) % server_count
         server = _servers[check_idx]
         if not server.is_busy():
-            # 找到空闲服务器，记录上次索引用于打印
+            # 找到空闲服务器，记录上次索引用于日志
             previous_idx = _last_dispatch_server_idx if _last_dispatch_server_idx >= 0 else None
             # 更新轮询索引
             _last_dispatch_server_idx = check_idx
-            # 打印轮询信息
-            if previous_idx is not None:
-                print(f"轮询分配服务器: {check_idx} (上次: {previous_idx})")
-            else:
-                print(f" 轮询分配服务器: {check_idx} (首次分配)")
+            log.debug("轮询分配服务器", server=check_idx, previous=previous_idx)
             return server
     
     # 所有服务器都繁忙
@@ -229,12 +236,31 @@ def set_server_busy(server_idx: int) -> bool:
     server = get_server(server_idx)
     if server:
         server.set_busy()
-        print(f" 服务器 {server_idx} 设置为繁忙状态")
+        log.info("服务器设置为繁忙状态", server=server_idx)
         return True
     return False
 
 
 # ==================== 密钥缓存管理 ====================
+def init_key_cache() -> None:
+    """
+    按 KEY_CACHE_BACKEND 初始化密钥缓存：shm=同机各进程共享内存，其他=本进程
+    需在 init_servers() 之后调用：共享内存中记录服务器列表指纹，列表变化后旧的路由作废
+    """
+    global _shm_key_cache
+    if settings.key_cache_backend == "shm" and _shm_key_cache is None:
+        fingerprint = server_fingerprint(f"{s.idx} {s.url} {s.username}" for s in _servers)
+        _shm_key_cache = SharedKeyCache(settings.key_cache_shm_name, settings.key_cache_shm_slots, fingerprint)
+
+
+def close_key_cache() -> None:
+    """解除共享内存映射（共享内存段保留给同机的其他进程）"""
+    global _shm_key_cache
+    if _shm_key_cache is not None:
+        _shm_key_cache.close()
+        _shm_key_cache = None
+
+
 async def add_key_to_cache(hash_code: str, server_idx: int, sn: str = "") -> bool:
     """
     添加密钥到缓存（密钥包解密成功后调用）
@@ -248,13 +274,21 @@ async def add_key_to_cache(hash_code: str, server_idx: int, sn: str = "") -> boo
         是否添加成功
     """
     if not hash_code or len(hash_code) != 8:
-        print(f" 无效的hash_code: {hash_code}")
+        log.warning("无效的hash_code", hash_code=hash_code, rate_limit=5)
         return False
+
+    if _shm_key_cache is not None:
+        if not _shm_key_cache.put(hash_code, server_idx, sn[:17]):
+            log.warning("无效的hash_code", hash_code=hash_code, rate_limit=5)
+            return False
+        log.debug("密钥已缓存", hash_code=hash_code, server=server_idx, sn=sn)
+        _processing_keys.pop(hash_code, None)
+        return True
     
     # 检查容量，超出则移除最旧的
     while len(_key_cache) >= MAX_KEY_CACHE_SIZE:
         oldest_key, oldest_info = _key_cache.popitem(last=False)
-        print(f" 密钥缓存已满，移除最旧的: {oldest_key}")
+        log.info("密钥缓存已满，移除最旧的", hash_code=oldest_key, rate_limit=1)
     
     # 添加到缓存
     key_info = DroneKeyInfo(
@@ -263,7 +297,7 @@ async def add_key_to_cache(hash_code: str, server_idx: int, sn: str = "") -> boo
         sn=sn
     )
     _key_cache[hash_code] = key_info
-    print(f"密钥已缓存: hash_code={hash_code}, server={server_idx}, sn={sn}")
+    log.debug("密钥已缓存", hash_code=hash_code, server=server_idx, sn=sn)
     
     # 从处理中队列移除
     if hash_code in _processing_keys:
@@ -284,6 +318,13 @@ async def find_key_in_cache(hash_code: str) -> Optional[DroneKeyInfo]:
     """
     if not hash_code:
         return None
+
+    if _shm_key_cache is not None:
+        entry = _shm_key_cache.get(hash_code)
+        if entry is None:
+            return None
+        server_idx, sn, timestamp = entry
+        return DroneKeyInfo(server_idx=server_idx, hash_code=hash_code, sn=sn, timestamp=timestamp)
     
     key_info = _key_cache.get(hash_code)#
     if key_info:
@@ -303,6 +344,8 @@ async def is_key_exists(hash_code: str) -> bool:
     Returns:
         True 如果密钥存在
     """
+    if _shm_key_cache is not None:
+        return hash_code in _shm_key_cache
     return hash_code in _key_cache
 
 
@@ -364,20 +407,20 @@ async def add_to_processing(hash_code: str, server_idx: int) -> bool:
     ]
     for hc in expired:
         del _processing_keys[hc]
-        print(f" 处理中队列超时清理: {hc}")
+        log.info("处理中队列超时清理", hash_code=hc)
     
     # 检查是否已在处理中
     if hash_code in _processing_keys:
-        print(f"  密钥 {hash_code} 已在处理中")
+        log.debug("密钥已在处理中", hash_code=hash_code)
         return False
     
     # 检查队列容量
     while len(_processing_keys) >= MAX_BUSY_QUEUE_SIZE:
         oldest_hc, _ = _processing_keys.popitem(last=False)
-        print(f" 处理中队列已满，移除最旧条目: {oldest_hc}")
+        log.warning("处理中队列已满，移除最旧条目", hash_code=oldest_hc, rate_limit=1)
     
     _processing_keys[hash_code] = (server_idx, now)
-    print(f" 密钥 {hash_code} 加入处理队列，分配服务器: {server_idx}")
+    log.debug("密钥加入处理队列", hash_code=hash_code, server=server_idx)
     return True
 
 
@@ -393,7 +436,7 @@ async def remove_from_processing(hash_code: str) -> bool:
     """
     if hash_code in _processing_keys:
         del _processing_keys[hash_code]
-        print(f"密钥 {hash_code} 已从处理队列移除")
+        log.debug("密钥已从处理队列移除", hash_code=hash_code)
         return True
     return False
 
@@ -416,7 +459,7 @@ async def is_in_processing(hash_code: str) -> bool:
     if time.time() - timestamp > KEY_BUSY_TIMEOUT:
         # 超时自动清理
         del _processing_keys[hash_code]
-        print(f"⏰ 处理中队列超时自动清理: {hash_code}")
+        log.info("处理中队列超时自动清理", hash_code=hash_code)
         return False
     
     return True
@@ -463,7 +506,7 @@ async def handle_key_packet(hash_code: str) -> dict:
     if key_info:
         # 密钥已存在，从处理队列中移除（防止重复请求解密）
         await remove_from_processing(hash_code)
-        print(f" 密钥已存在: hash_code={hash_code}, server={key_info.server_idx}, sn={key_info.sn}")
+        log.debug("密钥已存在", hash_code=hash_code, server=key_info.server_idx, sn=key_info.sn)
         return {
             "action": "key_exist",
             "server_idx": key_info.server_idx,
@@ -473,7 +516,7 @@ async def handle_key_packet(hash_code: str) -> dict:
     # 2. 检查是否正在处理中
     if await is_in_processing(hash_code):
         processing_server = await get_processing_server(hash_code)
-        print(f" 密钥正在处理中: hash_code={hash_code}, server={processing_server}")
+        log.debug("密钥正在处理中", hash_code=hash_code, server=processing_server)
         return {
             "action": "key_gen_busy",
             "server_idx": processing_server
@@ -485,33 +528,34 @@ async def handle_key_packet(hash_code: str) -> dict:
     
     if not idle_server:
         # 所有服务器都繁忙，等待并重试
-        print(f"⏳ 所有服务器繁忙，开始等待空闲服务器...")
+        log.info("所有服务器繁忙，开始等待空闲服务器", hash_code=hash_code, rate_limit=1)
         import asyncio
         
-        for attempt in range(1, max_wait_attempts + 1):
-            await asyncio.sleep(1)
+        with span("lb_busy_wait"):
+            for attempt in range(1, max_wait_attempts + 1):
+                await asyncio.sleep(1)
             
-            # 重新检查密钥状态（可能在等待期间已被其他请求处理）
-            key_info = await find_key_in_cache(hash_code)
-            if key_info:
-                print(f"✅ 等待期间密钥已存在: hash_code={hash_code}, server={key_info.server_idx}")
-                return {
-                    "action": "key_exist",
-                    "server_idx": key_info.server_idx,
-                    "sn": key_info.sn
-                }
+                # 重新检查密钥状态（可能在等待期间已被其他请求处理）
+                key_info = await find_key_in_cache(hash_code)
+                if key_info:
+                    log.debug("等待期间密钥已存在", hash_code=hash_code, server=key_info.server_idx)
+                    return {
+                        "action": "key_exist",
+                        "server_idx": key_info.server_idx,
+                        "sn": key_info.sn
+                    }
             
-            # 检查是否有服务器空闲
-            idle_server = get_idle_server()
-            if idle_server:
-                print(f"✅ 等待 {attempt}s 后获得空闲服务器 {idle_server.idx}")
-                break
+                # 检查是否有服务器空闲
+                idle_server = get_idle_server()
+                if idle_server:
+                    log.debug("等待后获得空闲服务器", hash_code=hash_code, server=idle_server.idx, waited=attempt)
+                    break
         
     if idle_server:
         # 加入处理队列
         await add_to_processing(hash_code, idle_server.idx)
         
-        print(f"📤 分发密钥包: hash_code={hash_code} -> 服务器 {idle_server.idx}")
+        log.debug("分发密钥包", hash_code=hash_code, server=idle_server.idx)
         return {
             "action": "dispatch",
             "server_idx": idle_server.idx,
@@ -519,7 +563,7 @@ async def handle_key_packet(hash_code: str) -> dict:
         }
     
     # 4. 等待36秒后仍然所有服务器都繁忙
-    print(f"❌ 等待 {max_wait_attempts}s 后所有服务器仍繁忙: {hash_code}")
+    log.warning("等待后所有服务器仍繁忙", hash_code=hash_code, waited=max_wait_attempts, rate_limit=1)
     return {
         "action": "all_servers_busy"
     }
@@ -581,11 +625,11 @@ async def on_keygen_result(hash_code: str, server_idx: int, success: bool, sn: s
             #这是解密成功的回调，添加到缓存
             await add_key_to_cache(hash_code, server_idx, sn)
             #同时要将处理队列中的这个hash_code移除掉（不管成功还是失败都要移除掉，防止重复处理）
-            print(f" 密钥包处理成功: hash_code={hash_code}, sn={sn}")
+            log.debug("密钥包处理成功", hash_code=hash_code, sn=sn)
         #这是繁忙导致的也算成功，添加到缓存但不带sn
         else:
             await add_key_to_cache(hash_code, server_idx)
-            print(f" 密钥包处理成功（密钥处理繁忙无SN）: hash_code={hash_code}")
+            log.debug("密钥包处理成功（密钥处理繁忙无SN）", hash_code=hash_code)
 
 
 
@@ -615,8 +659,9 @@ async def get_load_balancer_stats() -> dict:
     return {
         "server_count": len(_servers),
         "servers": server_stats,
-        "key_cache_count": len(_key_cache),
-        "key_cache_max": MAX_KEY_CACHE_SIZE,
+        "key_cache_backend": "shm" if _shm_key_cache is not None else "local",
+        "key_cache_count": get_key_cache_size(),
+        "key_cache_max": _shm_key_cache.capacity if _shm_key_cache is not None else MAX_KEY_CACHE_SIZE,
         "processing_count": len(_processing_keys),
         "processing_max": MAX_BUSY_QUEUE_SIZE,
         "server_busy_timeout": SERVER_BUSY_TIMEOUT,
@@ -625,6 +670,18 @@ async def get_load_balancer_stats() -> dict:
     }
 
 
+def get_key_cache_size() -> int:
+    """密钥缓存当前条目数"""
+    if _shm_key_cache is not None:
+        return len(_shm_key_cache)
+    return len(_key_cache)
+
+
+def get_processing_count() -> int:
+    """处理中的密钥包数"""
+    return len(_processing_keys)
+
+
 # ==================== 兼容性接口（保持与原 key_cache.py 兼容） ====================
 async def is_in_keygen_succ(drone_id: str) -> bool:
     """兼容接口：检查密钥是否已存在"""
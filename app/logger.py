@@ -0,0 +1,164 @@
+"""
+结构化异步日志模块
+替代热路径上的 print()：事件循环内只构造日志记录并放入队列，格式化和写stdout由后台线程完成
+
+用法：
+    log = get_logger(__name__)
+    log.debug("轮询分配服务器", server=3)                 # 未开启DEBUG时直接返回，不构造记录
+    log.info("密钥已缓存", hash_code=hc, server=idx)       # 附加字段以 key=value（或JSON）输出
+    log.info("派发任务", task_id=tid, sample=0.01)         # 采样：只记录约1%
+    log.warning("处理中队列已满", rate_limit=1)            # 限流：同一消息每秒最多1条，被抑制的条数随下一条输出
+"""
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Dict, Optional
+
+from .config import settings
+from . import codec
+
+
+ROOT_LOGGER = "app"
+_FIELDS_ATTR = "fields"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """放入队列时不在调用线程格式化消息，格式化推迟到后台线程"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class StructFormatter(logging.Formatter):
+    """结构化格式：text 为 `时间 级别 模块 消息 key=value ...`，json 为单行JSON"""
+
+    def __init__(self, fmt: str = "text"):
+        super().__init__()
+        self.json = fmt == "json"
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, _FIELDS_ATTR, None) or {}
+        if self.json:
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return codec.dumps(entry)
+
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class StructLogger:
+    """
+    带附加字段、采样和限流的日志记录器（包装标准库 Logger）
+
+    限流计数只在事件循环线程中访问，无需加锁
+    """
+
+    __slots__ = ("_logger", "_windows")
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+        # 限流窗口 {消息: [窗口开始时间, 窗口内已记录条数, 被抑制条数]}
+        self._windows: Dict[str, list] = {}
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def debug(self, msg: str, sample: float = 1.0, rate_limit: int = 0, **fields) -> None:
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._log(logging.DEBUG, msg, sample, rate_limit, fields)
+
+    def info(self, msg: str, sample: float = 1.0, rate_limit: int = 0, **fields) -> None:
+        if self._logger.isEnabledFor(logging.INFO):
+            self._log(logging.INFO, msg, sample, rate_limit, fields)
+
+    def warning(self, msg: str, sample: float = 1.0, rate_limit: int = 0, **fields) -> None:
+        if self._logger.isEnabledFor(logging.WARNING):
+            self._log(logging.WARNING, msg, sample, rate_limit, fields)
+
+    def error(self, msg: str, sample: float = 1.0, rate_limit: int = 0, exc_info=None, **fields) -> None:
+        if self._logger.isEnabledFor(logging.ERROR):
+            self._log(logging.ERROR, msg, sample, rate_limit, fields, exc_info)
+
+    def _log(self, level: int, msg: str, sample: float, rate_limit: int, fields: dict, exc_info=None) -> None:
+        if sample < 1.0 and random.random() >= sample:
+            return
+        if rate_limit:
+            now = time.monotonic()
+            window = self._windows.get(msg)
+            if window is None or now - window[0] >= 1.0:
+                suppressed = window[2] if window else 0
+                self._windows[msg] = [now, 1, 0]
+                if suppressed:
+                    fields["suppressed"] = suppressed
+            elif window[1] >= rate_limit:
+                window[2] += 1
+                return
+            else:
+                window[1] += 1
+        if exc_info is True:
+            exc_info = sys.exc_info()
+        # 直接构造记录，跳过标准库查找调用位置（遍历栈帧）的开销，模块名已足够定位
+        record = self._logger.makeRecord(
+            self._logger.name, level, "", 0, msg, (), exc_info, extra={_FIELDS_ATTR: fields}
+        )
+        self._logger.handle(record)
+
+
+def get_logger(name: str) -> StructLogger:
+    """获取模块的结构化日志记录器（统一挂在 app 根记录器下）"""
+    if not name.startswith(ROOT_LOGGER):
+        name = f"{ROOT_LOGGER}.{name}"
+    return StructLogger(logging.getLogger(name))
+
+
+def setup_logging() -> None:
+    """
+    启动异步日志：app 根记录器只挂一个队列Handler，后台线程从队列取出记录写stdout
+
+    重复调用无副作用，应用启动时调用一次
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    # 结构化格式不输出进程/线程信息，关闭后构造每条记录时不再查询
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(StructFormatter(settings.log_format))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(settings.log_level.upper())
+    root.handlers = [_DeferredQueueHandler(log_queue)]
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """停止后台日志线程（会先写完队列中剩余的记录），应用关闭时调用"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,210 @@
+"""
+运行指标模块
+进程内的计数器、直方图和仪表盘，/metrics 接口按 Prometheus 文本格式输出
+
+热路径上的更新只是字典/列表元素的整数加法：所有更新都在事件循环线程内发生，无需加锁；
+仪表盘（队列深度、缓存大小等）不在热路径维护，抓取时现场读取
+"""
+import bisect
+import time
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+from .config import settings
+from . import runtime
+from .load_balancer import get_all_servers, get_key_cache_size, get_processing_count
+from .task_service import QUEUE_KEY
+from .user_cache import get_user_cache_size
+from .ttl_cache import get_cache_stats
+
+
+# 默认延迟桶（秒）：覆盖本地操作（毫秒级）到上游调用（秒级）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_INF_LABEL = 'le="+Inf"'
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        key = tuple(str(v) for v in label_values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(tuple(str(v) for v in label_values), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class _Timer:
+    """计时上下文：退出时把耗时记入直方图"""
+
+    __slots__ = ("_histogram", "_label_values", "_start")
+
+    def __init__(self, histogram: "Histogram", label_values: tuple):
+        self._histogram = histogram
+        self._label_values = label_values
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, *self._label_values)
+        return False
+
+
+class Histogram:
+    """固定桶直方图（桶计数非累积存储，输出时累加）"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # {标签值: [各桶计数..., +Inf桶计数, 总和]}
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        key = tuple(str(v) for v in label_values)
+        slots = self._values.get(key)
+        if slots is None:
+            slots = [0] * (len(self.buckets) + 1) + [0.0]
+            self._values[key] = slots
+        slots[bisect.bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    def time(self, *label_values) -> _Timer:
+        """用法：with STAGE_SECONDS.time("auth"): ..."""
+        return _Timer(self, label_values)
+
+    def count(self, *label_values) -> int:
+        slots = self._values.get(tuple(str(v) for v in label_values))
+        return sum(slots[:-1]) if slots else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, slots in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, slots):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += slots[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, _INF_LABEL)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(slots[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+# ==================== 指标定义 ====================
+REQUESTS = Counter(
+    "gateway_requests_total", "解密请求数（按包类型）", ("packet_type",)
+)
+REQUESTS_BY_PRIORITY = Counter(
+    "gateway_requests_by_priority_total", "解密请求数（按用户优先级档位）", ("priority_band",)
+)
+RATE_LIMITED = Counter(
+    "gateway_rate_limited_total", "因请求频率超限被拒绝的请求数（按用户优先级档位，auth=账号密码认证尝试超限）", ("priority_band",)
+)
+UPSTREAM_REQUESTS = Counter(
+    "gateway_upstream_requests_total", "发往解密服务器的请求数（按服务器和HTTP状态码）", ("server", "status")
+)
+STAGE_SECONDS = Histogram(
+    "gateway_stage_duration_seconds",
+    "请求各阶段耗时：auth=认证 parse=解包 quota=扣费 queue_wait=排队 upstream=上游调用",
+    ("stage",),
+)
+
+
+def priority_band(priority) -> str:
+    """用户优先级档位（优先级1-999，按数量级分档避免标签过多）"""
+    if priority is None:
+        return "none"
+    if priority < 10:
+        return str(priority)
+    if priority < 100:
+        return "10-99"
+    return "100+"
+
+
+# ==================== 仪表盘（抓取时读取） ====================
+def _gauge(name: str, documentation: str, samples: List[Tuple[str, float]],
+           metric_type: str = "gauge") -> List[str]:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{labels} {_format_value(value)}")
+    return lines
+
+
+async def _collect_gauges() -> List[str]:
+    lines: List[str] = []
+
+    queue_depth = 0
+    if runtime.redis_client:
+        try:
+            queue_depth = await runtime.redis_client.zcard(QUEUE_KEY)
+        except Exception:
+            queue_depth = -1  # Redis不可用
+    lines += _gauge("gateway_queue_depth", "优先级队列中等待的密钥包数（-1表示Redis不可用）", [("", queue_depth)])
+    lines += _gauge("gateway_key_cache_size", "密钥缓存条目数", [("", get_key_cache_size())])
+    lines += _gauge("gateway_user_cache_size", "用户信息缓存条目数", [("", get_user_cache_size())])
+    lines += _gauge("gateway_ready", "是否已完成启动预热（1=就绪）", [("", int(runtime.ready))])
+    lines += _gauge("gateway_keygen_in_flight", "处理中的密钥包数", [("", get_processing_count())])
+
+    in_use = 0
+    if runtime.b_concurrency_sema:
+        in_use = settings.b_max_concurrency - runtime.b_concurrency_sema._value
+    lines += _gauge("gateway_upstream_concurrency_in_use", "已占用的上游并发数", [("", in_use)])
+    lines += _gauge("gateway_upstream_concurrency_limit", "上游并发上限", [("", settings.b_max_concurrency)])
+
+    caches = get_cache_stats()
+    # 命中/未命中/淘汰数由缓存对象自己累计，抓取时按计数器输出
+    for field, name, documentation, metric_type in (
+        ("size", "gateway_cache_entries", "进程内缓存条目数", "gauge"),
+        ("memory_bytes", "gateway_cache_memory_bytes", "进程内缓存估算内存占用（字节）", "gauge"),
+        ("hits", "gateway_cache_hits_total", "进程内缓存命中次数", "counter"),
+        ("misses", "gateway_cache_misses_total", "进程内缓存未命中次数", "counter"),
+        ("evictions", "gateway_cache_evictions_total", "进程内缓存按容量淘汰的条目数", "counter"),
+    ):
+        samples = [(_format_labels(("cache",), (c["name"],)), c[field]) for c in caches]
+        lines += _gauge(name, documentation, samples, metric_type)
+
+    now = datetime.utcnow()
+    token_ages = []
+    for server in get_all_servers():
+        age = (now - server.token_fetch_time).total_seconds() if server.token_fetch_time else -1
+        token_ages.append((_format_labels(("server",), (server.idx,)), age))
+    lines += _gauge("gateway_server_token_age_seconds", "各服务器token已使用时长（-1表示无token）", token_ages)
+    return lines
+
+
+async def render_metrics() -> str:
+    """按 Prometheus 文本格式输出全部指标"""
+    lines: List[str] = []
+    for metric in (REQUESTS, REQUESTS_BY_PRIORITY, RATE_LIMITED, UPSTREAM_REQUESTS, STAGE_SECONDS):
+        lines += metric.render()
+    lines += await _collect_gauges()
+    return "\n".join(lines) + "\n"
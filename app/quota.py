@@ -0,0 +1,243 @@
+"""
+请求配额计数模块
+配额检查和扣费由 Redis 上的 Lua 脚本原子完成（一次往返），不再对 sys_user 行加锁；
+已用次数由后台任务分批写回 sys_user.remaining_requests
+
+Redis 结构：
+quota:{username}  哈希 {used: 已用次数, synced: 已写回数据库的次数}，首次扣费时从数据库初始化
+quota:dirty       有未写回用量的用户名集合
+
+总配额不存 Redis：由调用方传入（来自用户缓存，管理员修改用户时失效），修改总配额立即生效
+
+恢复：Redis 数据丢失后 quota:{username} 不存在，下次扣费重新从数据库初始化，
+最多丢失一个写回周期内的用量；Redis 不可用时回退到数据库行锁扣费
+"""
+import asyncio
+from typing import List, Optional, Tuple
+
+from redis.exceptions import RedisError
+from sqlalchemy import bindparam, select, update
+
+from .config import settings
+from . import runtime
+from .db import AsyncSessionLocal
+from .logger import get_logger
+from .models import SysUser
+from .task_service import _get_script
+
+log = get_logger(__name__)
+
+QUOTA_KEY_PREFIX = "quota:"
+QUOTA_DIRTY_KEY = "quota:dirty"
+
+# 扣费脚本：未初始化返回 -2，已达上限返回 -1，否则已用次数加1并返回新值
+# KEYS: quota:{username}, quota:dirty   ARGV: username, total, ttl
+_CHARGE_LUA = """
+local used = redis.call('HGET', KEYS[1], 'used')
+if not used then
+    return -2
+end
+used = tonumber(used)
+local total = tonumber(ARGV[2])
+if total ~= -1 and used >= total then
+    return -1
+end
+used = redis.call('HINCRBY', KEYS[1], 'used', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[1])
+return used
+"""
+
+# 初始化脚本：key不存在时写入数据库中的已用次数（并发初始化只有第一个生效）
+# KEYS: quota:{username}   ARGV: used, ttl
+_SEED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HSET', KEYS[1], 'used', ARGV[1], 'synced', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# 取出待写回的用量：弹出最多 ARGV[1] 个用户，返回 {用户名, 增量, ...}，并把 synced 推进到 used
+# KEYS: quota:dirty   ARGV: batch_size, key_prefix
+_TAKE_LUA = """
+local names = redis.call('SPOP', KEYS[1], ARGV[1])
+local out = {}
+for _, name in ipairs(names) do
+    local key = ARGV[2] .. name
+    local used = tonumber(redis.call('HGET', key, 'used') or '0')
+    local synced = tonumber(redis.call('HGET', key, 'synced') or '0')
+    if used > synced then
+        redis.call('HSET', key, 'synced', used)
+        table.insert(out, name)
+        table.insert(out, used - synced)
+    end
+end
+return out
+"""
+
+# 写回失败时退还增量，下个周期重试
+# KEYS: quota:{username}, quota:dirty   ARGV: username, delta
+_RESTORE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], 'synced', -tonumber(ARGV[2]))
+    redis.call('SADD', KEYS[2], ARGV[1])
+end
+return 0
+"""
+
+# 删除计数并返回未写回的增量（管理员重置用量后重新从数据库初始化）
+# KEYS: quota:{username}
+_DROP_LUA = """
+local used = tonumber(redis.call('HGET', KEYS[1], 'used') or '0')
+local synced = tonumber(redis.call('HGET', KEYS[1], 'synced') or '0')
+redis.call('DEL', KEYS[1])
+return used - synced
+"""
+
+
+def quota_key(username: str) -> str:
+    return f"{QUOTA_KEY_PREFIX}{username}"
+
+
+async def _load_used(username: str) -> Optional[int]:
+    """从数据库读取已用次数（初始化计数用）"""
+    async with AsyncSessionLocal() as db:
+        res = await db.execute(select(SysUser.remaining_requests).where(SysUser.user_name == username))
+        row = res.first()
+    return (row[0] or 0) if row else None
+
+
+async def _charge_db(username: str) -> bool:
+    """Redis不可用时的兜底：数据库原子更新（行锁）"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(SysUser)
+            .where(
+                SysUser.user_name == username,
+                (SysUser.total_requests == -1) | (SysUser.remaining_requests < SysUser.total_requests)
+            )
+            .values(remaining_requests=SysUser.remaining_requests + 1)
+        )
+        await db.commit()
+        return result.rowcount > 0
+
+
+async def charge(username: str, total: int) -> int:
+    """
+    扣费一次（配额检查和计数原子完成）
+
+    Returns:
+        扣费后的已用次数；-1 表示配额已用完
+    """
+    if not runtime.redis_client:
+        return 0 if await _charge_db(username) else -1
+
+    script = _get_script("quota_charge", _CHARGE_LUA)
+    keys = [quota_key(username), QUOTA_DIRTY_KEY]
+    args = [username, total, settings.quota_key_ttl]
+    try:
+        used = await script(keys=keys, args=args, client=runtime.redis_client)
+        if used != -2:
+            return used
+        # 首次扣费（或Redis数据丢失后）：从数据库初始化后重试
+        db_used = await _load_used(username)
+        if db_used is None:
+            return -1
+        seed = _get_script("quota_seed", _SEED_LUA)
+        await seed(keys=[keys[0]], args=[db_used, settings.quota_key_ttl], client=runtime.redis_client)
+        used = await script(keys=keys, args=args, client=runtime.redis_client)
+        return -1 if used < 0 else used
+    except (RedisError, OSError) as e:
+        log.error("Redis扣费失败，回退到数据库扣费", username=username, error=e, rate_limit=1)
+        return 0 if await _charge_db(username) else -1
+
+
+async def get_used(username: str) -> Optional[int]:
+    """Redis中的已用次数（含尚未写回数据库的部分）；未初始化或Redis不可用时返回None"""
+    if not runtime.redis_client:
+        return None
+    try:
+        used = await runtime.redis_client.hget(quota_key(username), "used")
+    except Exception:
+        return None
+    return int(used) if used is not None else None
+
+
+async def current_used(username: str) -> int:
+    """当前已用次数：优先取Redis计数，未初始化时查数据库"""
+    used = await get_used(username)
+    if used is None:
+        used = await _load_used(username) or 0
+    return used
+
+
+async def reset_quota(username: str) -> None:
+    """管理员直接修改已用次数后调用：写回未同步的增量并删除计数，下次扣费重新从数据库初始化"""
+    if not runtime.redis_client:
+        return
+    drop = _get_script("quota_drop", _DROP_LUA)
+    delta = await drop(keys=[quota_key(username)], client=runtime.redis_client)
+    if delta > 0:
+        await _write_back([(username, delta)])
+
+
+# ==================== 写回数据库 ====================
+async def _write_back(deltas: List[Tuple[str, int]]) -> None:
+    """一个事务内批量累加已用次数（Core executemany；ORM 的参数列表 UPDATE 要求按主键更新）"""
+    table = SysUser.__table__
+    async with AsyncSessionLocal() as db:
+        conn = await db.connection()
+        await conn.execute(
+            update(table)
+            .where(table.c.user_name == bindparam("b_user_name"))
+            .values(remaining_requests=table.c.remaining_requests + bindparam("b_delta")),
+            [{"b_user_name": name, "b_delta": delta} for name, delta in deltas],
+        )
+        await db.commit()
+
+
+async def _restore(deltas: List[Tuple[str, int]]) -> None:
+    restore = _get_script("quota_restore", _RESTORE_LUA)
+    for name, delta in deltas:
+        await restore(keys=[quota_key(name), QUOTA_DIRTY_KEY], args=[name, delta], client=runtime.redis_client)
+
+
+async def flush_quota_usage() -> int:
+    """把所有未写回的用量分批写入数据库，返回写回的用户数"""
+    if not runtime.redis_client:
+        return 0
+    take = _get_script("quota_take", _TAKE_LUA)
+    flushed = 0
+    while True:
+        items = await take(
+            keys=[QUOTA_DIRTY_KEY],
+            args=[settings.quota_sync_batch_size, QUOTA_KEY_PREFIX],
+            client=runtime.redis_client,
+        )
+        if not items:
+            # 集合为空，或弹出的用户都没有新增用量
+            if not await runtime.redis_client.scard(QUOTA_DIRTY_KEY):
+                return flushed
+            continue
+        deltas = [(items[i], int(items[i + 1])) for i in range(0, len(items), 2)]
+        try:
+            await _write_back(deltas)
+        except Exception:
+            await _restore(deltas)
+            raise
+        flushed += len(deltas)
+
+
+async def quota_sync_task() -> None:
+    """每隔 QUOTA_SYNC_INTERVAL 秒写回一次用量"""
+    while True:
+        await asyncio.sleep(settings.quota_sync_interval)
+        try:
+            flushed = await flush_quota_usage()
+            if flushed:
+                log.debug("配额用量已写回数据库", users=flushed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("配额用量写回失败，下个周期重试", error=e, rate_limit=5)
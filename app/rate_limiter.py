@@ -1,42 +1,241 @@
 import asyncio
 import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from .config import settings
+from . import runtime
+from .logger import get_logger
+from .task_service import _get_script
+
+log = get_logger(__name__)
 
 
 class TokenBucketRateLimiter:
     """
-    令牌桶速率限制器
+    令牌桶速率限制器（GCRA / 虚拟调度实现）
     用于控制每秒请求数
+
+    只维护一个"理论到达时间" TAT：每次获取时 O(1) 算出调用方的放行时间并把 TAT 推后一个间隔，
+    然后在锁外等待到放行时间。计算过程没有 await，在事件循环内天然原子，无需加锁；
+    并发等待者各自按预约时间放行，互不阻塞
     """
 
-    def __init__(self, rate: int):
+    def __init__(self, rate: int, burst: Optional[int] = None):
         """
         初始化令牌桶
-        
+
         Args:
             rate: 每秒允许的请求数
+            burst: 桶容量（允许的突发请求数），默认等于 rate
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._interval = 1.0 / rate  # 相邻两个请求的间隔
+        self._tolerance = (self.burst - 1) * self._interval  # 允许提前放行的时长（突发容量）
+        self._tat = time.monotonic()  # 理论到达时间
+
+    @property
+    def tokens(self) -> float:
+        """当前可立即获取的令牌数（已预约未放行的请求会占用令牌）"""
+        backlog = max(0.0, self._tat - time.monotonic())
+        available = (self._tolerance + self._interval - backlog) / self._interval
+        return max(0.0, min(float(self.burst), available))
+
+    def _departure(self, now: float) -> float:
+        """下一个请求的放行时间（不预约）"""
+        return max(now, self._tat - self._tolerance)
+
+    def reserve(self) -> float:
+        """预约一个令牌，返回需要等待的秒数（0表示立即放行）"""
+        now = time.monotonic()
+        departure = self._departure(now)
+        self._tat = max(self._tat, now) + self._interval
+        return departure - now
+
+    def _cancel(self, tat: float) -> None:
+        """等待被取消时退还令牌（只有最后一个预约可以退还，其他预约的放行时间不变）"""
+        if self._tat == tat:
+            self._tat -= self._interval
+
+    async def _wait(self, delay: float) -> None:
+        if delay <= 0:
+            return
+        tat = self._tat
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self._cancel(tat)
+            raise
+
+    async def acquire(self):
+        """
+        获取一个令牌，如果没有令牌则等待到预约的放行时间
+        """
+        await self._wait(self.reserve())
+
+    async def try_acquire(self, deadline: Optional[float] = None) -> bool:
         """
+        在截止时间之前获取一个令牌
+
+        Args:
+            deadline: 截止时间（time.monotonic() 时间），None 表示只在可以立即获取时获取
+
+        Returns:
+            True表示已获取；False表示截止时间前无法放行（不占用令牌）
+        """
+        now = time.monotonic()
+        if self._departure(now) > (now if deadline is None else deadline):
+            return False
+        await self._wait(self.reserve())
+        return True
+
+
+# ==================== 跨进程限速（Redis） ====================
+# GCRA 租约脚本：单个key保存理论到达时间 TAT（使用 Redis 服务器时钟，各进程/节点一致）
+# 一次预约 ARGV[3] 个令牌：第 k 个令牌（从0开始）的放行时间 = TAT - 容差 + k * 间隔
+# 第一个令牌需要等待超过 ARGV[4] 秒时不预约
+# KEYS: ratelimit:{name}   ARGV: 间隔, 容差, 令牌数, 最长等待
+# 返回：{是否预约成功, 第一个令牌相对当前时间的放行偏移（秒，可为负）}（字符串，避免Lua数字被截断为整数）
+_GCRA_LEASE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local offset = tat - tolerance - now
+if offset > tonumber(ARGV[4]) then
+    return {0, tostring(offset)}
+end
+tat = tat + tonumber(ARGV[3]) * interval
+redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000) + 1000)
+return {1, tostring(offset)}
+"""
+
+RATE_LIMIT_KEY_PREFIX = "ratelimit:"
+_NO_WAIT_LIMIT = 1e9  # acquire() 不限制等待时长（Lua 5.1 无法解析 inf）
+
+
+async def gcra_reserve(key: str, interval: float, tolerance: float, count: int = 1,
+                       max_wait: float = _NO_WAIT_LIMIT) -> Tuple[bool, float]:
+    """
+    在 Redis 上预约 count 个令牌
+
+    Returns:
+        (是否预约成功, 第一个令牌相对当前时间的放行偏移秒数)；失败时偏移即需要等待的时长
+    """
+    lease = _get_script("gcra_lease", _GCRA_LEASE_LUA)
+    ok, offset = await lease(
+        keys=[key],
+        args=[repr(interval), repr(tolerance), count, repr(max_wait)],
+        client=runtime.redis_client,
+    )
+    return bool(int(ok)), float(offset)
+
+
+class RedisRateLimiter:
+    """
+    跨进程 GCRA 速率限制器（所有网关进程/节点共享同一个 Redis key）
+
+    lease_size = 1 时每个请求各自向 Redis 预约一个令牌，并发请求的预约互相重叠，单进程吞吐不受 Redis 往返时延限制；
+    lease_size > 1 时每次向 Redis 预约一批令牌（各自带放行时间）在本地依次使用，
+    大部分请求不需要访问 Redis，批量预约同一时间只有一个（并发等待者共享）；预约的令牌都计入共享的 TAT，
+    集群总速率不会超过限制，代价是进程空闲时未用完的令牌被浪费，且本地可能晚于预约时间使用令牌
+    （最多 lease_size 个的突发）
+
+    Redis 不可用时回退到本进程的令牌桶（此时按单进程速率限制）
+    """
+
+    def __init__(self, name: str, rate: int, burst: Optional[int] = None, lease_size: int = 1):
+        self.key = f"{RATE_LIMIT_KEY_PREFIX}{name}"
         self.rate = rate
-        self.tokens = rate
-        self.last_refill = time.monotonic()
-        self._lock = asyncio.Lock()
+        self.burst = burst if burst is not None else rate
+        self.lease_size = max(1, lease_size)
+        self._interval = 1.0 / rate
+        self._tolerance = (self.burst - 1) * self._interval
+        self._slots: Deque[float] = deque()  # 已预约令牌的放行时间（time.monotonic()）
+        self._fetching: Optional[asyncio.Future] = None  # 正在进行的批量预约（并发等待者共享）
+        self._fallback = TokenBucketRateLimiter(rate, burst)
+
+    @property
+    def tokens(self) -> float:
+        """本地已预约、当前即可使用的令牌数"""
+        now = time.monotonic()
+        return float(sum(1 for slot in self._slots if slot <= now))
+
+    async def _lease(self, count: int, max_wait: float) -> bool:
+        """向 Redis 预约 count 个令牌，放行时间追加到本地队列"""
+        ok, offset = await gcra_reserve(self.key, self._interval, self._tolerance, count, max_wait)
+        if not ok:
+            return False
+        start = time.monotonic() + offset
+        self._slots.extend(start + k * self._interval for k in range(count))
+        return True
+
+    async def _next_slot(self) -> float:
+        if self.lease_size == 1:
+            ok, offset = await gcra_reserve(self.key, self._interval, self._tolerance, 1, _NO_WAIT_LIMIT)
+            return time.monotonic() + offset
+        while not self._slots:
+            if self._fetching is None:
+                self._fetching = asyncio.ensure_future(self._lease(self.lease_size, _NO_WAIT_LIMIT))
+            fetching = self._fetching
+            try:
+                await asyncio.shield(fetching)
+            finally:
+                if self._fetching is fetching and fetching.done():
+                    self._fetching = None
+        return self._slots.popleft()
+
+    @staticmethod
+    async def _sleep_until(slot: float) -> None:
+        delay = slot - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
 
     async def acquire(self):
+        """获取一个令牌，等待到预约的放行时间"""
+        if not runtime.redis_client:
+            await self._fallback.acquire()
+            return
+        try:
+            slot = await self._next_slot()
+        except (RedisError, OSError) as e:
+            log.error("Redis限速失败，回退到本进程限速", key=self.key, error=e, rate_limit=5)
+            await self._fallback.acquire()
+            return
+        await self._sleep_until(slot)
+
+    async def try_acquire(self, deadline: Optional[float] = None) -> bool:
+        """
+        在截止时间之前获取一个令牌（time.monotonic() 时间，None 表示只在可以立即获取时获取）
         """
-        获取一个令牌，如果没有令牌则等待
-        """
-        async with self._lock:
-            now = time.monotonic()
-            elapsed = now - self.last_refill
-            
-            # 补充令牌
-            self.tokens = min(self.rate, self.tokens + elapsed * self.rate)
-            self.last_refill = now
-            
-            if self.tokens >= 1:
-                self.tokens -= 1
-                return
-            
-            # 等待直到有令牌
-            wait_time = (1 - self.tokens) / self.rate
-            await asyncio.sleep(wait_time)
-            self.tokens = 0
+        if not runtime.redis_client:
+            return await self._fallback.try_acquire(deadline)
+        now = time.monotonic()
+        deadline = now if deadline is None else deadline
+        if self._slots:
+            if self._slots[0] > deadline:
+                return False
+        else:
+            try:
+                # 单独预约一个令牌：Redis 按截止时间判断，超出则不占用
+                if not await self._lease(1, deadline - now):
+                    return False
+            except (RedisError, OSError) as e:
+                log.error("Redis限速失败，回退到本进程限速", key=self.key, error=e, rate_limit=5)
+                return await self._fallback.try_acquire(deadline)
+        await self._sleep_until(self._slots.popleft())
+        return True
+
+
+def create_rate_limiter(name: str, rate: int):
+    """按 B_RATE_LIMIT_BACKEND 创建限速器：redis=所有进程共享，local=本进程"""
+    if settings.b_rate_limit_backend == "redis":
+        return RedisRateLimiter(name, rate, lease_size=settings.b_rate_lease_size)
+    return TokenBucketRateLimiter(rate)
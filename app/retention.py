@@ -0,0 +1,180 @@
+"""
+数据保留（过期清理）模块
+统一管理 user_decrypt_log / server_key_relation 的过期数据清理
+
+两种模式：
+1. 分区模式：表已按天做 RANGE 分区（见 sql/retention_partitions.sql）时，
+   直接 DROP 过期分区并预建未来分区，成本 O(1)，不锁业务行
+2. 分批删除模式（兜底）：按 decrypt_time 索引分批 DELETE ... LIMIT，
+   每批独立提交并短暂停顿，避免长事务锁表、占满连接池
+"""
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, date, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+from .config import settings
+from .db import AsyncSessionLocal
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    单张表的保留策略
+
+    Attributes:
+        table: 表名
+        column: 时间列（按该列判断过期，也是分区键）
+        keep_days: 保留天数
+    """
+    table: str
+    column: str
+    keep_days: int
+
+
+# 需要定期清理的表（表名/列名为常量，可安全拼接到SQL中）
+RETENTION_POLICIES: List[RetentionPolicy] = [
+    RetentionPolicy(table="server_key_relation", column="decrypt_time", keep_days=30),
+    RetentionPolicy(table="user_decrypt_log", column="decrypt_time", keep_days=3),
+]
+
+# 兜底分区名，存放超出预建范围的数据
+FUTURE_PARTITION = "p_future"
+
+
+def _to_days(d: date) -> int:
+    """与 MySQL TO_DAYS() 一致的天数（TO_DAYS('0001-01-01') = 366）"""
+    return d.toordinal() + 365
+
+
+def _partition_name(d: date) -> str:
+    """按天分区命名：p20260101 存放 2026-01-01 当天的数据"""
+    return f"p{d:%Y%m%d}"
+
+
+async def _list_partitions(table: str) -> List[Tuple[str, str]]:
+    """
+    查询表的分区列表
+
+    Returns:
+        [(分区名, 分区上界描述)]，未分区的表返回空列表
+    """
+    async with AsyncSessionLocal() as db_session:
+        rows = (await db_session.execute(
+            text(
+                "SELECT PARTITION_NAME, PARTITION_DESCRIPTION "
+                "FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+                "AND PARTITION_NAME IS NOT NULL "
+                "ORDER BY PARTITION_ORDINAL_POSITION"
+            ),
+            {"table": table},
+        )).fetchall()
+    return [(row[0], row[1]) for row in rows]
+
+
+async def _rotate_partitions(policy: RetentionPolicy, partitions: List[Tuple[str, str]]) -> None:
+    """
+    分区模式：删除过期分区，并预建未来几天的分区
+    """
+    today = datetime.now().date()
+    threshold_days = _to_days(today - timedelta(days=policy.keep_days))
+
+    # 1. 删除上界不超过阈值的分区（整块数据都已过期；迁移时建立的 p_history 同样按上界判断）
+    expired = [
+        name for name, desc in partitions
+        if name != FUTURE_PARTITION and desc.isdigit() and int(desc) <= threshold_days
+    ]
+
+    # 2. 预建今天起 N 天的分区（从 p_future 中拆分出来）
+    existing = {name for name, _ in partitions}
+    missing = [
+        today + timedelta(days=i)
+        for i in range(settings.retention_precreate_days + 1)
+        if _partition_name(today + timedelta(days=i)) not in existing
+    ]
+
+    async with AsyncSessionLocal() as db_session:
+        if expired:
+            await db_session.execute(text(
+                f"ALTER TABLE {policy.table} DROP PARTITION {', '.join(expired)}"
+            ))
+            print(f"[数据保留] {policy.table} 已删除过期分区: {', '.join(expired)}")
+
+        if missing and FUTURE_PARTITION in existing:
+            new_parts = ", ".join(
+                f"PARTITION {_partition_name(d)} VALUES LESS THAN ({_to_days(d + timedelta(days=1))})"
+                for d in missing
+            )
+            await db_session.execute(text(
+                f"ALTER TABLE {policy.table} REORGANIZE PARTITION {FUTURE_PARTITION} INTO "
+                f"({new_parts}, PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+            ))
+            print(f"[数据保留] {policy.table} 已预建分区: {', '.join(_partition_name(d) for d in missing)}")
+        await db_session.commit()
+
+
+async def _batched_delete(policy: RetentionPolicy) -> int:
+    """
+    分批删除模式：按时间索引每次删除一小批，批次之间让出连接
+
+    Returns:
+        删除的总行数
+    """
+    threshold = datetime.now() - timedelta(days=policy.keep_days)
+    batch_size = settings.retention_batch_size
+    stmt = text(
+        f"DELETE FROM {policy.table} WHERE {policy.column} < :threshold "
+        f"ORDER BY {policy.column} LIMIT :batch_size"
+    )
+
+    total = 0
+    while True:
+        # 每批使用独立会话和事务，删除完立刻归还连接
+        async with AsyncSessionLocal() as db_session:
+            result = await db_session.execute(stmt, {"threshold": threshold, "batch_size": batch_size})
+            await db_session.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+        # 批次之间暂停，给业务流量让路
+        await asyncio.sleep(settings.retention_batch_pause)
+
+
+async def apply_retention(policy: RetentionPolicy) -> None:
+    """
+    对单张表执行一次保留策略（自动选择分区模式或分批删除模式）
+    """
+    partitions = []
+    if settings.retention_mode != "batch":
+        partitions = await _list_partitions(policy.table)
+
+    if partitions:
+        await _rotate_partitions(policy, partitions)
+    else:
+        deleted = await _batched_delete(policy)
+        print(f"[数据保留] {policy.table} 分批删除 {policy.keep_days} 天前数据 {deleted} 行")
+
+
+async def daily_retention_task():
+    """
+    每天凌晨前1秒对所有表执行一次保留策略
+    """
+    while True:
+        now = datetime.now()
+        # 计算距离明天凌晨0点0分0秒还有多少秒，提前1秒
+        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        sleep_seconds = max(0, (tomorrow - now).total_seconds() - 1)
+        print(f"[数据保留] 距离下次清理还有 {sleep_seconds} 秒")
+        await asyncio.sleep(sleep_seconds)
+
+        for policy in RETENTION_POLICIES:
+            try:
+                await apply_retention(policy)
+            except Exception as e:
+                print(f"[数据保留] 清理 {policy.table} 失败: {e}")
+
+        # 等待1秒，确保不会重复清理
+        await asyncio.sleep(1)
@@ -0,0 +1,60 @@
+import secrets
+
+# 导入FastAPI相关依赖
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+
+from ..config import settings
+from ..tracing import slow_requests
+from ..quota import reset_quota
+from ..token_auth import revoke_token, revoke_user_tokens
+from ..user_cache import invalidate_user
+
+
+def require_admin(admin_token: str = Query(..., description="管理员token（ADMIN_TOKEN）")) -> None:
+    """校验管理员token（常量时间比较）"""
+    if not secrets.compare_digest(admin_token, settings.admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
+
+
+# 创建API路由器，前缀为/api/admin，所有接口都需要管理员token
+router = APIRouter(prefix="/api/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/slow_requests")
+async def get_slow_requests():
+    """最近每分钟最慢的解密请求及其各阶段耗时（毫秒）"""
+    return {
+        "top_n": slow_requests.top_n,
+        "minutes": slow_requests.snapshot(),
+    }
+
+
+@router.post("/users/invalidate")
+async def invalidate_all_users():
+    """清空所有进程的用户缓存（批量修改用户后调用）"""
+    await invalidate_user()
+    return {"invalidated": "*"}
+
+
+@router.post("/users/{username}/invalidate")
+async def invalidate_one_user(username: str):
+    """管理员修改用户（状态、优先级、配额等）后调用：所有进程删除该用户的缓存，
+    已用次数计数写回数据库后删除，下次扣费从数据库重新初始化"""
+    await reset_quota(username)
+    await invalidate_user(username)
+    return {"invalidated": username}
+
+
+@router.post("/users/{username}/revoke_tokens")
+async def revoke_tokens(username: str):
+    """吊销该用户已签发的全部登录token（修改密码、禁用账号后调用）"""
+    await revoke_user_tokens(username)
+    return {"revoked": username}
+
+
+@router.post("/tokens/revoke")
+async def revoke_one_token(token: str = Query(..., description="要吊销的登录token")):
+    """吊销单个登录token（token泄露时调用，该用户的其他token不受影响，下次登录签发新token）"""
+    if not await revoke_token(token):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired token")
+    return {"revoked": True}
@@ -1,24 +1,16 @@
 # 导入用于生成唯一任务ID的uuid库
 import uuid
-# 导入用于可逆解密的AES库
-import base64
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
 # 导入用于异步操作的asyncio
 import asyncio
-import json
+import math
 import time
-import secrets
-import hashlib
 from typing import Optional
-from datetime import datetime, timedelta
-# 导入JWT库
-import jwt
+from datetime import datetime
 
-from ..db import AsyncSessionLocal
+from ..db import AsyncSessionLocal, execute_read
 from ..models import ServerStats, UserDecryptLog, SysUser # 确保已导入 ServerStats
 # 导入FastAPI相关依赖
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
 from fastapi.responses import Response
 # 导入SQLAlchemy用于数据库操作的select
 from sqlalchemy import select, update
@@ -30,7 +22,21 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from ..db import get_db
 from ..models import SysUser
 from ..schemas import SubmitResponse, QuickSubmitRequest, OptimizedSubmitResponse, LoginResponse
-from ..task_service import push_task_to_queue
+from ..task_service import push_task_to_queue, mark_task_abandoned, task_state_key
+from .. import quota
+from ..ttl_cache import TTLCache
+from ..user_cache import CachedUser, get_cached_user, peek_cached_user
+from ..ingress_limit import check_auth_rate, check_user_rate, record_auth_failure
+from ..credentials import AUTH_OK, authenticate
+from ..token_auth import (
+    TOKEN_EXPIRE_SECONDS,
+    TOKEN_KEY_PREFIX,
+    mint_token,
+    issue_login_token,
+    decode_token,
+    token_username,
+    is_revoked,
+)
 from ..config import settings
 from ..packet_parser import parse_packet
 from ..load_balancer import (
@@ -41,75 +47,38 @@ from ..load_balancer import (
     remove_from_processing,
     get_server
 )
-from ..worker import decrypt_with_retry, get_valid_token_for_server
-
-
-# Token过期时间：48小时（秒）
-TOKEN_EXPIRE_SECONDS = 48 * 60 * 60
-
-# JWT密钥（用于签名token），从配置中加载
-JWT_SECRET_KEY = settings.jwt_secret_key
-JWT_ALGORITHM = "HS256"
-JWT_ISSUER = "ApiStore"
-JWT_AUDIENCE = "ApiStore"
-
-
-def decrypt_password(ciphertext_b64: str) -> str | None:
-    try:
-        key = settings.aes_key.encode("utf-8")
-        iv = settings.aes_iv.encode("utf-8")
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        plaintext = unpad(cipher.decrypt(base64.b64decode(ciphertext_b64)), AES.block_size)
-        return plaintext.decode("utf-8")
-    except Exception:
-        return None
+from ..worker import decrypt_with_retry, decrypt_passthrough, get_valid_token_for_server
 from .. import runtime
+from .. import codec
+from ..logger import get_logger
+from ..metrics import REQUESTS, REQUESTS_BY_PRIORITY, RATE_LIMITED, STAGE_SECONDS, priority_band
+from ..tracing import span, current_trace
 
 
 # 创建API路由器，前缀为/api，标签为tasks
 router = APIRouter(prefix="/api", tags=["tasks"])
+log = get_logger(__name__)
 
 
-async def _charge_user(username: str) -> tuple[bool, int]:
-    """异步扣费，使用原子操作防止超额
+async def _charge_user(username: str, total_requests: int) -> tuple[bool, int]:
+    """扣费一次：Redis原子计数完成配额检查，不锁数据库行（用量由后台任务写回）
     
     Returns:
-        (bool, int): (扣费是否成功, 扣费后的remaining_requests)
+        (bool, int): (扣费是否成功, 扣费后的已用次数)
     """
     try:
-        async with AsyncSessionLocal() as charge_db:
-            # 原子操作：只有在剩余次数>0时才扣费（防止并发超额）
-            result = await charge_db.execute(
-                update(SysUser)
-                .where(
-                    SysUser.user_name == username,
-                    # total_requests=-1表示无限制，跳过检查
-                    # 否则必须满足：remaining_requests < total_requests
-                    (SysUser.total_requests == -1) | (SysUser.remaining_requests < SysUser.total_requests)
-                )
-                .values(remaining_requests=SysUser.remaining_requests + 1)
-            )
-            await charge_db.commit()
-            
-            # 检查是否有行被更新（0表示余额不足，扣费失败）
-            if result.rowcount > 0:
-                # 查询更新后的值
-                res = await charge_db.execute(
-                    select(SysUser.remaining_requests).where(SysUser.user_name == username)
-                )
-                new_remaining = res.scalar_one_or_none()
-                return (True, new_remaining or 0)
-            return (False, -1)
+        used = await quota.charge(username, total_requests)
+        return (used >= 0, used)
     except Exception as e:
-        print(f"  扣费失败: {e}")
+        log.error("扣费失败", username=username, error=e, rate_limit=1)
         return (False, -1)
 
 
 async def generate_user_token(username: str) -> str:
-    """为用户生成JWT格式的token并存储到Redis
+    """为用户签发新的JWT格式token并存储到Redis
     
     生成固定长度355字符的JWT token，包含用户名、角色、过期时间等信息。
-    Token绑定用户名，且每次生成都是唯一的。
+    Token绑定用户名，且每次生成都是唯一的。登录接口使用 issue_login_token 复用当前token。
     
     Args:
         username: 用户名
@@ -117,33 +86,12 @@ async def generate_user_token(username: str) -> str:
     Returns:
         生成的JWT token字符串（固定355字符）
     """
-    # 计算过期时间
-    exp_time = datetime.utcnow() + timedelta(seconds=TOKEN_EXPIRE_SECONDS)
-    exp_timestamp = int(exp_time.timestamp())
-    
-    # 生成唯一标识（5字符，确保同一用户多次登录生成不同token）
-    unique_id = hashlib.md5(f"{username}:{time.time()}:{secrets.token_hex(4)}".encode()).hexdigest()[:5]
-    
-    # 用户名填充到固定8字符（确保token长度固定为355字符）
-    padded_username = username.ljust(8)[:8]
-    
-    # 构建JWT payload（模拟.NET风格的claims）
-    payload = {
-        "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/name": padded_username,
-        "http://schemas.microsoft.com/ws/2008/06/identity/claims/role": "0",
-        "exp": exp_timestamp,
-        "iss": JWT_ISSUER,
-        "aud": JWT_AUDIENCE,
-        "jti": unique_id,  # JWT ID，确保唯一性
-    }
-    
-    # 生成JWT token（固定355字符）
-    token = jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+    token = mint_token(username)
     
     # 存储到Redis，key为 user_token:{token}，value为原始用户名
     if runtime.redis_client:
         await runtime.redis_client.setex(
-            f"user_token:{token}",
+            f"{TOKEN_KEY_PREFIX}{token}",
             TOKEN_EXPIRE_SECONDS,
             username  # 存储原始用户名（不含填充）
         )
@@ -151,48 +99,73 @@ async def generate_user_token(username: str) -> str:
     return token
 
 
-# 内存缓存：token -> (username, expire_time)，避免每次都查Redis
-_token_cache: dict = {}
-# ⚠️ 不缓存用户对象，配额信息(remaining/total_requests)需要实时准确
+# 内存缓存：token -> username，避免每次都查Redis（有界，超出容量按LRU淘汰）
+_token_cache = TTLCache("token", maxsize=settings.token_cache_size, ttl=settings.token_cache_ttl)
+
+
+def _build_json_response(result, pretty: bool = True) -> Response:
+    """
+    返回解密结果
 
+    pretty=True 时以 text/plain 格式返回（带缩进，与截图一致），
+    否则直接返回紧凑的 application/json
+    """
+    if not pretty:
+        if isinstance(result, str):
+            return Response(content=result, media_type="application/json; charset=utf-8")
+        return Response(content=codec.dumps_bytes(result), media_type="application/json; charset=utf-8")
 
-def _build_json_response(result) -> Response:
-    """将解密结果以 text/plain 格式返回（带缩进，与截图一致）"""
     if isinstance(result, (dict, list)):
-        content = json.dumps(result, indent=2, ensure_ascii=False)
+        content = codec.dumps_pretty(result)
     elif isinstance(result, str):
         # 尝试解析，确保是合法JSON
         try:
-            parsed = json.loads(result)
-            content = json.dumps(parsed, indent=2, ensure_ascii=False)
-        except json.JSONDecodeError:
+            parsed = codec.loads(result)
+            content = codec.dumps_pretty(parsed)
+        except codec.JSONDecodeError:
             content = result  # 原样返回
     else:
-        content = json.dumps(result, indent=2, ensure_ascii=False)
+        content = codec.dumps_pretty(result)
 
     return Response(content=content, media_type="text/plain; charset=utf-8")
 
 
 async def validate_token(token: str) -> Optional[str]:
-    """验证token并返回对应的用户名（带内存缓存）"""
+    """验证token并返回对应的用户名
+    
+    local模式：本地校验签名和声明，检查本地同步的吊销信息，不访问Redis；
+    只有用户名可能被截断时才查Redis取完整用户名
+    redis模式：查 user_token:{token}（带内存缓存）
+    """
+    if settings.token_verify_mode != "local":
+        return await _lookup_token(token)
+    claims = decode_token(token)
+    if claims is None:
+        return None
+    username = token_username(claims)
+    if username is None:
+        username = await _lookup_token(token)
+    if not username or is_revoked(username, claims):
+        return None
+    return username
+
+
+async def _lookup_token(token: str) -> Optional[str]:
+    """查 user_token:{token} 得到完整用户名（带内存缓存）"""
     # 1. 先查内存缓存
-    cached = _token_cache.get(token)
-    if cached:
-        username, expire_ts = cached
-        if time.time() < expire_ts:
-            return username
-        else:
-            del _token_cache[token]  # 过期清理
+    username = _token_cache.get(token)
+    if username:
+        return username
     
     # 2. 缓存未命中，查Redis
     if not runtime.redis_client:
         return None
     
-    username = await runtime.redis_client.get(f"user_token:{token}")
+    username = await runtime.redis_client.get(f"{TOKEN_KEY_PREFIX}{token}")
     if username:
         username = username.decode("utf-8") if isinstance(username, bytes) else username
-        # 缓存到内存（30分钟有效，匹配用户缓存时长）
-        _token_cache[token] = (username, time.time() + 1800)
+        # 缓存到内存（默认30分钟有效）
+        _token_cache.set(token, username)
         return username
     return None
 
@@ -207,17 +180,16 @@ async def get_user(username: str, db: AsyncSession = None) -> Optional[SysUser]:
     Returns:
         用户对象或None
     """
-    # 每次都查数据库，确保配额信息准确（数据库有连接池+索引，性能足够）
+    # 每次都查数据库（未传入会话时优先走只读副本，数据最多落后 REPLICA_MAX_LAG 秒）
     if db is None:
-        async with AsyncSessionLocal() as db:
-            res = await db.execute(select(SysUser).where(SysUser.user_name == username))
-            return res.scalar_one_or_none()
+        res = await execute_read(select(SysUser).where(SysUser.user_name == username))
+        return res.scalar_one_or_none()
     else:
         res = await db.execute(select(SysUser).where(SysUser.user_name == username))
         return res.scalar_one_or_none()
 
 
-async def get_user_orders(user: SysUser) -> list:
+async def get_user_orders(user: CachedUser) -> list:
     """获取用户订单信息（请求次数）
     
     Args:
@@ -226,12 +198,13 @@ async def get_user_orders(user: SysUser) -> list:
     Returns:
         订单列表
     """
+    # 已用次数以Redis计数为准（未初始化时查数据库）
+    used = await quota.current_used(user.user_name)
     # 构建订单信息：显示已使用次数/总次数
     if user.total_requests == -1:
         # 无限制
-        order_detail = f"{user.remaining_requests}/unlimited"
+        order_detail = f"{used}/unlimited"
     else:
-        used = user.remaining_requests
         total = user.total_requests
         order_detail = f"{used}/{total}"
     
@@ -256,11 +229,31 @@ async def wait_for_task_result(task_id: str, max_wait: int = None) -> dict:
     
     start_time = time.time()
     
+    try:
+        return await _poll_task_result(task_id, start_time, max_wait)
+    except (HTTPException, asyncio.CancelledError):
+        # 超时或客户端断开：标记为已放弃，Worker出队时直接丢弃，不再发往服务器
+        await _mark_task_abandoned(task_id)
+        raise
+
+
+async def _mark_task_abandoned(task_id: str) -> None:
+    """标记任务为已放弃（仅当任务仍在排队时）"""
+    if not runtime.redis_client:
+        return
+    try:
+        await mark_task_abandoned(task_id)
+    except Exception as e:
+        log.error("标记任务为已放弃失败", task_id=task_id, error=e, rate_limit=1)
+
+
+async def _poll_task_result(task_id: str, start_time: float, max_wait: int) -> dict:
+    """轮询Redis中的任务状态，直到完成、失败或超时"""
     while True:
         # 检查是否超时
         elapsed = time.time() - start_time
         if elapsed >= max_wait:
-            print(f" Task {task_id} wait timeout after {elapsed:.1f}s")
+            log.warning("等待任务结果超时", task_id=task_id, elapsed=round(elapsed, 1), rate_limit=5)
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="Server busy, please retry later",
@@ -268,27 +261,32 @@ async def wait_for_task_result(task_id: str, max_wait: int = None) -> dict:
         
         # 从Redis获取任务状态
         if runtime.redis_client:
-            result = await runtime.redis_client.get(f"task:{task_id}")
+            data = await runtime.redis_client.hgetall(task_state_key(task_id))
             
             # key 不存在 = 已超时自动过期，返回服务器繁忙
-            if result is None:
-                print(f" Redis key expired for task: {task_id}")
+            if not data:
+                log.warning("任务状态已过期", task_id=task_id, rate_limit=5)
                 raise HTTPException(
                     status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                     detail="Server busy, please retry later",
                 )
             
-            data = json.loads(result)# 解析任务结果JSON
             task_status = data.get("status")
 
+            # 结果只会被等待方读取一次，读取后立即删除，不再占用内存到TTL过期
+            if task_status in ("completed", "failed"):
+                await runtime.redis_client.delete(task_state_key(task_id))
+
             if task_status == "completed":
+                data["data"] = codec.loads(data.get("data", "{}"))  # 解析服务器响应JSON
+                data["spans"] = codec.loads(data.get("spans", "[]"))  # Worker记录的阶段耗时
                 return data
             
             # 任务处理失败
             if task_status == "failed":
                 error_msg = data.get("error", "Task processing failed")
                 # 打印完整错误到日志
-                print(f" Task {task_id} failed: {error_msg}")
+                log.warning("任务处理失败", task_id=task_id, error=error_msg)
                 # 返回通用错误给客户端，隐藏服务器详情
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -299,12 +297,41 @@ async def wait_for_task_result(task_id: str, max_wait: int = None) -> dict:
         await asyncio.sleep(0.05)
 
 
+def _raise_rate_limited(retry_after: float) -> None:
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def _enforce_user_rate(username: str, priority: Optional[int] = None) -> None:
+    """
+    已认证用户的请求频率超限时返回429
+    未传入优先级时取自本地用户缓存（token请求在查库之前检查），未缓存时按最低档
+    """
+    if priority is None:
+        cached = peek_cached_user(username)
+        priority = cached.priority if cached else None
+    retry_after = await check_user_rate(username, priority)
+    if retry_after > 0:
+        RATE_LIMITED.inc(priority_band(priority))
+        _raise_rate_limited(retry_after)
+
+
+async def _enforce_auth_rate(username: str, client: str) -> None:
+    """(用户名, 客户端IP) 的认证失败额度已用尽时返回429（不影响该用户其他来源和token的请求）"""
+    retry_after = await check_auth_rate(username, client)
+    if retry_after > 0:
+        RATE_LIMITED.inc("auth")
+        _raise_rate_limited(retry_after)
+
+
 # ==================== 登录接口 ====================
 @router.get("/login", response_model=LoginResponse)
 async def login(
     username: str = Query(..., description="用户名"),#从query参数获取用户名
     password: str = Query(..., description="密码"),#从query参数获取密码
-    db: AsyncSession = Depends(get_db)
 ):
     """登录接口：验证用户名密码，返回token
     
@@ -316,10 +343,10 @@ async def login(
         成功: {"success": true, "msg": "", "data": {"token": "xxx", "orders": ["用户名: 已用次数/总次数"]}}
         失败: {"success": false, "msg": "错误信息", "data": null}
     """
-    # 校验用户身份：根据用户名查找用户（去除首尾空格）
+    # 校验用户身份：根据用户名查找用户（去除首尾空格），校验结果短期缓存
+    # （查询到的用户同时写入用户缓存，随后的token请求直接命中）
     username = username.strip() if username else ""
-    res = await db.execute(select(SysUser).where(SysUser.user_name == username))
-    user: SysUser | None = res.scalar_one_or_none()
+    user, auth_result = await authenticate(username, password)
     
     # 检查用户是否存在且状态正常
     if not user or user.status != "0":
@@ -330,16 +357,15 @@ async def login(
         )
     
     # 校验密码是否正确（AES/CBC/PKCS5 Base64）
-    decrypted = decrypt_password(user.password)
-    if not decrypted or decrypted != password:
+    if auth_result != AUTH_OK:
         return LoginResponse(
             success=False,
             msg="Invalid password",
             data=None
         )
     
-    # 生成token
-    token = await generate_user_token(username)
+    # 获取token：剩余有效期足够时复用当前token，同一用户反复登录不会产生大量token
+    token = await issue_login_token(username)
     
     # 获取订单信息
     orders = await get_user_orders(user)
@@ -357,10 +383,12 @@ async def login(
 # ==================== 解密接口（支持两种认证方式） ====================
 @router.get("/yd/decryptl")
 async def quick_submit(
+    request: Request,
     hex: str = Query(..., description="16进制数据"),
     username: Optional[str] = Query(None, description="用户名（方式一）"),
     password: Optional[str] = Query(None, description="密码（方式一）"),
-    token: Optional[str] = Query(None, description="登录token（方式二）")
+    token: Optional[str] = Query(None, description="登录token（方式二）"),
+    pretty: bool = Query(False, description="按旧格式返回带缩进的结果"),
 ):
     """解密接口：支持两种认证方式
     
@@ -369,47 +397,58 @@ async def quick_submit(
     
     方式二：token + hex（token从登录接口获取，24小时有效，性能更优）
         http://localhost:5000/api/yd/decryptl?token=xxx&hex=xxx
+
+    返回格式：默认透传服务器响应（紧凑JSON），pretty=1 或 RESPONSE_PRETTY=1 时返回带缩进的 text/plain
     """
-    user: SysUser | None = None
+    pretty = pretty or settings.response_pretty
+    user: CachedUser | None = None
     
     # ========== 认证逻辑 ==========
+    stage_start = time.perf_counter()
     # 方式二：token认证（优先检查，token缓存避免查Redis）
     if token:
-        validated_username = await validate_token(token)
+        with span("token"):
+            validated_username = await validate_token(token)
         if not validated_username:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, 
                 detail="Invalid or expired token"
             )
-        # 实时查询用户信息（确保配额准确，数据库连接池性能足够）
-        user = await get_user(validated_username)
+        await _enforce_user_rate(validated_username)
+        # 用户信息走本地缓存（管理员修改用户时失效），稳态下不查数据库
+        with span("db_user"):
+            user = await get_cached_user(validated_username)
         if not user or user.status != "0":
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, 
                 detail="User not found or account disabled"
             )
     
-    # 方式一：用户名+密码认证（需要数据库查询）
+    # 方式一：用户名+密码认证（近期校验过的账号密码不再查库和解密）
     elif username and password:
-        # 获取数据库连接
-        async with AsyncSessionLocal() as db:
-            # 校验用户身份：根据用户名查找用户（去除首尾空格）
-            username = username.strip()
-            res = await db.execute(select(SysUser).where(SysUser.user_name == username))
-            user = res.scalar_one_or_none()
-            # 检查用户是否存在且状态正常
-            if not user or user.status != "0":
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED, 
-                    detail="User not found or account disabled"
-                )
-            # 校验密码是否正确（AES/CBC/PKCS5 Base64）
-            decrypted = decrypt_password(user.password)
-            if not decrypted or decrypted != password:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED, 
-                    detail="Invalid password"
-                )
+        # 校验用户身份：根据用户名查找用户（去除首尾空格）
+        username = username.strip()
+        # 校验失败只计入 (用户名, 客户端IP) 的认证失败额度，错误密码不会消耗该用户的额度；
+        # 校验通过的请求不消耗认证失败额度，只受用户额度限制
+        client_ip = request.client.host if request.client else ""
+        await _enforce_auth_rate(username, client_ip)
+        with span("db_user"):
+            user, auth_result = await authenticate(username, password)
+        if auth_result != AUTH_OK:
+            await record_auth_failure(username, client_ip)
+        # 检查用户是否存在且状态正常
+        if not user or user.status != "0":
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, 
+                detail="User not found or account disabled"
+            )
+        # 校验密码是否正确（AES/CBC/PKCS5 Base64）
+        if auth_result != AUTH_OK:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, 
+                detail="Invalid password"
+            )
+        await _enforce_user_rate(username, user.priority)
     
     else:
         # 既没有token也没有username+password
@@ -417,10 +456,19 @@ async def quick_submit(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Authentication required: username+password or token"
         )
+    STAGE_SECONDS.observe(time.perf_counter() - stage_start, "auth")
     
     # ========== 解析数据包 ==========
     try:
+        stage_start = time.perf_counter()
         packet_info = parse_packet(hex)
+        STAGE_SECONDS.observe(time.perf_counter() - stage_start, "parse")
+        REQUESTS.inc(packet_info['packet_type'])
+        REQUESTS_BY_PRIORITY.inc(priority_band(user.priority))
+        trace = current_trace()
+        if trace is not None:
+            trace.meta["username"] = user.user_name
+            trace.meta["packet_type"] = packet_info['packet_type']
         # 检查是否为有效数据包
         if not packet_info['is_valid']:
             raise HTTPException(
@@ -434,44 +482,36 @@ async def quick_submit(
         is_key_packet = packet_info['is_key_packet']
         drone_id = packet_info['drone_id']  # hash_code，8位hex字符串
         
-        if is_key_packet:
-            print(f" 数据包解析: 类型={packet_type}, 无人机ID={drone_id}, 密钥包=是")
-        
-        # ========== 请求次数检查（实时查询+同步扣费）==========
-        # 重新查询数据库获取最新配额（管理员可能随时修改）
-        fresh_user = await get_user(user.user_name)
-        if fresh_user:
-            user = fresh_user  # 使用最新的用户信息
+        log.debug("数据包解析", packet_type=packet_type, drone_id=drone_id, is_key_packet=is_key_packet)
         
+        # ========== 请求次数检查（同步扣费）==========
+        # 已用次数不缓存：扣费的原子更新同时完成配额检查，不再单独查询最新配额
+        stage_start = time.perf_counter()
         if user.total_requests is not None and user.total_requests != -1:
-            # 预检：已用次数达到或超过总配额时拒绝
-            if user.remaining_requests >= user.total_requests:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Request quota exceeded"
-                )
-            
             # 同步扣费：使用原子操作确保不会超过total_requests
-            charge_success, _ = await _charge_user(user.user_name)
+            with span("charge"):
+                charge_success, _ = await _charge_user(user.user_name, user.total_requests)
             if not charge_success:
                 # 扣费失败说明配额已用完（可能是并发请求导致）
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="Request quota exceeded"
                 )
+        STAGE_SECONDS.observe(time.perf_counter() - stage_start, "quota")
         
         # ========== 负载均衡处理 ==========
         server_idx = 0  # 默认服务器索引
         max_wait_attempts = 36  # 最多等待36秒
         if is_key_packet:
             # 密钥包：检查是否已存在或正在处理
-            lb_result = await handle_key_packet(drone_id)
+            with span("lb"):
+                lb_result = await handle_key_packet(drone_id)
             action = lb_result.get("action")
             
             if action == "key_exist":
                 # 密钥已存在，直接返回 key_exist 和 sn
                 sn = lb_result.get("sn", "")
-                print(f" 密钥已存在: drone_id={drone_id}, sn={sn}")
+                log.debug("密钥已存在", drone_id=drone_id, sn=sn)
                 return {
                     "msg": "key_exist",
                     "sn": sn
@@ -479,7 +519,7 @@ async def quick_submit(
             
             elif action == "key_gen_busy":
                 # 正在处理中
-                print(f" 密钥正在处理队列中: drone_id={drone_id}")
+                log.debug("密钥正在处理队列中", drone_id=drone_id)
                 return {
                     "msg": "key_gen_busy",
                     "note": "The key package is in queue"
@@ -487,39 +527,40 @@ async def quick_submit(
             
             elif action == "all_servers_busy":
                 # 所有服务器繁忙，等待重试
-                print(f"  所有服务器繁忙，开始等待...")
-                for attempt in range(max_wait_attempts):
-                    await asyncio.sleep(1)
-                    lb_result = await handle_key_packet(drone_id)
-                    action = lb_result.get("action")
+                log.info("所有服务器繁忙，开始等待", drone_id=drone_id, rate_limit=1)
+                with span("busy_wait"):
+                    for attempt in range(max_wait_attempts):
+                        await asyncio.sleep(1)
+                        lb_result = await handle_key_packet(drone_id)
+                        action = lb_result.get("action")
                     
-                    if action == "key_exist":
-                        sn = lb_result.get("sn", "")
-                        print(f" 等待期间密钥已存在: drone_id={drone_id}")
-                        return {"msg": "key_exist", "sn": sn}
+                        if action == "key_exist":
+                            sn = lb_result.get("sn", "")
+                            log.debug("等待期间密钥已存在", drone_id=drone_id)
+                            return {"msg": "key_exist", "sn": sn}
                     
-                    elif action == "dispatch":
-                        server_idx = lb_result.get("server_idx", 0)
-                        print(f" 等待 {attempt + 1}s 后获得空闲服务器 {server_idx}")
-                        break
+                        elif action == "dispatch":
+                            server_idx = lb_result.get("server_idx", 0)
+                            log.debug("等待后获得空闲服务器", drone_id=drone_id, server=server_idx, waited=attempt + 1)
+                            break
                     
-                    elif action == "key_gen_busy":
-                        print(f" 密钥已在处理中: drone_id={drone_id}")
-                        return {"msg": "key_gen_busy", "note": "waiting 36s and try again."}
+                        elif action == "key_gen_busy":
+                            log.debug("密钥已在处理中", drone_id=drone_id)
+                            return {"msg": "key_gen_busy", "note": "waiting 36s and try again."}
                     
-                    print(f"⏳ 等待空闲服务器... ({attempt + 1}/{max_wait_attempts}s)")
-                else:
-                    # 等待超时，仍然全忙
-                    print(f" 等待 {max_wait_attempts}s 后仍无空闲服务器")
-                    raise HTTPException(
-                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                        detail="All servers busy, please retry later"
-                    )
+                        log.debug("等待空闲服务器", drone_id=drone_id, waited=attempt + 1, max_wait=max_wait_attempts)
+                    else:
+                        # 等待超时，仍然全忙
+                        log.warning("等待后仍无空闲服务器", drone_id=drone_id, waited=max_wait_attempts, rate_limit=1)
+                        raise HTTPException(
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="All servers busy, please retry later"
+                        )
             
             elif action == "dispatch":
                 # 分发到指定服务器
                 server_idx = lb_result.get("server_idx", 0)
-                print(f" 密钥包分发到服务器 {server_idx}: drone_id={drone_id}")
+                log.debug("密钥包分发到服务器", drone_id=drone_id, server=server_idx)
         
         else:
             # ========== 数据包：直接调用解密服务器，不走队列 ==========
@@ -539,44 +580,48 @@ async def quick_submit(
                     if not target_server:
                         raise Exception(f"服务器 {server_idx} 不存在")
                     
-                    # 《=========================== 更新数据库lastRequestTime ============================》
-                    # 数据包不排队，直接发往服务器之前更新最后请求时间
-                    try:
-                        async with AsyncSessionLocal() as update_db:
-                            result_update = await update_db.execute(
-                                update(SysUser)
-                                .where(SysUser.user_name == user.user_name)
-                                .values(lastRequestTime=datetime.now())
+                    with span("db_stats"):
+                        # 《=========================== 更新数据库lastRequestTime ============================》
+                        # 数据包不排队，直接发往服务器之前更新最后请求时间
+                        try:
+                            async with AsyncSessionLocal() as update_db:
+                                result_update = await update_db.execute(
+                                    update(SysUser)
+                                    .where(SysUser.user_name == user.user_name)
+                                    .values(lastRequestTime=datetime.now())
+                                )
+                                await update_db.commit()
+                                # 检查是否更新成功
+                                if result_update.rowcount == 0:
+                                    log.warning("用户不存在，无法更新lastRequestTime", username=user.user_name)
+                        except Exception as db_error:
+                            # 数据库更新失败不应该影响主业务流程，只记录日志
+                            log.error("更新lastRequestTime失败", error=db_error, rate_limit=1)
+                        # 《=========================== 更新服务器请求总数 ============================》
+                        try:
+                            result_server_update = await update_db.execute(
+                                update(ServerStats)
+                                .where(ServerStats.id == server_idx)
+                                .values(request_total=ServerStats.request_total + 1)
                             )
+                            # 新增：插入用户解密日志
+                            update_db.add(UserDecryptLog(user_id=user.user_id, decrypt_time=datetime.now()))
                             await update_db.commit()
-                            # 检查是否更新成功
-                            if result_update.rowcount == 0:
-                                print(f"警告：用户 {user.user_name} 不存在，无法更新lastRequestTime")
-                    except Exception as db_error:
-                        # 数据库更新失败不应该影响主业务流程，只记录日志
-                        print(f"更新lastRequestTime失败: {db_error}")
-                    # 《=========================== 更新服务器请求总数 ============================》
-                    try:
-                        result_server_update = await update_db.execute(
-                            update(ServerStats)
-                            .where(ServerStats.id == server_idx)
-                            .values(request_total=ServerStats.request_total + 1)
-                        )
-                        # 新增：插入用户解密日志
-                        update_db.add(UserDecryptLog(user_id=user.user_id, decrypt_time=datetime.now()))
-                        await update_db.commit()
-
-                        if result_server_update.rowcount == 0:
-                            print(f"警告：服务器 {server_idx} 不存在，无法更新 request_total")
-                    except Exception as server_db_error:
-                        print(f"更新服务器 request_total 失败: {server_db_error}")
-                    # 直接调用解密服务器
-                    result = await decrypt_with_retry(raw_hex, target_server)
-                    # 直接返回解密结果（零延迟，扣费已在前面统一处理）
-                    return _build_json_response(result)
+
+                            if result_server_update.rowcount == 0:
+                                log.warning("服务器不存在，无法更新 request_total", server=server_idx)
+                        except Exception as server_db_error:
+                            log.error("更新服务器 request_total 失败", error=server_db_error, rate_limit=1)
+                    # 直接调用解密服务器，返回解密结果（零延迟，扣费已在前面统一处理）
+                    if pretty:
+                        result = await decrypt_with_retry(raw_hex, target_server)
+                        return _build_json_response(result)
+                    # 透传模式：服务器响应字节原样返回，不解析、不重新序列化
+                    body, content_type = await decrypt_passthrough(raw_hex, target_server)
+                    return Response(content=body, media_type=content_type)
                     
                 except Exception as e:
-                    print(f"数据包直接解密失败: {e}")
+                    log.error("数据包直接解密失败", server=server_idx, error=e, rate_limit=5)
                     raise HTTPException(
                         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                         detail="Task processing failed"
@@ -598,10 +643,11 @@ async def quick_submit(
 
     # 推送密钥包到消息队列，附带优先级
     try:
-        await push_task_to_queue(
+        position = await push_task_to_queue(
             {
                 "task_id": task_id,
                 "username": user.user_name,
+                "user_id": user.user_id,
                 "priority": priority,
                 "update_time": str(update_time) if update_time else "",
                 "encrypted_data": raw_hex,
@@ -609,14 +655,17 @@ async def quick_submit(
                 "is_key_packet": is_key_packet,
                 "drone_id": drone_id,
                 "server_idx": server_idx,
+                # 绝对截止时间：超过后客户端已不再等待，Worker出队时直接丢弃
+                "deadline": time.time() + settings.queue_wait_timeout,
             },
             priority,
         )
+        log.debug("密钥包已入队", task_id=task_id, position=position)
     except Exception as e:
         # 入队失败，回滚负载均衡状态
         if is_key_packet and drone_id:
             await remove_from_processing(drone_id)
-            print(f"任务入队失败，已回滚负载均衡状态: {drone_id}")
+            log.warning("任务入队失败，已回滚负载均衡状态", drone_id=drone_id)
         raise
 
     # ========== 等待密钥包处理完成（可选：支持快速返回模式）==========
@@ -624,7 +673,11 @@ async def quick_submit(
     # return {"task_id": task_id, "status": "processing"}
     
     try:
-        result = await wait_for_task_result(task_id)
+        with span("wait_result"):
+            result = await wait_for_task_result(task_id)
+        # 合并Worker记录的阶段（排队、上游调用等）
+        if trace is not None:
+            trace.merge(result.get("spans"))
         
         b_server_response = result.get("data", {})
         response_data = {}
@@ -633,16 +686,16 @@ async def quick_submit(
             response_data.update(b_server_response)
         elif isinstance(b_server_response, str):
             try:
-                parsed_data = json.loads(b_server_response)
+                parsed_data = codec.loads(b_server_response)
                 if isinstance(parsed_data, dict):
                     response_data.update(parsed_data)
                 else:
                     response_data["data"] = parsed_data
-            except json.JSONDecodeError:
+            except codec.JSONDecodeError:
                 response_data["data"] = b_server_response
         else:
             response_data["data"] = b_server_response
         
-        return _build_json_response(response_data)
+        return _build_json_response(response_data, pretty=pretty)
     except HTTPException:
         raise
\ No newline at end of file
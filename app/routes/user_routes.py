@@ -1,32 +1,11 @@
-# 导入用于可逆解密的AES库
-import base64
 from typing import Optional
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
 
 # 导入FastAPI相关依赖
-from fastapi import APIRouter, Depends, Query, Request
-# 导入SQLAlchemy用于数据库操作的select
-from sqlalchemy import select
-# 导入异步数据库会话
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Query, Request
 
-# 导入自定义的数据库依赖、模型和配置
-from ..db import get_db
-from ..models import SysUser
-from ..config import settings
-
-
-def decrypt_password(ciphertext_b64: str) -> str | None:
-    """解密密码（AES/CBC/PKCS5 Base64）"""
-    try:
-        key = settings.aes_key.encode("utf-8")
-        iv = settings.aes_iv.encode("utf-8")
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        plaintext = unpad(cipher.decrypt(base64.b64decode(ciphertext_b64)), AES.block_size)
-        return plaintext.decode("utf-8")
-    except Exception:
-        return None
+# 导入自定义的账号密码校验和配额计数
+from ..credentials import AUTH_OK, authenticate
+from ..quota import current_used
 
 
 # 创建API路由器，前缀为/api，标签为users
@@ -39,7 +18,6 @@ async def query_user_requests(
     request: Request,
     username: Optional[str] = Query(None, description="用户名"),
     password: Optional[str] = Query(None, description="密码"),
-    db: AsyncSession = Depends(get_db)
 ):
     """查询用户请求次数
     
@@ -49,7 +27,6 @@ async def query_user_requests(
         request: 请求对象
         username: 用户名（必需）
         password: 密码（必需）
-        db: 数据库会话
     
     Returns:
         返回JSON格式：
@@ -97,8 +74,8 @@ async def query_user_requests(
     username = username.strip()
     
     try:
-        res = await db.execute(select(SysUser).where(SysUser.user_name == username))
-        user: SysUser | None = res.scalar_one_or_none()
+        # 同一账号密码近期校验过时直接通过，不查库、不解密
+        user, auth_result = await authenticate(username, password)
     except Exception as e:
         return {
             "code": 500,
@@ -115,8 +92,7 @@ async def query_user_requests(
         }
     
     # 验证密码（AES/CBC/PKCS5 Base64解密）
-    decrypted = decrypt_password(user.password)
-    if not decrypted or decrypted != password:
+    if auth_result != AUTH_OK:
         return {
             "code": 401,
             "message": "Invalid password",
@@ -131,8 +107,7 @@ async def query_user_requests(
             "data": {}
         }
     
-    # 获取已用次数和总次数
-    remaining_requests =user.remaining_requests
+    # 获取总次数
     total_requests = user.total_requests
     
     # 如果total_requests为-1，返回次数无限制
@@ -145,8 +120,9 @@ async def query_user_requests(
             }
         }
     
+    # 已用次数以Redis计数为准（未初始化时查数据库）
+    remaining = await current_used(user.user_name)
     # 返回格式：剩余次数/总次数（字符串）
-    remaining = remaining_requests if remaining_requests is not None else 0
     total = total_requests if total_requests is not None else 0
     return {
         "code": 200,
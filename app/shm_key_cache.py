@@ -0,0 +1,213 @@
+"""
+共享内存密钥缓存（单机多进程部署）
+同一台机器上以 SO_REUSEPORT 运行多个网关进程时，各进程共享同一张密钥路由表：
+任一进程解密密钥包成功后，其他进程收到该无人机的数据包也能直接路由，无需访问 Redis
+
+结构：multiprocessing.shared_memory 中的定长开放寻址哈希表
+- 每个槽位保存 hash_code -> (服务器索引, 记录时间, SN)
+- 读：无锁，每个槽位带 seqlock 版本号（写入期间为奇数），读到奇数或前后版本不一致时重读
+- 写：密钥包解密成功时才写入（远少于读），用 fcntl 文件锁串行化各进程的写操作
+- 淘汰：hash_code 只在以起始槽位开始的 PROBE_WINDOW 个槽位内存放，窗口已满时覆盖其中记录时间最早的条目
+  （近似 FIFO；读路径不写共享内存，因此不维护 LRU 顺序）
+
+共享内存段在进程退出时不删除（单个进程重启不丢失路由），机器重启后自然清空；
+头部记录槽位数和服务器列表指纹，重新部署后服务器列表（槽位中的服务器索引含义）或槽位数变化时，
+新进程删除旧段并重建（仍在运行的旧进程继续使用已映射的旧段，互不影响）
+"""
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterable, Iterator, Optional, Tuple
+
+from .logger import get_logger
+
+log = get_logger(__name__)
+
+_MAGIC = b"DKC2"
+# 头部：魔数, 槽位数, 已占用槽位数, 服务器列表指纹（补齐到64字节）
+_HEADER = struct.Struct("<4sIIQ")
+_HEADER_SIZE = 64
+# 槽位：seqlock版本号, hash_code+1（0表示空槽位）, 服务器索引, 记录时间, SN长度, SN（补齐到48字节）
+_SLOT = struct.Struct("<IQidB17s6x")
+_SEQ = struct.Struct("<I")
+_SN_SIZE = 17
+
+PROBE_WINDOW = 8  # 每个 hash_code 最多探测的槽位数
+_READ_RETRIES = 16  # 槽位正在写入时最多重读的次数
+
+
+def _parse_hash(hash_code: str) -> Optional[int]:
+    """8位hex的 hash_code 转为 uint32，格式错误返回None"""
+    if not hash_code or len(hash_code) != 8:
+        return None
+    try:
+        return int(hash_code, 16)
+    except ValueError:
+        return None
+
+
+def server_fingerprint(servers: Iterable[str]) -> int:
+    """服务器列表指纹（按索引顺序的服务器描述），列表顺序或内容变化时指纹不同"""
+    digest = hashlib.sha256("\n".join(servers).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+class SharedKeyCache:
+    """
+    共享内存密钥路由表
+
+    Args:
+        name: 共享内存段名称（同一台机器上的网关进程使用相同名称）
+        slots: 槽位数（取不小于该值的2的幂）
+        fingerprint: 服务器列表指纹（见 server_fingerprint()），槽位中的服务器索引只在指纹相同的进程间有效
+
+    已存在的段槽位数或指纹不一致（或为旧版本格式）时删除并重建
+    """
+
+    def __init__(self, name: str, slots: int, fingerprint: int = 0):
+        self.name = name
+        self.fingerprint = fingerprint
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        capacity = 1 << max(PROBE_WINDOW.bit_length(), (max(slots, 1) - 1).bit_length())
+        with self._locked():
+            created = self._open(capacity)
+            magic, stored, _, stored_fingerprint = _HEADER.unpack_from(self._shm.buf, 0)
+            if not created and (magic, stored, stored_fingerprint) != (_MAGIC, capacity, fingerprint):
+                log.warning("共享内存密钥缓存的槽位数或服务器列表已变化，重建", name=name,
+                            slots=capacity, old_slots=stored if magic == _MAGIC else None)
+                self._unlink_segment()
+                self._shm.close()
+                created = self._open(capacity)
+            self._buf = self._shm.buf
+            if created:
+                _HEADER.pack_into(self._buf, 0, _MAGIC, capacity, 0, fingerprint)
+        self.capacity = capacity
+        self._shift = 32 - (capacity.bit_length() - 1)
+        log.info("共享内存密钥缓存已就绪", name=name, slots=capacity, created=created)
+
+    def _open(self, capacity: int) -> bool:
+        """创建或映射已存在的共享内存段，返回是否新建（需持有文件锁）"""
+        try:
+            self._shm = shared_memory.SharedMemory(
+                name=self.name, create=True, size=_HEADER_SIZE + capacity * _SLOT.size)
+            created = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+            created = False
+        # 段的生命周期不跟随进程（resource_tracker 会在进程退出时删除它登记过的段）
+        resource_tracker.unregister(self._shm._name, "shared_memory")
+        return created
+
+    def _unlink_segment(self) -> None:
+        resource_tracker.register(self._shm._name, "shared_memory")  # unlink() 会注销登记
+        self._shm.unlink()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _home(self, key: int) -> int:
+        """起始槽位（Fibonacci 哈希，打散相邻的 hash_code）"""
+        return ((key * 0x9E3779B1) & 0xFFFFFFFF) >> self._shift
+
+    def _offset(self, index: int) -> int:
+        return _HEADER_SIZE + (index & (self.capacity - 1)) * _SLOT.size
+
+    def _read_slot(self, offset: int) -> Optional[Tuple]:
+        """按 seqlock 读出一个完整槽位，持续处于写入状态时返回None"""
+        for _ in range(_READ_RETRIES):
+            entry = _SLOT.unpack_from(self._buf, offset)
+            if entry[0] & 1:
+                continue
+            if _SEQ.unpack_from(self._buf, offset)[0] == entry[0]:
+                return entry
+        return None
+
+    def get(self, hash_code: str) -> Optional[Tuple[int, str, float]]:
+        """
+        无锁查找
+
+        Returns:
+            (服务器索引, SN, 记录时间)，未找到返回None
+        """
+        key = _parse_hash(hash_code)
+        if key is None:
+            return None
+        tag = key + 1
+        home = self._home(key)
+        for probe in range(PROBE_WINDOW):
+            entry = self._read_slot(self._offset(home + probe))
+            if entry is None:
+                continue
+            _, slot_tag, server_idx, timestamp, sn_len, sn = entry
+            if slot_tag == tag:
+                return server_idx, sn[:sn_len].decode("ascii", "replace"), timestamp
+            if slot_tag == 0:
+                return None  # 只覆盖不删除：空槽位之后不会有该 hash_code
+        return None
+
+    def put(self, hash_code: str, server_idx: int, sn: str = "") -> bool:
+        """写入（加锁）：已存在则更新，否则占用窗口内的空槽位，窗口已满时覆盖最早的条目"""
+        key = _parse_hash(hash_code)
+        if key is None:
+            return False
+        tag = key + 1
+        sn_bytes = sn.encode("ascii", "replace")[:_SN_SIZE]
+        home = self._home(key)
+        with self._locked():
+            target = None
+            oldest = None
+            for probe in range(PROBE_WINDOW):
+                offset = self._offset(home + probe)
+                _, slot_tag, _, timestamp, _, _ = _SLOT.unpack_from(self._buf, offset)
+                if slot_tag == tag or slot_tag == 0:
+                    target = offset
+                    break
+                if oldest is None or timestamp < oldest[1]:
+                    oldest = (offset, timestamp)
+            if target is None:
+                target = oldest[0]
+            elif slot_tag == 0:
+                magic, capacity, count, fingerprint = _HEADER.unpack_from(self._buf, 0)
+                _HEADER.pack_into(self._buf, 0, magic, capacity, count + 1, fingerprint)
+            # 版本号置为奇数 -> 写入数据 -> 置为偶数（写入中途进程退出时版本号停留在奇数，下次写入时恢复）
+            seq = _SEQ.unpack_from(self._buf, target)[0] | 1
+            _SEQ.pack_into(self._buf, target, seq)
+            _SLOT.pack_into(self._buf, target, seq, tag, server_idx, time.time(), len(sn_bytes), sn_bytes)
+            _SEQ.pack_into(self._buf, target, (seq + 1) & 0xFFFFFFFF)
+        return True
+
+    def __contains__(self, hash_code: str) -> bool:
+        return self.get(hash_code) is not None
+
+    def __len__(self) -> int:
+        return _HEADER.unpack_from(self._buf, 0)[2]
+
+    def clear(self) -> None:
+        """清空所有槽位（各进程同时生效）"""
+        with self._locked():
+            self._buf[_HEADER_SIZE:_HEADER_SIZE + self.capacity * _SLOT.size] = bytes(self.capacity * _SLOT.size)
+            _HEADER.pack_into(self._buf, 0, _MAGIC, self.capacity, 0, self.fingerprint)
+
+    def close(self) -> None:
+        """解除本进程的映射（不删除共享内存段）"""
+        self._shm.close()
+        os.close(self._lock_fd)
+
+    def unlink(self) -> None:
+        """删除共享内存段和锁文件（所有进程停止后调用）"""
+        self._unlink_segment()
+        try:
+            os.unlink(self._lock_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,56 @@
+-- 数据保留相关的表结构调整（app/retention.py）
+
+-- 分批删除模式：decrypt_time 索引，让 DELETE ... ORDER BY decrypt_time LIMIT n 走索引范围扫描
+create index idx_decrypt_time
+    on server_key_relation (decrypt_time);
+
+create index idx_decrypt_time
+    on user_decrypt_log (decrypt_time);
+
+-- 分区模式（可选）：按天 RANGE 分区后，清理只需 DROP PARTITION，成本 O(1)
+-- 注意：MySQL 分区表不支持外键，且分区键必须包含在主键中
+-- 外键名随部署不同（自动生成或手工命名），从 information_schema 查出该表的全部外键后删除
+set @drop_fks = (
+    select concat('alter table user_decrypt_log ',
+                  group_concat(concat('drop foreign key `', constraint_name, '`') separator ', '))
+    from information_schema.TABLE_CONSTRAINTS
+    where table_schema = database()
+      and table_name = 'user_decrypt_log'
+      and constraint_type = 'FOREIGN KEY'
+);
+set @drop_fks = coalesce(@drop_fks, 'do 0');
+prepare stmt from @drop_fks;
+execute stmt;
+deallocate prepare stmt;
+
+alter table user_decrypt_log
+    drop primary key,
+    add primary key (id, decrypt_time);
+
+alter table server_key_relation
+    drop primary key,
+    add primary key (id, decrypt_time);
+
+-- 迁移日之前的历史数据放入 p_history（上界 = 迁移当天），迁移日及之后的数据进入 p_future，
+-- 首次运行 daily_retention_task 时从 p_future 中拆分出按天的分区；
+-- p_history 的上界不超过保留阈值（迁移日已过去 keep_days 天）时整块删除，此时其中的数据都已过期
+-- 分区上界必须是常量，用迁移当天的 TO_DAYS() 拼接语句
+set @history_bound = to_days(current_date());
+
+set @partition_sql = concat(
+    'alter table user_decrypt_log partition by range (to_days(decrypt_time)) (',
+    'partition p_history values less than (', @history_bound, '), ',
+    'partition p_future values less than maxvalue)'
+);
+prepare stmt from @partition_sql;
+execute stmt;
+deallocate prepare stmt;
+
+set @partition_sql = concat(
+    'alter table server_key_relation partition by range (to_days(decrypt_time)) (',
+    'partition p_history values less than (', @history_bound, '), ',
+    'partition p_future values less than maxvalue)'
+);
+prepare stmt from @partition_sql;
+execute stmt;
+deallocate prepare stmt;
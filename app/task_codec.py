@@ -0,0 +1,156 @@
+"""
+队列任务编码模块
+将排队任务编码为紧凑的二进制格式（约230字节，原JSON约600字节），并兼容旧的JSON格式
+
+二进制格式 v1（大端序）：
+    version      B    格式版本（JSON成员以 '{' 开头，不会与版本号冲突）
+    flags        B    bit0: 是否密钥包，bit1: 是否带无人机ID
+    packet_type  B    包类型编号
+    reserved     B
+    priority     H    用户优先级
+    server_idx   H    目标服务器索引
+    user_id      Q    用户ID（用户名通过 queue:user_names 驻留，不随任务重复存储）
+    update_time  d    账号更新时间戳（0表示无）
+    deadline     d    绝对截止时间戳（0表示无）
+    task_id      16s  任务ID（uuid4 hex 的原始16字节）
+    drone_id     4s   无人机ID（hash_code 原始4字节）
+    raw          ...  原始176字节数据包
+"""
+import struct
+from datetime import datetime
+from typing import Dict, Optional, Union
+
+from . import runtime
+from . import codec
+
+
+FORMAT_VERSION = 1
+USER_NAMES_KEY = "queue:user_names"  # 用户ID -> 用户名 {user_id: username}
+
+_HEADER = struct.Struct(">BBBBHHQdd16s4s")
+_FLAG_KEY_PACKET = 0x01
+_FLAG_HAS_DRONE_ID = 0x02
+_PACKET_TYPES = ("useless_packet", "key_packet", "data_packet")
+_PACKET_TYPE_IDS = {name: i for i, name in enumerate(_PACKET_TYPES)}
+
+# 本进程已知的用户名驻留表 {user_id: username}
+_user_names: Dict[int, str] = {}
+
+
+def _is_hex(value: str, length: int) -> bool:
+    """检查是否为指定长度的hex字符串"""
+    if len(value) != length:
+        return False
+    try:
+        bytes.fromhex(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _can_encode_binary(task: dict) -> bool:
+    """检查任务字段是否满足二进制格式的要求，不满足时回退为JSON"""
+    drone_id = task.get("drone_id") or ""
+    return (
+        isinstance(task.get("user_id"), int)
+        and _is_hex(task.get("task_id", ""), 32)
+        and (drone_id == "" or _is_hex(drone_id, 8))
+        and task.get("packet_type", "key_packet") in _PACKET_TYPE_IDS
+    )
+
+
+def encode_task(task: dict, binary: bool = True) -> Union[bytes, str]:
+    """
+    编码队列任务
+
+    Args:
+        task: 任务字典
+        binary: 是否使用二进制格式（队列客户端不支持二进制时传False）
+
+    Returns:
+        二进制成员（bytes），或JSON成员（str）
+    """
+    if not binary or not _can_encode_binary(task):
+        return codec.dumps(task)
+
+    update_time = 0.0
+    if task.get("update_time"):
+        try:
+            update_time = datetime.fromisoformat(task["update_time"]).timestamp()
+        except ValueError:
+            update_time = 0.0
+
+    flags = 0
+    if task.get("is_key_packet"):
+        flags |= _FLAG_KEY_PACKET
+    if task.get("drone_id"):
+        flags |= _FLAG_HAS_DRONE_ID
+
+    header = _HEADER.pack(
+        FORMAT_VERSION,
+        flags,
+        _PACKET_TYPE_IDS[task.get("packet_type", "key_packet")],
+        0,
+        task.get("priority", 0),
+        task.get("server_idx", 0),
+        task["user_id"],
+        update_time,
+        task.get("deadline") or 0.0,
+        bytes.fromhex(task["task_id"]),
+        bytes.fromhex(task.get("drone_id") or "00000000"),
+    )
+    return header + bytes.fromhex(task.get("encrypted_data", ""))
+
+
+def decode_task(member: Union[bytes, str]) -> dict:
+    """
+    解码队列任务（同时支持二进制格式和旧的JSON格式）
+
+    二进制任务的 username 从本进程驻留表中取，取不到时为空，需调用 resolve_username 补全
+
+    Args:
+        member: 队列成员
+
+    Returns:
+        任务字典（字段与JSON格式一致）
+    """
+    if isinstance(member, str):
+        return codec.loads(member)
+    if not member or member[0] != FORMAT_VERSION:
+        return codec.loads(member)
+
+    (_, flags, packet_type, _, priority, server_idx, user_id,
+     update_time, deadline, task_id, drone_id) = _HEADER.unpack_from(member)
+    return {
+        "task_id": task_id.hex(),
+        "user_id": user_id,
+        "username": _user_names.get(user_id, ""),
+        "priority": priority,
+        "update_time": str(datetime.fromtimestamp(update_time)) if update_time else "",
+        "encrypted_data": member[_HEADER.size:].hex(),
+        "packet_type": _PACKET_TYPES[packet_type],
+        "is_key_packet": bool(flags & _FLAG_KEY_PACKET),
+        "drone_id": drone_id.hex() if flags & _FLAG_HAS_DRONE_ID else "",
+        "server_idx": server_idx,
+        "deadline": deadline or None,
+    }
+
+
+def remember_username(user_id: Optional[int], username: str) -> None:
+    """登记本进程的用户ID与用户名映射（Redis中的映射由入队脚本同步写入）"""
+    if user_id is not None:
+        _user_names[user_id] = username
+
+
+async def resolve_username(job: dict) -> str:
+    """补全二进制任务的用户名（本进程驻留表未命中时查Redis）"""
+    if job.get("username"):
+        return job["username"]
+    user_id = job.get("user_id")
+    if user_id is not None and runtime.redis_client:
+        username = await runtime.redis_client.hget(USER_NAMES_KEY, str(user_id))
+        if username:
+            username = username.decode("utf-8") if isinstance(username, bytes) else username
+            _user_names[user_id] = username
+            job["username"] = username
+    return job.get("username", "")
@@ -1,7 +1,7 @@
-import json
 import random
 import time
 from datetime import datetime
+from typing import Dict
 
 from sqlalchemy import update, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -9,61 +9,234 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from .models import SysUser
 from .config import settings
 from . import runtime
+from .task_codec import encode_task, remember_username, USER_NAMES_KEY
+
+
+QUEUE_KEY = "queue:priority"
+# 任务状态哈希 task:{task_id}，字段：status / username / start_time / finish_time / server_idx / data / error
+# 状态流转只写变化的字段，不再整体重写JSON
+TASK_KEY_PREFIX = "task:"
+# 公平排队相关key：
+# queue:vclock        各优先级档位的虚拟时钟（已出队的最大轮次） {priority: round}
+# queue:vstart:{p}    档位p内每个用户下一个任务的起始轮次 {username: round}
+# queue:user_count    每个用户当前排队中的任务数 {username: count}
+VCLOCK_KEY = "queue:vclock"
+VSTART_KEY_PREFIX = "queue:vstart:"
+USER_COUNT_KEY = "queue:user_count"
+
+# 分数布局：priority * PRIORITY_SCALE + 轮次 * ROUND_SCALE + 更新时间偏移(< ROUND_SCALE)
+# 最大分数（999档）约1e15，小于2^53，分数在double中精确表示，更新时间偏移不丢精度
+# 每个档位最多容纳 PRIORITY_SCALE / ROUND_SCALE 个轮次：
+# - 入队时起始轮次不超过 档位虚拟时钟 + ROUND_WINDOW
+# - 档位虚拟时钟达到 ROUND_REBASE_AT 时，认领脚本把该档位所有任务和用户的轮次整体减去虚拟时钟（重新从0计数）
+# 因此轮次始终小于 ROUND_REBASE_AT + ROUND_WINDOW，不会溢出到下一个优先级的分数区间
+PRIORITY_SCALE = 1e12
+ROUND_SCALE = 1e8
+ROUND_WINDOW = 4000
+ROUND_REBASE_AT = 4000
+TIEBREAK_EPOCH = 4102444800  # 2100-01-01，更新时间偏移的上界
+
+
+# 入队脚本（原子执行，一次往返完成准入、入队和任务状态写入）：
+# 1. 检查队列总长度是否达到上限
+# 2. 检查该用户排队数是否超过上限
+# 3. 起始轮次 = max(档位虚拟时钟, 该用户上一个任务的轮次 + 1)，同一用户的多个任务依次排到后续轮次，
+#    不同用户的任务在同一轮次内交替出队（起始时间公平排队，Start-time Fair Queueing）；
+#    起始轮次最多领先虚拟时钟 ROUND_WINDOW 轮
+# 4. 写入任务状态哈希（status=queued），TTL = queue_wait_timeout
+# 5. 二进制任务只携带用户ID，同时登记用户ID到用户名的映射
+# 返回：{起始轮次, 队列位置}，起始轮次 -1 表示超过单用户上限，-2 表示队列已满
+_ENQUEUE_LUA = """
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[8]) then
+    return {-2, -1}
+end
+local count = tonumber(redis.call('HGET', KEYS[4], ARGV[3]) or '0')
+if count >= tonumber(ARGV[4]) then
+    return {-1, -1}
+end
+local vclock = tonumber(redis.call('HGET', KEYS[2], ARGV[5]) or '0')
+local next_round = tonumber(redis.call('HGET', KEYS[3], ARGV[3]) or '0')
+local round = math.min(math.max(vclock, next_round), vclock + tonumber(ARGV[11]))
+redis.call('HSET', KEYS[3], ARGV[3], round + 1)
+redis.call('HINCRBY', KEYS[4], ARGV[3], 1)
+redis.call('EXPIRE', KEYS[3], ARGV[6])
+redis.call('EXPIRE', KEYS[4], ARGV[6])
+-- 用 %.17g 格式化，避免Lua默认的 %.14g 截断大分数的精度
+redis.call('ZADD', KEYS[1], string.format('%.17g', tonumber(ARGV[2]) + round * tonumber(ARGV[7])), ARGV[1])
+redis.call('HSET', KEYS[5], 'status', ARGV[9])
+redis.call('EXPIRE', KEYS[5], ARGV[6])
+if ARGV[10] ~= '' then
+    redis.call('HSET', KEYS[6], ARGV[10], ARGV[3])
+end
+return {round, redis.call('ZRANK', KEYS[1], ARGV[1])}
+"""
+
+# 认领脚本（原子执行）：ZREM成功才算认领，同时减少用户排队数、推进档位虚拟时钟；
+# 档位清空时重置该档位的轮次；档位一直不清空时，虚拟时钟达到 ARGV[7] 后把该档位的任务分数和
+# 用户起始轮次整体前移虚拟时钟个轮次（低于虚拟时钟的轮次记为0），虚拟时钟归零，避免轮次无限增长
+# ARGV: 成员, 用户名, 优先级, 轮次, PRIORITY_SCALE, ROUND_SCALE, ROUND_REBASE_AT
+# 返回：1 认领成功，0 已被其他Worker认领
+_CLAIM_LUA = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if redis.call('HINCRBY', KEYS[4], ARGV[2], -1) <= 0 then
+    redis.call('HDEL', KEYS[4], ARGV[2])
+end
+local band_lo = tonumber(ARGV[3]) * tonumber(ARGV[5])
+local band_hi = string.format('(%.17g', band_lo + tonumber(ARGV[5]))
+if redis.call('ZCOUNT', KEYS[1], string.format('%.17g', band_lo), band_hi) == 0 then
+    redis.call('HDEL', KEYS[2], ARGV[3])
+    redis.call('DEL', KEYS[3])
+else
+    local vclock = tonumber(redis.call('HGET', KEYS[2], ARGV[3]) or '0')
+    if tonumber(ARGV[4]) > vclock then
+        vclock = tonumber(ARGV[4])
+        redis.call('HSET', KEYS[2], ARGV[3], vclock)
+    end
+    if vclock >= tonumber(ARGV[7]) then
+        local round_scale = tonumber(ARGV[6])
+        local members = redis.call('ZRANGEBYSCORE', KEYS[1], string.format('%.17g', band_lo), band_hi, 'WITHSCORES')
+        for i = 1, #members, 2 do
+            local offset = tonumber(members[i + 1]) - band_lo
+            local round = math.floor(offset / round_scale)
+            local score = band_lo + math.max(round - vclock, 0) * round_scale + (offset - round * round_scale)
+            redis.call('ZADD', KEYS[1], string.format('%.17g', score), members[i])
+        end
+        local starts = redis.call('HGETALL', KEYS[3])
+        for i = 1, #starts, 2 do
+            redis.call('HSET', KEYS[3], starts[i], math.max(tonumber(starts[i + 1]) - vclock, 0))
+        end
+        redis.call('HSET', KEYS[2], ARGV[3], 0)
+    end
+end
+return 1
+"""
+
+# 标记放弃脚本：仅当任务仍在排队时写入 abandoned，
+# 已完成/失败（结果可能已被读取删除）或处理中的任务不受影响
+_ABANDON_LUA = """
+if redis.call('HGET', KEYS[1], 'status') == 'queued' then
+    redis.call('HSET', KEYS[1], 'status', 'abandoned')
+    return 1
+end
+return 0
+"""
+
+# 状态更新脚本：任务已进入终态（abandoned/completed/failed）或状态key已不存在（超时过期、结果已被读取）时
+# 不再写入，避免Worker的 processing 覆盖并发写入的 abandoned，让等待方看到任务"复活"
+# KEYS: task:{task_id}   ARGV: TTL, 字段1, 值1, 字段2, 值2, ...
+# 返回：1 已更新，0 已拒绝
+_SET_STATE_LUA = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if not status or status == 'abandoned' or status == 'completed' or status == 'failed' then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+_scripts: Dict[str, object] = {}
+
+
+def _queue_client():
+    """获取队列使用的Redis客户端（优先使用二进制客户端）"""
+    return runtime.redis_queue_client or runtime.redis_client
+
+
+def _get_script(name: str, source: str):
+    """获取注册好的Lua脚本（首次调用时注册，按SHA执行，调用时传入当前客户端）"""
+    script = _scripts.get(name)
+    if script is None:
+        script = runtime.redis_client.register_script(source)
+        _scripts[name] = script
+    return script
+
+
+def task_state_key(task_id: str) -> str:
+    """任务状态哈希的key"""
+    return f"{TASK_KEY_PREFIX}{task_id}"
+
+
+async def set_task_state(task_id: str, fields: dict) -> bool:
+    """
+    字段级更新任务状态并续期TTL（Lua脚本原子执行，一次往返）
+
+    任务已处于终态（abandoned/completed/failed）或状态key已不存在时不写入
+
+    Args:
+        task_id: 任务ID
+        fields: 要写入的字段（值为 str / int / float）
+
+    Returns:
+        是否已更新
+    """
+    update_state = _get_script("set_state", _SET_STATE_LUA)
+    args = [settings.queue_wait_timeout]
+    for field, value in fields.items():
+        args += [field, value]
+    return await update_state(keys=[task_state_key(task_id)], args=args, client=runtime.redis_client) == 1
+
+
+async def mark_task_abandoned(task_id: str) -> bool:
+    """标记任务为已放弃（仅当任务仍在排队时），返回是否标记成功"""
+    abandon = _get_script("abandon", _ABANDON_LUA)
+    return await abandon(keys=[task_state_key(task_id)], client=runtime.redis_client) == 1
 
 
 def calculate_queue_score(priority: int, update_time: datetime, username: str) -> float:
     """
-    计算队列优先级分数，分数越小优先级越高
-    
+    计算队列优先级分数（公平排队轮次为0时的基础分数），分数越小优先级越高
+
     规则：
     1. 优先按priority排序（数字越小优先级越高）
-    2. priority相同时，按账号更新时间排序（时间越新优先级越高）
-    
+    2. priority相同时，由入队脚本按用户轮次交替排序（见 push_task_to_queue）
+    3. 同一轮次内，按账号更新时间排序（时间越新优先级越高）
+
     Args:
         priority: 用户优先级（1-999）
         update_time: 账号更新时间
         username: 用户名
-    
+
     Returns:
         float: 队列分数，越小优先级越高
     """
-    # priority占主要权重（乘以1e15确保优先级是最重要的因素）
-    priority_score = priority * 1e15
-    
+    # priority占主要权重（乘以PRIORITY_SCALE确保优先级是最重要的因素）
+    priority_score = priority * PRIORITY_SCALE
+
     # 账号更新时间：时间越新（时间戳越大），分数越小（优先级越高）
-    # 使用负数确保时间越新分数越小
+    # 映射到 [0, ROUND_SCALE) 内，不影响轮次排序
     if update_time:
-        update_time_score = -update_time.timestamp() * 1e6
+        update_time_score = (TIEBREAK_EPOCH - update_time.timestamp()) / TIEBREAK_EPOCH * (ROUND_SCALE - 1)
+        update_time_score = min(max(update_time_score, 0), ROUND_SCALE - 1)
     else:
-        # 如果没有更新时间，使用一个默认值（低优先级）
-        update_time_score = 0
-    
+        # 如果没有更新时间，使用一个默认值（同一轮次内最低优先级）
+        update_time_score = ROUND_SCALE - 1
+
     # 最终分数（去掉随机数，确保排序完全确定性）
     return priority_score + update_time_score
 
 
-async def push_task_to_queue(task: dict, priority: int):
+async def push_task_to_queue(task: dict, priority: int) -> int:
     """
     将任务推入优先级队列
-    
+
     使用Redis有序集合(sorted set)实现复杂的排队规则：
     1. 优先级越小越高
-    2. 相同优先级时，账号创建时间越晚越高
-    3. 同一账号的多个请求随机处理
+    2. 相同优先级时，各用户的任务按轮次交替出队（单个大客户不能挤占同档位其他用户）
+    3. 同一轮次内，账号更新时间越晚越高
+    4. 每个用户排队中的任务数不超过 max_queue_per_user
+
+    队列长度检查、入队和任务状态写入在同一个Lua脚本中原子完成，
+    并发入队时也不会超过 max_queue_size
+
+    Returns:
+        int: 入队后任务在队列中的位置（0表示队首）
     """
     if not runtime.redis_client:
         raise RuntimeError("Redis not initialized")
-    
-    # 检查队列长度，超过限制则拒绝
-    queue_key = "queue:priority"
-    queue_size = await runtime.redis_client.zcard(queue_key)
-    if queue_size >= settings.max_queue_size:
-        from fastapi import HTTPException, status
-        raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Exceeds the system's maximum length"
-        )
-    
+
     # 解析账号更新时间
     update_time_str = task.get('update_time', '')
     try:
@@ -73,27 +246,81 @@ async def push_task_to_queue(task: dict, priority: int):
             update_time = None
     except:
         update_time = None
-    
+
     # 计算队列分数
+    username = task.get('username', '')
     score = calculate_queue_score(
         priority=priority,
         update_time=update_time,
-        username=task.get('username', '')
+        username=username
     )
-    
-    # 使用有序集合存储任务
-    queue_member = json.dumps(task)
-    await runtime.redis_client.zadd(
-        queue_key,
-        {queue_member: score}
+
+    # 使用有序集合存储任务（公平排队轮次由脚本原子计算）
+    # 有二进制队列客户端时使用紧凑二进制编码，用户名驻留为用户ID
+    binary = settings.queue_binary_encoding and runtime.redis_queue_client is not None
+    if binary:
+        remember_username(task.get("user_id"), username)
+    queue_member = encode_task(task, binary=binary)
+    enqueue = _get_script("enqueue", _ENQUEUE_LUA)
+    round_no, position = await enqueue(
+        keys=[
+            QUEUE_KEY, VCLOCK_KEY, f"{VSTART_KEY_PREFIX}{priority}", USER_COUNT_KEY,
+            task_state_key(task['task_id']), USER_NAMES_KEY,
+        ],
+        args=[
+            queue_member, score, username, settings.max_queue_per_user,
+            priority, settings.queue_wait_timeout, ROUND_SCALE,
+            settings.max_queue_size, "queued",
+            task.get("user_id", "") if binary else "",
+            ROUND_WINDOW,
+        ],
+        client=_queue_client(),
     )
-    
-    # 设置任务状态，TTL = queue_wait_timeout，超时自动过期
-    await runtime.redis_client.set(
-        f"task:{task['task_id']}",
-        json.dumps({"status": "queued"}),
-        ex=settings.queue_wait_timeout
+    if round_no == -2:
+        # 队列长度超过限制则拒绝
+        from fastapi import HTTPException, status
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Exceeds the system's maximum length"
+        )
+    if round_no == -1:
+        from fastapi import HTTPException, status
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many queued requests for this user"
+        )
+    return position
+
+
+async def claim_task(member, score: float, username: str) -> bool:
+    """
+    从队列中认领一个任务（分发器调用）
+
+    Args:
+        member: 队列成员（二进制或JSON编码的任务）
+        score: 成员分数（用于推算优先级档位和轮次）
+        username: 任务所属用户
+
+    Returns:
+        True 认领成功，False 已被其他Worker认领
+    """
+    priority = int(score // PRIORITY_SCALE)
+    round_no = int((score - priority * PRIORITY_SCALE) // ROUND_SCALE)
+    claim = _get_script("claim", _CLAIM_LUA)
+    claimed = await claim(
+        keys=[QUEUE_KEY, VCLOCK_KEY, f"{VSTART_KEY_PREFIX}{priority}", USER_COUNT_KEY],
+        args=[member, username, priority, round_no, PRIORITY_SCALE, ROUND_SCALE, ROUND_REBASE_AT],
+        client=_queue_client(),
     )
+    return claimed == 1
+
+
+async def requeue_task(member, score: float, username: str) -> None:
+    """将已认领但未处理的任务按原分数放回队列（停机时调用）"""
+    async with _queue_client().pipeline(transaction=True) as pipe:
+        pipe.zadd(QUEUE_KEY, {member: score})
+        pipe.hincrby(USER_COUNT_KEY, username, 1)
+        await pipe.execute()
 
 
     # 用户配额相关逻辑已移除，如需实现请在SysUser表扩展字段后补充
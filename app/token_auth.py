@@ -0,0 +1,237 @@
+"""
+登录token本地校验模块
+token 是 HS256 签名的 JWT（含 exp/iss/aud），签名和声明在本地校验即可，不需要每次查 Redis
+
+吊销信息体积很小，由后台任务从 Redis 同步到本地：
+user_token:revoked_before  哈希 {用户名: 整秒时间戳}，签发时间（exp - 有效期，整秒）早于该值的该用户token全部失效
+user_token:revoked         有序集合 {jti:exp: exp}，单个吊销的token，过期后自动清理
+                           （jti只有5个字符，加上exp避免误伤其他token）
+user_token:revocation_version  每次吊销加1，同步任务只在版本变化时重新加载
+
+token 中的用户名填充/截断为8个字符：不足8个字符的用户名可以直接还原，
+恰好8个字符的可能是被截断的长用户名，需要查 Redis 的 user_token:{token} 得到完整用户名
+
+登录时复用用户当前的token（user_token_current:{username}），剩余有效期足够时不再签发新token，
+Redis 中的token数量与活跃用户数成正比，而不是与登录次数成正比
+"""
+import asyncio
+import hashlib
+import secrets
+import time
+from typing import Dict, Optional
+
+import jwt
+
+from .config import settings
+from . import runtime
+from .logger import get_logger
+from .task_service import _get_script
+
+log = get_logger(__name__)
+
+# Token过期时间：48小时（秒）
+TOKEN_EXPIRE_SECONDS = 48 * 60 * 60
+
+# JWT密钥（用于签名token），从配置中加载
+JWT_SECRET_KEY = settings.jwt_secret_key
+JWT_ALGORITHM = "HS256"
+JWT_ISSUER = "ApiStore"
+JWT_AUDIENCE = "ApiStore"
+
+NAME_CLAIM = "http://schemas.xmlsoap.org/ws/2005/05/identity/claims/name"
+ROLE_CLAIM = "http://schemas.microsoft.com/ws/2008/06/identity/claims/role"
+NAME_CLAIM_LENGTH = 8  # 用户名填充/截断后的长度
+
+TOKEN_KEY_PREFIX = "user_token:"  # user_token:{token} -> 完整用户名
+CURRENT_TOKEN_KEY_PREFIX = "user_token_current:"  # user_token_current:{username} -> 该用户当前的token
+REVOKED_BEFORE_KEY = "user_token:revoked_before"
+REVOKED_JTI_KEY = "user_token:revoked"
+REVOCATION_VERSION_KEY = "user_token:revocation_version"
+
+# 本地吊销信息（由 revocation_sync_task 整体替换，校验时只读）
+_revoked_before: Dict[str, int] = {}
+_revoked_jti: Dict[str, float] = {}
+_revocation_version: Optional[int] = None
+
+
+# 登录取token脚本（原子执行，同一用户并发登录拿到同一个token）：
+# 当前token存在、剩余有效期不少于 ARGV[3] 且未被单独吊销时直接返回；
+# 否则登记新签发的token，但新token签发时间早于该用户的吊销点时不登记（签发后、登记前发生了吊销）
+# 按用户吊销与删除当前token在同一事务内，已登记的当前token签发时间一定不早于最近的吊销点
+# KEYS: user_token_current:{username}, user_token:{新token}, user_token:revoked_before
+# ARGV: 新token, 有效期, 最短剩余有效期, user_token: 前缀, 用户名, 新token签发时间
+# 返回：{1, token} 或 {0, 吊销点}（调用方按吊销点重新签发）
+_ISSUE_LUA = """
+local current = redis.call('GET', KEYS[1])
+if current and redis.call('TTL', KEYS[1]) >= tonumber(ARGV[3])
+        and redis.call('EXISTS', ARGV[4] .. current) == 1 then
+    return {1, current}
+end
+local cutoff = tonumber(redis.call('HGET', KEYS[3], ARGV[5]) or 0)
+if tonumber(ARGV[6]) < cutoff then
+    return {0, tostring(cutoff)}
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('SET', KEYS[2], ARGV[5], 'EX', ARGV[2])
+return {1, ARGV[1]}
+"""
+
+
+def mint_token(username: str, issued_at: Optional[int] = None) -> str:
+    """
+    签发JWT（固定355字符），只签名不登记
+
+    Args:
+        issued_at: 签发时间（整秒），默认为当前时间；不早于本进程已知的该用户吊销时间点，
+            吊销后同一秒内签发的token不会被误判为已吊销
+    """
+    if issued_at is None:
+        issued_at = max(int(time.time()), _revoked_before.get(username, 0))
+    # 计算过期时间（Unix时间戳，本地校验时按此判断过期；签发时间 = exp - 有效期）
+    exp_timestamp = issued_at + TOKEN_EXPIRE_SECONDS
+
+    # 生成唯一标识（5字符，确保同一用户多次签发的token不同）
+    unique_id = hashlib.md5(f"{username}:{time.time()}:{secrets.token_hex(4)}".encode()).hexdigest()[:5]
+
+    # 用户名填充到固定8字符（确保token长度固定为355字符）
+    padded_username = username.ljust(NAME_CLAIM_LENGTH)[:NAME_CLAIM_LENGTH]
+
+    # 构建JWT payload（模拟.NET风格的claims）
+    payload = {
+        NAME_CLAIM: padded_username,
+        ROLE_CLAIM: "0",
+        "exp": exp_timestamp,
+        "iss": JWT_ISSUER,
+        "aud": JWT_AUDIENCE,
+        "jti": unique_id,  # JWT ID，确保唯一性
+    }
+    return jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+async def issue_login_token(username: str) -> str:
+    """登录取token：复用该用户剩余有效期足够的当前token，否则签发新token"""
+    issued_at = max(int(time.time()), _revoked_before.get(username, 0))
+    if not runtime.redis_client:
+        return mint_token(username, issued_at)
+    issue = _get_script("issue_token", _ISSUE_LUA)
+    # 脚本拒绝时按返回的吊销点重新签发（只有期间再次吊销才会重签多次）
+    for _ in range(3):
+        token = mint_token(username, issued_at)
+        ok, value = await issue(
+            keys=[f"{CURRENT_TOKEN_KEY_PREFIX}{username}", f"{TOKEN_KEY_PREFIX}{token}", REVOKED_BEFORE_KEY],
+            args=[token, TOKEN_EXPIRE_SECONDS, settings.token_reuse_min_ttl, TOKEN_KEY_PREFIX, username, issued_at],
+            client=runtime.redis_client,
+        )
+        if int(ok):
+            return value
+        issued_at = max(issued_at, int(value))
+    raise RuntimeError(f"用户 {username} 的token在签发期间被反复吊销")
+
+
+def decode_token(token: str) -> Optional[dict]:
+    """校验签名、过期时间、签发者和受众，返回claims；无效返回None"""
+    try:
+        return jwt.decode(
+            token,
+            JWT_SECRET_KEY,
+            algorithms=[JWT_ALGORITHM],
+            audience=JWT_AUDIENCE,
+            issuer=JWT_ISSUER,
+            options={"require": ["exp", "iss", "aud"]},
+        )
+    except jwt.PyJWTError:
+        return None
+
+
+def token_username(claims: dict) -> Optional[str]:
+    """从claims还原用户名；可能被截断时返回None（需查Redis）"""
+    name = claims.get(NAME_CLAIM)
+    if not isinstance(name, str):
+        return None
+    username = name.rstrip(" ")
+    if len(username) >= NAME_CLAIM_LENGTH:
+        return None
+    return username
+
+
+def is_revoked(username: str, claims: dict) -> bool:
+    """token是否已被吊销（按jti单个吊销，或按用户吊销该时间之前签发的全部token）"""
+    if _revoked_jti and _jti_member(claims) in _revoked_jti:
+        return True
+    cutoff = _revoked_before.get(username)
+    if cutoff is None:
+        return False
+    issued_at = claims["exp"] - TOKEN_EXPIRE_SECONDS
+    return issued_at < cutoff
+
+
+# ==================== 吊销 ====================
+def _jti_member(claims: dict) -> str:
+    return f"{claims.get('jti')}:{claims['exp']}"
+
+
+async def revoke_user_tokens(username: str) -> None:
+    """
+    吊销该用户此前签发的全部token（修改密码、禁用账号时调用）
+
+    签发时间只精确到秒：吊销点取下一整秒，当前这一秒及之前签发的token全部失效，
+    之后签发的token从该秒开始计时（mint_token 和登录脚本保证不早于吊销点）
+    """
+    cutoff = int(time.time()) + 1
+    _revoked_before[username] = cutoff
+    if not runtime.redis_client:
+        return
+    pipe = runtime.redis_client.pipeline(transaction=True)
+    pipe.hset(REVOKED_BEFORE_KEY, username, cutoff)
+    pipe.delete(f"{CURRENT_TOKEN_KEY_PREFIX}{username}")  # 下次登录签发新token
+    pipe.incr(REVOCATION_VERSION_KEY)
+    await pipe.execute()
+
+
+async def revoke_token(token: str) -> bool:
+    """吊销单个token，返回token是否有效"""
+    claims = decode_token(token)
+    if claims is None or claims.get("jti") is None:
+        return False
+    member = _jti_member(claims)
+    _revoked_jti[member] = claims["exp"]
+    if runtime.redis_client:
+        pipe = runtime.redis_client.pipeline(transaction=True)
+        pipe.zadd(REVOKED_JTI_KEY, {member: claims["exp"]})
+        pipe.delete(f"{TOKEN_KEY_PREFIX}{token}")  # 登录时不再复用该token
+        pipe.incr(REVOCATION_VERSION_KEY)
+        await pipe.execute()
+    return True
+
+
+async def sync_revocations() -> bool:
+    """版本变化时从Redis重新加载吊销信息，返回是否重新加载"""
+    global _revoked_before, _revoked_jti, _revocation_version
+    version = int(await runtime.redis_client.get(REVOCATION_VERSION_KEY) or 0)
+    if version == _revocation_version:
+        return False
+    now = time.time()
+    # 清理已过期的jti（过期的token本身已无法通过校验）
+    await runtime.redis_client.zremrangebyscore(REVOKED_JTI_KEY, "-inf", now)
+    # 按用户吊销的时间点超过token有效期后也不再需要
+    before = await runtime.redis_client.hgetall(REVOKED_BEFORE_KEY)
+    jtis = await runtime.redis_client.zrange(REVOKED_JTI_KEY, 0, -1, withscores=True)
+    _revoked_before = {
+        name: int(float(ts)) for name, ts in before.items() if float(ts) > now - TOKEN_EXPIRE_SECONDS
+    }
+    _revoked_jti = {member: exp for member, exp in jtis}
+    _revocation_version = version
+    return True
+
+
+async def revocation_sync_task() -> None:
+    """每隔 TOKEN_REVOCATION_POLL_INTERVAL 秒检查一次吊销版本号"""
+    while True:
+        try:
+            if runtime.redis_client:
+                await sync_revocations()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("同步token吊销信息失败", error=e, rate_limit=5)
+        await asyncio.sleep(settings.token_revocation_poll_interval)
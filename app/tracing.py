@@ -0,0 +1,168 @@
+"""
+请求阶段计时模块
+记录一次解密请求在各阶段（认证、查用户、扣费、等待空闲服务器、排队、上游调用等）的耗时，
+通过 Server-Timing 响应头返回，并保留每分钟最慢的N个请求供管理接口查询
+
+当前请求的计时记录保存在 contextvars 中，同一请求内的函数直接用 span() 记录，无需层层传参；
+Worker 在独立任务中处理密钥包，其阶段耗时随任务结果写回，由等待方合并
+"""
+import contextvars
+import heapq
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .config import settings
+
+
+class Trace:
+    """单个请求的阶段耗时记录"""
+
+    __slots__ = ("path", "start", "spans", "meta")
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []  # [(阶段名, 耗时秒)]
+        self.meta: Dict[str, str] = {}  # 附加信息（用户名、包类型等）
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans.append((name, seconds))
+
+    def merge(self, spans) -> None:
+        """合并其他任务记录的阶段（如Worker返回的 [[name, seconds], ...]）"""
+        for name, seconds in spans or ():
+            self.spans.append((name, float(seconds)))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头（耗时单位毫秒）"""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def start_trace(path: str = "") -> Trace:
+    """开始记录当前请求（由中间件调用）"""
+    trace = Trace(path)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def use_trace(trace: Trace) -> None:
+    """在后台任务中切换到指定的记录（Worker处理密钥包时使用）"""
+    _current.set(trace)
+
+
+@contextmanager
+def span(name: str):
+    """记录一个阶段的耗时；当前没有请求记录时只计时不保存"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace = _current.get()
+        if trace is not None:
+            trace.add(name, time.perf_counter() - start)
+
+
+# ==================== 慢请求采集 ====================
+class SlowRequestLog:
+    """
+    每分钟保留最慢的 top_n 个请求，最近 minutes 分钟组成环形缓冲区
+
+    当前分钟用大小为 top_n 的最小堆维护，进入下一分钟时排序后归档
+    """
+
+    def __init__(self, top_n: int, minutes: int):
+        self.top_n = top_n
+        self._minute = 0
+        self._heap: List[Tuple[float, int, dict]] = []
+        self._seq = 0
+        self._history: Deque[Tuple[int, List[dict]]] = deque(maxlen=minutes)
+
+    def _roll(self, minute: int) -> None:
+        if minute != self._minute:
+            if self._heap:
+                entries = [entry for _, _, entry in sorted(self._heap, reverse=True)]
+                self._history.append((self._minute, entries))
+            self._minute = minute
+            self._heap = []
+
+    def record(self, trace: Trace, status_code: int) -> None:
+        total = trace.elapsed()
+        self._roll(int(time.time() // 60))
+        if len(self._heap) >= self.top_n and total <= self._heap[0][0]:
+            return
+        entry = {
+            "path": trace.path,
+            "status": status_code,
+            "total_ms": round(total * 1000, 1),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "stages": [{"name": name, "ms": round(seconds * 1000, 1)} for name, seconds in trace.spans],
+            **trace.meta,
+        }
+        self._seq += 1
+        item = (total, self._seq, entry)
+        if len(self._heap) >= self.top_n:
+            heapq.heapreplace(self._heap, item)
+        else:
+            heapq.heappush(self._heap, item)
+
+    def snapshot(self) -> List[dict]:
+        """按分钟倒序返回 [{"minute": "...", "requests": [...]}]"""
+        self._roll(int(time.time() // 60))
+        minutes = list(self._history)
+        if self._heap:
+            minutes.append((self._minute, [entry for _, _, entry in sorted(self._heap, reverse=True)]))
+        return [
+            {"minute": time.strftime("%Y-%m-%d %H:%M", time.localtime(minute * 60)), "requests": entries}
+            for minute, entries in reversed(minutes)
+        ]
+
+
+slow_requests = SlowRequestLog(settings.slow_request_top_n, settings.slow_request_minutes)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI中间件：为指定前缀的请求开启阶段计时，响应头附加 Server-Timing，并采集慢请求
+
+    直接实现ASGI接口（不用 BaseHTTPMiddleware），不额外包装请求/响应体
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/yd/"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        trace = start_trace(scope["path"])
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            slow_requests.record(trace, status_code)
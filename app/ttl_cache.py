@@ -0,0 +1,115 @@
+"""
+有界TTL-LRU缓存
+登录token、账号密码校验结果等进程内缓存共用，条目数有上限，超出时按LRU淘汰最久未访问的条目（O(1)）；
+条目过期后在访问或淘汰时删除
+
+每个缓存记录命中率、淘汰数和估算的内存占用，/api/server/stats 和 /metrics 中输出
+"""
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def _default_sizeof(key, value) -> int:
+    """估算条目占用的字节数（键+值，不含字典本身的开销）"""
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, tuple):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class TTLCache:
+    """
+    有界TTL-LRU缓存（仅在事件循环线程内使用，不加锁）
+
+    Args:
+        name: 缓存名称（统计输出用）
+        maxsize: 最多条目数
+        ttl: 默认存活时间（秒）
+        sizeof: 估算条目字节数的函数 (key, value) -> int
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float,
+                 sizeof: Callable[[Any, Any], int] = _default_sizeof):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sizeof = sizeof
+        # {key: (value, 过期时间monotonic, 字节数)}，顺序即LRU顺序（末尾为最近访问）
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        _registry.append(self)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[1] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if key in self._data:
+            self._remove(key)
+        now = time.monotonic()
+        # 先清理队首已过期的条目，再按LRU淘汰到容量以内
+        while self._data:
+            oldest_key, oldest = next(iter(self._data.items()))
+            if oldest[1] > now and len(self._data) < self.maxsize:
+                break
+            self._remove(oldest_key)
+            if oldest[1] > now:
+                self.evictions += 1
+            else:
+                self.expirations += 1
+        nbytes = self._sizeof(key, value)
+        self._data[key] = (value, now + (self.ttl if ttl is None else ttl), nbytes)
+        self.memory_bytes += nbytes
+
+    def pop(self, key: Hashable) -> None:
+        if key in self._data:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.memory_bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, nbytes = self._data.pop(key)
+        self.memory_bytes -= nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "memory_bytes": self.memory_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# 已创建的缓存（统计输出用）
+_registry: List[TTLCache] = []
+
+
+def get_cache_stats() -> List[Dict[str, Any]]:
+    return [cache.stats() for cache in _registry]
@@ -0,0 +1,195 @@
+"""
+用户信息本地缓存
+解密接口每次请求都要用到用户的ID、状态、优先级、更新时间和总配额，这些字段只在管理员修改用户时变化，
+缓存在进程内后，稳态下解密路径不再查询 sys_user
+
+失效方式：
+1. 管理员修改用户后调用 invalidate_user()（或管理接口）：Redis 版本号加1，并通过 pub/sub 通知各进程删除该用户
+2. 后台任务定期比对 Redis 版本号，发现漏收的通知时清空本地缓存；
+   管理后台无法发布消息时，直接 INCR user_cache:version 即可让所有进程失效
+3. 条目有最长存活时间（USER_CACHE_TTL），Redis 不可用时也不会无限期使用旧数据
+
+已用次数不在缓存中，配额以扣费时的原子更新为准
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
+
+from .config import settings
+from . import runtime
+from .db import execute_read
+from .logger import get_logger
+from .models import SysUser
+from .ttl_cache import TTLCache
+
+log = get_logger(__name__)
+
+USER_CACHE_VERSION_KEY = "user_cache:version"  # 全局版本号，每次失效加1
+USER_CACHE_CHANNEL = "user_cache:invalidate"  # 失效通知，消息格式 "版本号:用户名"
+_ALL_USERS = "*"  # 通知中表示清空全部
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """解密路径用到的用户字段（不含密码和已用次数）"""
+    user_id: int
+    user_name: str
+    status: Optional[str]
+    priority: int
+    update_time: Optional[datetime]
+    total_requests: Optional[int]
+
+
+_COLUMNS = (
+    SysUser.user_id,
+    SysUser.user_name,
+    SysUser.status,
+    SysUser.priority,
+    SysUser.update_time,
+    SysUser.total_requests,
+)
+
+# {用户名: (用户信息, 过期时间monotonic)}
+_cache: Dict[str, Tuple[CachedUser, float]] = {}
+# 本地失效次数：查询期间发生失效时，查询结果不写入缓存（避免写回旧数据）
+_generation = 0
+_cleared_at = 0  # 最近一次清空全部时的失效次数
+# {用户名: 最近一次失效时的失效次数}：只需覆盖仍可能被引用的失效次数（账号密码校验记录最长存活
+# CREDENTIAL_CACHE_TTL，查询中的缓存写入只持续一次查库），过期条目按"未失效"处理
+_INVALIDATION_TTL = max(settings.credential_cache_ttl, 60.0)
+_INVALIDATION_HISTORY_SIZE = 100000
+_invalidated_at = TTLCache("user_invalidation", maxsize=_INVALIDATION_HISTORY_SIZE, ttl=_INVALIDATION_TTL)
+# 最近确认的 Redis 版本号（None 表示尚未同步）
+_version: Optional[int] = None
+
+
+async def _load_user(username: str) -> Optional[CachedUser]:
+    res = await execute_read(select(*_COLUMNS).where(SysUser.user_name == username))
+    row = res.first()
+    return CachedUser(*row) if row else None
+
+
+def current_generation() -> int:
+    """当前失效次数：查询前记录，写入缓存前用 changed_since() 判断期间是否发生过失效"""
+    return _generation
+
+
+def changed_since(username: str, generation: int) -> bool:
+    """该用户在 generation 之后是否被失效过（修改了状态、密码等）"""
+    return max(_cleared_at, _invalidated_at.get(username, 0)) > generation
+
+
+def _store(user: CachedUser, generation: int) -> None:
+    if not changed_since(user.user_name, generation) and settings.user_cache_ttl > 0:
+        _cache[user.user_name] = (user, time.monotonic() + settings.user_cache_ttl)
+
+
+async def get_cached_user(username: str) -> Optional[CachedUser]:
+    """获取用户信息：命中缓存时不查数据库；用户不存在返回None（不缓存）"""
+    entry = _cache.get(username)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    generation = _generation
+    user = await _load_user(username)
+    if user is not None:
+        _store(user, generation)
+    return user
+
+
+def peek_cached_user(username: str) -> Optional[CachedUser]:
+    """只查本地缓存，不查数据库（未缓存或已过期返回None）"""
+    entry = _cache.get(username)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+
+def remember_user(user: SysUser) -> CachedUser:
+    """用已查询到的完整用户记录填充缓存（登录、密码认证时顺带写入，后续token请求直接命中）"""
+    cached = CachedUser(*(getattr(user, column.key) for column in _COLUMNS))
+    _store(cached, _generation)
+    return cached
+
+
+def invalidate_local(username: Optional[str] = None) -> None:
+    """删除本进程缓存中的用户（username为空时清空全部）"""
+    global _generation, _cleared_at
+    _generation += 1
+    # 失效记录已满时按清空全部处理：淘汰任何一条都可能让该用户的旧校验记录继续有效
+    if username is None or username == _ALL_USERS or len(_invalidated_at) >= _INVALIDATION_HISTORY_SIZE:
+        _cache.clear()
+        _invalidated_at.clear()
+        _cleared_at = _generation
+    else:
+        _cache.pop(username, None)
+        _invalidated_at.set(username, _generation)
+
+
+async def invalidate_user(username: Optional[str] = None) -> None:
+    """管理员修改用户后调用：通知所有进程删除该用户的缓存（username为空时清空全部）"""
+    invalidate_local(username)
+    if not runtime.redis_client:
+        return
+    version = await runtime.redis_client.incr(USER_CACHE_VERSION_KEY)
+    await runtime.redis_client.publish(USER_CACHE_CHANNEL, f"{version}:{username or _ALL_USERS}")
+
+
+def get_user_cache_size() -> int:
+    return len(_cache)
+
+
+# ==================== 后台同步 ====================
+def _handle_message(data: str) -> None:
+    """处理失效通知；版本号连续时顺带推进本地版本，不连续说明有通知漏收，交给版本比对兜底"""
+    global _version
+    version, _, username = data.partition(":")
+    invalidate_local(username)
+    if _version is not None and version.isdigit() and int(version) == _version + 1:
+        _version = int(version)
+
+
+async def _check_version() -> None:
+    """比对 Redis 版本号，与本地不一致时清空缓存"""
+    global _version
+    version = int(await runtime.redis_client.get(USER_CACHE_VERSION_KEY) or 0)
+    if version != _version:
+        invalidate_local()
+        _version = version
+
+
+async def user_cache_sync_task() -> None:
+    """订阅失效通知，并每隔 USER_CACHE_POLL_INTERVAL 秒比对一次版本号"""
+    global _version
+    while True:
+        pubsub = None
+        try:
+            pubsub = runtime.redis_client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(USER_CACHE_CHANNEL)
+            # 订阅成功后再同步版本号，之后的修改一定能通过通知或下次比对发现
+            await _check_version()
+            next_check = time.monotonic() + settings.user_cache_poll_interval
+            while True:
+                message = await pubsub.get_message(timeout=1.0)
+                if message and message.get("type") == "message":
+                    _handle_message(message["data"])
+                if time.monotonic() >= next_check:
+                    await _check_version()
+                    next_check = time.monotonic() + settings.user_cache_poll_interval
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 断线期间可能漏收通知：清空缓存，重连后重新同步版本号
+            log.error("用户缓存同步失败，1秒后重连", error=e, rate_limit=5)
+            invalidate_local()
+            _version = None
+            await asyncio.sleep(1)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
@@ -0,0 +1,80 @@
+"""
+启动预热与就绪状态
+新实例启动后，第一批请求要为每台服务器付出 TLS 握手、HTTP/2 建连和 /api/login 的往返时间。
+启动时并发完成以下步骤，全部结束后 /ready 才返回就绪，滚动发布时负载均衡器不会把冷流量打到新实例：
+1. 并发登录所有服务器（获取token）
+2. 每台服务器发起 WARMUP_CONNECTIONS_PER_SERVER 个并发 HEAD 请求，在 runtime.http_b_client 的连接池中建立保活连接
+   （HTTP/2 服务器的并发请求复用同一条连接，实际只建立一条）
+
+单台服务器预热失败只记录日志，不阻止就绪（该服务器的第一个请求会按原流程登录）；
+整个预热阶段最长 WARMUP_TIMEOUT 秒，超时后同样视为完成。关闭时先退出就绪状态
+"""
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from .config import settings
+from . import runtime
+from .load_balancer import ServerInfo, get_all_servers
+from .logger import get_logger
+from .worker import get_valid_token_for_server
+
+log = get_logger(__name__)
+
+# 预热结果：{"duration": 秒, "servers": [{"idx", "login", "connections", "error"}]}
+_report: Dict[str, Any] = {}
+
+
+def is_ready() -> bool:
+    return runtime.ready
+
+
+def mark_not_ready() -> None:
+    """关闭时调用：/ready 立即返回未就绪，负载均衡器停止派发新请求"""
+    runtime.ready = False
+
+
+def get_warmup_report() -> Dict[str, Any]:
+    return _report
+
+
+async def _open_connection(server: ServerInfo) -> bool:
+    try:
+        await runtime.http_b_client.head(f"{server.url}/", timeout=10)
+        return True
+    except Exception:
+        return False
+
+
+async def _warm_server(server: ServerInfo, result: Dict[str, Any]) -> None:
+    try:
+        await get_valid_token_for_server(server)
+        result["login"] = True
+    except Exception as e:
+        result["error"] = str(e)
+        log.error("预热登录失败", server=server.idx, error=e)
+    opened = await asyncio.gather(
+        *(_open_connection(server) for _ in range(settings.warmup_connections_per_server))
+    )
+    result["connections"] = sum(opened)
+
+
+async def warm_up() -> None:
+    """登录所有服务器并建立保活连接，完成（或超时）后进入就绪状态"""
+    global _report
+    start = time.monotonic()
+    servers = get_all_servers()
+    results: List[Dict[str, Any]] = [
+        {"idx": server.idx, "login": False, "connections": 0, "error": None} for server in servers
+    ]
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(_warm_server(server, result) for server, result in zip(servers, results))),
+            timeout=settings.warmup_timeout,
+        )
+    except asyncio.TimeoutError:
+        log.warning("启动预热超时，直接进入就绪状态", timeout=settings.warmup_timeout)
+    _report = {"duration": round(time.monotonic() - start, 3), "servers": results}
+    runtime.ready = True
+    log.info("启动预热完成", duration=_report["duration"],
+             logged_in=sum(1 for r in results if r["login"]), servers=len(results))
@@ -1,14 +1,20 @@
 import asyncio
-import json
-from datetime import datetime, timedelta
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional
 
 import httpx
-from sqlalchemy import update, delete, select
+from sqlalchemy import update, select
 
 from .config import settings
 from .db import AsyncSessionLocal  # 修正为相对导入
 from .models import SysUser, ServerStats, ServerKeyRelation, UserDecryptLog
 from . import runtime
+from . import codec
+from .logger import get_logger
+from .metrics import STAGE_SECONDS, UPSTREAM_REQUESTS
+from .tracing import Trace, span, use_trace
 from .load_balancer import (
     on_keygen_result,
     get_server,
@@ -16,6 +22,103 @@ from .load_balancer import (
     ServerInfo
 )
 from .key_cache import is_in_keygen_succ
+from .task_service import QUEUE_KEY, claim_task, requeue_task, set_task_state, task_state_key
+from .task_codec import decode_task, resolve_username
+
+
+log = get_logger(__name__)
+
+# 每台服务器的本地派发队列：{server_idx: asyncio.Queue[(job, score, member)]}
+# 分发器按优先级从 QUEUE_KEY 认领任务放入对应服务器的队列，各服务器的消费者独立处理，
+# 慢服务器只会阻塞自己的队列，不会拖住其他服务器的任务
+_server_queues: Dict[int, asyncio.Queue] = {}
+
+# Worker运行指标（按服务器统计，供 worker_pool 扩缩容决策使用）
+_active_jobs: Dict[int, int] = defaultdict(int)  # 正在处理中的任务数
+_processed_jobs: Dict[int, int] = defaultdict(int)  # 累计处理完成的任务数
+_upstream_latency_ewma: Dict[int, float] = defaultdict(float)  # 上游解密调用耗时的指数滑动平均（秒）
+UPSTREAM_LATENCY_ALPHA = 0.2  # EWMA平滑系数
+# 出队时丢弃的任务数：expired=已过截止时间，abandoned=客户端已放弃等待
+_dropped_jobs: Dict[str, int] = {"expired": 0, "abandoned": 0}
+
+
+def get_server_queue(server_idx: int) -> asyncio.Queue:
+    """获取（必要时创建）指定服务器的本地派发队列"""
+    queue = _server_queues.get(server_idx)
+    if queue is None:
+        queue = asyncio.Queue(maxsize=settings.server_queue_prefetch)
+        _server_queues[server_idx] = queue
+    return queue
+
+
+def get_worker_metrics(server_idx: int) -> dict:
+    """获取指定服务器的Worker运行指标"""
+    queue = _server_queues.get(server_idx)
+    return {
+        "active_jobs": _active_jobs[server_idx],
+        "processed_jobs": _processed_jobs[server_idx],
+        "local_queue": queue.qsize() if queue else 0,
+        "upstream_latency": _upstream_latency_ewma[server_idx],
+    }
+
+
+def get_dropped_stats() -> dict:
+    """获取出队时被丢弃的任务统计"""
+    return dict(_dropped_jobs)
+
+
+async def _drop_reason(job: dict) -> Optional[str]:
+    """
+    判断任务是否应在发往服务器之前丢弃
+
+    Returns:
+        "expired"（已过截止时间）、"abandoned"（客户端已放弃或状态已过期），否则 None
+    """
+    deadline = job.get("deadline")
+    if deadline and time.time() >= deadline:
+        return "expired"
+    if runtime.redis_client:
+        state = await runtime.redis_client.hget(task_state_key(job["task_id"]), "status")
+        # 状态key不存在说明已超时过期，等待方早已返回
+        if state is None or state == "abandoned":
+            return "abandoned"
+    return None
+
+
+async def _drop_job(job: dict, reason: str) -> None:
+    """丢弃任务：回滚处理中状态，并计入统计"""
+    _dropped_jobs[reason] += 1
+    drone_id = job.get("drone_id", "")
+    if drone_id:
+        await on_keygen_result(hash_code=drone_id, server_idx=job.get("server_idx", 0), success=False)
+    if runtime.redis_client:
+        await runtime.redis_client.delete(task_state_key(job["task_id"]))
+    log.info("丢弃任务", task_id=job.get("task_id"), reason=reason, rate_limit=10)
+
+
+async def _fail_unroutable(job: dict) -> None:
+    """目标服务器不存在的任务：标记失败并释放密钥生成占位"""
+    server_idx = job.get("server_idx", 0)
+    log.error("任务的目标服务器不存在，标记失败", task_id=job.get("task_id"), server=server_idx, rate_limit=10)
+    drone_id = job.get("drone_id", "")
+    if drone_id:
+        await on_keygen_result(hash_code=drone_id, server_idx=server_idx, success=False)
+    await set_task_state(job["task_id"], {
+        "status": "failed",
+        "error": f"Task processing failed: 服务器 {server_idx} 不存在",
+        "finish_time": datetime.now().isoformat(),
+    })
+
+
+def _record_upstream_latency(server_idx: int, seconds: float) -> None:
+    """记录一次上游调用耗时"""
+    current = _upstream_latency_ewma[server_idx]
+    if current == 0.0:
+        _upstream_latency_ewma[server_idx] = seconds
+    else:
+        _upstream_latency_ewma[server_idx] = current + UPSTREAM_LATENCY_ALPHA * (seconds - current)
+
+
 async def get_valid_token_for_server(server: ServerInfo) -> str:
     """
     获取指定服务器的有效JWT Token，23小时自动刷新
@@ -28,7 +131,7 @@ async def get_valid_token_for_server(server: ServerInfo) -> str:
     """
     # 检查是否需要刷新Token
     if server.need_refresh_token():
-        print(f" 刷新服务器 {server.idx} ({server.url}) 的Token...")
+        log.info("刷新服务器Token", server=server.idx, url=server.url)
         
         # 调用该服务器的登录API获取新Token
         try:
@@ -42,25 +145,24 @@ async def get_valid_token_for_server(server: ServerInfo) -> str:
             # 检查是否被重定向（301/302），说明服务器强制要求HTTPS
             if resp.status_code in (301, 302, 303, 307, 308):
                 redirect_location = resp.headers.get("Location", "")
-                print(f"  服务器 {server.idx} 返回重定向: {resp.status_code} -> {redirect_location}")
+                log.error("服务器返回重定向", server=server.idx, status=resp.status_code, location=redirect_location)
                 raise Exception(f"服务器配置错误: URL应该使用HTTPS而不是HTTP (当前: {server.url})")
             
             resp.raise_for_status()
-            data = resp.json()
+            data = codec.loads(resp.content)
             
-            print(f" 服务器 {server.idx} 登录响应: success={data.get('success')}, msg='{data.get('msg')}'")
+            log.debug("服务器登录响应", server=server.idx, success=data.get("success"), upstream_msg=data.get("msg"))
             
             if data.get("success") and "data" in data and "token" in data["data"]:
                 server.update_token(data["data"]["token"])
-                print(f" 服务器 {server.idx} Token刷新成功")
-                print(f" Token: {server.token[:50]}...")
+                log.info("服务器Token刷新成功", server=server.idx)
             else:
                 error_msg = f"登录失败: {data.get('msg', 'Unknown error')}"
-                print(f" 服务器 {server.idx} {error_msg}")
+                log.error("服务器登录失败", server=server.idx, upstream_msg=data.get("msg"))
                 raise Exception(error_msg)
                 
         except Exception as e:
-            print(f" 服务器 {server.idx} 获取Token失败: {e}")
+            log.error("获取服务器Token失败", server=server.idx, error=e)
             raise Exception(f"服务器 {server.idx} Token获取失败")
     
     if server.token is None:
@@ -69,6 +171,14 @@ async def get_valid_token_for_server(server: ServerInfo) -> str:
     return server.token
 
 
+_TOKEN_MARKER = b"token"
+
+
+def _has_token_marker(content: bytes) -> bool:
+    """字节级检查响应中是否可能包含token错误信息（大小写不敏感）"""
+    return _TOKEN_MARKER in content.lower()
+
+
 async def server_request_with_token_retry(server: ServerInfo, url: str, params: dict, timeout=30, max_retry=3):
     """
     请求指定服务器，遇到token失效时自动刷新token并重试一次。
@@ -83,6 +193,10 @@ async def server_request_with_token_retry(server: ServerInfo, url: str, params:
     检测token失效的条件：
     1. HTTP状态码为401
     2. 响应中包含token相关错误信息
+
+    Returns:
+        (response, result)：result 为检测token时解析出的响应JSON，
+        响应不含token标记（未解析）或解析失败时为 None
     """
     for attempt in range(max_retry + 1):
         # 获取该服务器的有效token（内部有缓存，过期才刷新）
@@ -95,66 +209,148 @@ async def server_request_with_token_retry(server: ServerInfo, url: str, params:
         
         # 检测是否token失效
         is_token_invalid = False
+        result = None
         
         # 条件1: HTTP 401
         if response.status_code == 401:
             is_token_invalid = True
-            print(f" 服务器 {server.idx} 检测到401错误，token可能失效")
+            log.warning("检测到401错误，token可能失效", server=server.idx)
         
         # 条件2: 响应中包含token错误
-        elif response.status_code == 200:
+        # 先在原始字节上查找 "token"，绝大多数正常响应不含该标记，无需解析JSON
+        elif response.status_code == 200 and _has_token_marker(response.content):
             try:
-                result = response.json()
+                result = codec.loads(response.content)
                 if isinstance(result, dict):
                     msg = str(result.get("msg", "")).lower()
                     if "token" in msg and ("invalid" in msg or "expired" in msg or "失效" in msg):
                         is_token_invalid = True
-                        print(f"服务器 {server.idx} 响应中包含token失效信息: {result.get('msg')}")
+                        log.warning("响应中包含token失效信息", server=server.idx, msg=result.get("msg"))
             except Exception:
                 pass
         
         # 如果token失效且还有重试次数，则刷新token并重试
         if is_token_invalid and attempt < max_retry:
-            print(f" 服务器 {server.idx} Token失效，强制刷新并重试... (尝试 {attempt + 1}/{max_retry + 1})")
+            log.info("Token失效，强制刷新并重试", server=server.idx, attempt=attempt + 1, max_attempts=max_retry + 1)
             server.invalidate_token()
             continue
         
         # 否则返回响应
-        return response
+        return response, result
     
-    return response
+    return response, result
 
 
-async def worker_loop():
+async def dispatcher_loop():
     """
-    工作线程主循环，从优先级队列中获取并处理任务
-    
-    使用Redis有序集合(sorted set)的ZPOPMIN命令获取分数最小（优先级最高）的任务
+    分发器主循环：按优先级从共享队列认领任务，放入各服务器的本地队列
+
+    每轮用ZRANGE查看分数最小的一批任务，跳过本地队列已满的服务器，
+    通过认领脚本原子地ZREM（返回成功才算认领，多进程部署时也不会重复处理）
+
+    目标服务器已不在当前服务器列表中（重启后列表变化，或由服务器列表不同的进程入队）的任务
+    没有消费者处理，认领后直接标记失败，不放入本地队列（数据包的密钥只在原服务器上，不能改派）
     """
-    print(" Worker started!")
+    print(" Dispatcher started!")
     if not runtime.redis_client:
         print("Redis client not initialized")
         return
+
+    try:
+        while True:
+            try:
+                dispatched = 0
+                queue_client = runtime.redis_queue_client or runtime.redis_client
+                items = await queue_client.zrange(
+                    QUEUE_KEY, 0, settings.dispatch_scan_window - 1, withscores=True
+                )
+                for item, score in items:
+                    job = decode_task(item)
+                    server_idx = job.get("server_idx", 0)
+                    if get_server(server_idx) is None:
+                        if await claim_task(item, score, await resolve_username(job)):
+                            await _fail_unroutable(job)
+                            dispatched += 1
+                        continue
+                    queue = get_server_queue(server_idx)
+                    if queue.full():
+                        # 该服务器消费不过来，跳过，让后面其他服务器的任务先走
+                        continue
+                    username = await resolve_username(job)
+                    if await claim_task(item, score, username):
+                        queue.put_nowait((job, score, item))
+                        dispatched += 1
+
+                if not dispatched:
+                    # 队列为空或各服务器都满，短暂等待后再检查
+                    await asyncio.sleep(0.01)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("Dispatcher loop error", error=e, rate_limit=1)
+                await asyncio.sleep(1)
+    except asyncio.CancelledError:
+        print("✅ Dispatcher正常停止")
+        return
+
+
+async def requeue_local_jobs() -> int:
+    """
+    将本地队列中已认领但尚未处理的任务放回共享队列（停机时调用，避免任务丢失）
+
+    Returns:
+        放回的任务数
+    """
+    if not runtime.redis_client:
+        return 0
+    returned = 0
+    for queue in _server_queues.values():
+        while not queue.empty():
+            job, score, member = queue.get_nowait()
+            await requeue_task(member, score, job.get("username", ""))
+            returned += 1
+    return returned
+
+
+async def worker_loop(server_idx: int, stop_event: Optional[asyncio.Event] = None):
+    """
+    工作线程主循环，处理指定服务器本地队列中的任务
     
-    queue_key = "queue:priority"
+    Args:
+        server_idx: 该Worker负责的服务器索引
+        stop_event: 缩容信号，设置后处理完当前任务即退出（None表示一直运行）
+    """
+    print(f" Worker started for server {server_idx}!")
+    queue = get_server_queue(server_idx)
     
     try:
-        while True:
+        while stop_event is None or not stop_event.is_set():
             try:
-                # 使用ZPOPMIN获取分数最小（优先级最高）的任务
-                result = await runtime.redis_client.zpopmin(queue_key, 1)
-                
-                if result:
-                    # result格式: [(member, score)]
-                    item, score = result[0]
-                    job = json.loads(item)
-                    print(f" Got job from queue: {job.get('task_id')}")
-                    
-                    # 直接处理任务
+                # 带超时等待，便于及时响应缩容信号
+                try:
+                    job, _, _ = await asyncio.wait_for(queue.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+                log.debug("Got job from queue", task_id=job.get("task_id"), server=server_idx)
+                if job.get("deadline"):
+                    # 截止时间 = 入队时间 + queue_wait_timeout，据此推算排队时长
+                    enqueued_at = job["deadline"] - settings.queue_wait_timeout
+                    STAGE_SECONDS.observe(time.time() - enqueued_at, "queue_wait")
+
+                # 客户端已超时或放弃等待的任务直接丢弃，不占用服务器
+                reason = await _drop_reason(job)
+                if reason:
+                    await _drop_job(job, reason)
+                    continue
+
+                # 直接处理任务
+                _active_jobs[server_idx] += 1
+                try:
                     await process_job(job)
-                else:
-                    # 队列为空，短暂等待后再检查
-                    await asyncio.sleep(0.01)
+                finally:
+                    _active_jobs[server_idx] -= 1
+                    _processed_jobs[server_idx] += 1
                     
             except asyncio.CancelledError:
                 # Worker被取消，正常退出
@@ -163,7 +359,7 @@ async def worker_loop():
             except Exception as e:
                 # 出现异常时等待后继续
                 error_str = str(e)
-                print(f"  Worker loop error: {error_str}")
+                log.error("Worker loop error", server=server_idx, error=error_str, rate_limit=1)
                 
                 # 简单退避策略
                 await asyncio.sleep(1)
@@ -184,20 +380,27 @@ async def process_job(job: dict):
     server_idx = job.get("server_idx", 0)  # 目标服务器索引
     start_time = datetime.now().isoformat()  # 使用本地时间
 
-    # 设置任务为处理中状态
+    # 本任务的阶段耗时，随结果写回，由等待方合并到请求的 Server-Timing 中
+    trace = Trace()
+    use_trace(trace)
+    if job.get("deadline"):
+        trace.add("queue", time.time() - (job["deadline"] - settings.queue_wait_timeout))
+
+    # 设置任务为处理中状态（客户端在出队检查之后才放弃、或状态已过期时不再处理）
     if runtime.redis_client:
-        await runtime.redis_client.set(
-            f"task:{task_id}", 
-            json.dumps({
-                "status": "processing",
-                "username": username,
-                "start_time": start_time,
-                "server_idx": server_idx  # 记录处理服务器
-            }), 
-            ex=settings.queue_wait_timeout
-        )
+        if not await set_task_state(task_id, {
+            "status": "processing",
+            "username": username,
+            "start_time": start_time,
+            "server_idx": server_idx  # 记录处理服务器
+        }):
+            await _drop_job(job, "abandoned")
+            return
 
-    # 速率限制（每秒请求数）
+    # 速率限制（每秒请求数）：先按目标服务器，再按全部服务器总量
+    server_limiter = runtime.b_server_rate_limiters.get(server_idx)
+    if server_limiter:
+        await server_limiter.acquire()
     if runtime.b_rate_limiter:
         await runtime.b_rate_limiter.acquire()
 
@@ -214,48 +417,42 @@ async def process_job(job: dict):
         if not target_server:
             raise Exception(f"服务器 {server_idx} 不存在")
         
-        print(f" 准备处理任务: task_id={task_id}, username={username}, server={server_idx}")
-        print(f"hex数据长度: {len(hex_data)}, 前40字符: {hex_data[:40]}...")
+        log.debug("准备处理任务", task_id=task_id, username=username, server=server_idx, hex_len=len(hex_data))
         
         # 《=========================== 更新数据库lastRequestTime ============================》
         # 从队列拿出密钥包，发往服务器之前更新最后请求时间
         try:
-            async with AsyncSessionLocal() as db_session:
-                result_update = await db_session.execute(
-                    update(SysUser)
-                    .where(SysUser.user_name == username)
-                    .values(lastRequestTime=datetime.now())
-                )
-                await db_session.commit()
+            with span("db_last_request"):
+                async with AsyncSessionLocal() as db_session:
+                    result_update = await db_session.execute(
+                        update(SysUser)
+                        .where(SysUser.user_name == username)
+                        .values(lastRequestTime=datetime.now())
+                    )
+                    await db_session.commit()
                 # 检查是否更新成功（如果用户不存在，rowcount为0）
                 if result_update.rowcount == 0:
-                    print(f" 警告：用户 {username} 不存在，无法更新lastRequestTime")
+                    log.warning("用户不存在，无法更新lastRequestTime", username=username)
         except Exception as db_error:
             # 数据库更新失败不应该影响主业务流程，只记录日志
-            print(f"更新lastRequestTime失败: {db_error}")
+            log.error("更新lastRequestTime失败", error=db_error, rate_limit=1)
 
         # 《===========================调用目标服务器，获取原始响应============================》
         result = await decrypt_with_retry(hex_data, target_server)#调用目标服务器解密数据，自动处理token失效重试
 
-        # 把服务器的响应原样存入Redis，供客户端获取（保留开始时间+完成时间）
+        # 把服务器的响应原样存入Redis，供客户端获取（username/start_time/server_idx 已在处理中状态写入）
         if runtime.redis_client:
-            await runtime.redis_client.set(
-                f"task:{task_id}",
-                json.dumps({
-                    "status": "completed",
-                    "data": result,
-                    "username": username,
-                    "start_time": start_time,
-                    "finish_time": datetime.now().isoformat(),  # 使用本地时间
-                    "server_idx": server_idx
-                }),
-                ex=settings.queue_wait_timeout,
-            )
+            await set_task_state(task_id, {
+                "status": "completed",
+                "data": codec.dumps_bytes(result),
+                "spans": codec.dumps_bytes(trace.spans),
+                "finish_time": datetime.now().isoformat(),  # 使用本地时间
+            })
         # 情况1: 密钥包首次解密成功 - msg="keygen_succ"
         if isinstance(result, dict) and result.get("msg") == "keygen_succ":
             is_keygen_success = True
             KeySucc_Sn = result.get("sn", "")
-            print(f"密钥包首次解密成功 (keygen_succ)，sn={KeySucc_Sn}")
+            log.info("密钥包首次解密成功 (keygen_succ)", task_id=task_id, sn=KeySucc_Sn)
             try:
                 async with AsyncSessionLocal() as db_session:
                     # 查询 user_id
@@ -277,7 +474,7 @@ async def process_job(job: dict):
                         db_session.add(ServerKeyRelation(server_id=server_idx, user_id=row.user_id, decrypt_time=datetime.now()))
                     await db_session.commit()
             except Exception as e:
-                print(f"更新数据库失败: {e}")
+                log.error("更新数据库失败", error=e, rate_limit=1)
 
         elif isinstance(result, dict) and result.get("msg") == "keygen_busy":
             try:
@@ -288,11 +485,11 @@ async def process_job(job: dict):
                     )
                     await db_session.commit()
             except Exception as e:
-                print(f"更新 ServerStats 失败: {e}")
+                log.error("更新 ServerStats 失败", error=e, rate_limit=1)
             #需要将服务器标记为忙碌同时需要将密钥加入队列
             set_server_busy(server_idx)
             is_keygen_success = True
-            print(f"密钥包解密返回 keygen_busy，服务器 {server_idx} 标记为忙碌")
+            log.info("密钥包解密返回 keygen_busy，服务器标记为忙碌", task_id=task_id, server=server_idx)
         elif isinstance(result, dict) and result.get("msg")=="key_exist":
             # 需要检查当前缓存key是否存在该密钥，避免和解密服务器存的密钥不同步
             # 如果当前缓存没有该密钥，则需要加上，从而与真实服务器同步
@@ -302,32 +499,26 @@ async def process_job(job: dict):
                     # 标记为成功，这样 finally 中的 on_keygen_result 会将密钥加入缓存
                     is_keygen_success = True
                     KeySucc_Sn = key_exist_sn
-                    print(f"密钥已存在于服务器，将同步到本地缓存: drone_id={drone_id}, sn={key_exist_sn}")
+                    log.info("密钥已存在于服务器，将同步到本地缓存", drone_id=drone_id, sn=key_exist_sn)
         # 情况2: 其他情况不扣费
         else:
-            print(f"  不符合扣费条件，跳过扣费。返回内容: {result}")
+            log.debug("不符合扣费条件，跳过扣费", task_id=task_id, result=result)
         # ⚠ 注意：请求次数已在任务提交时（task_routes.py）累加过了
         # 这里不需要再次累加，否则会导致重复计数
     except Exception as e:
         # 处理失败，记录错误信息和完成时间
         error_detail = str(e)
-        print(f"Task {task_id} failed: {error_detail}")
+        log.error("任务处理失败", task_id=task_id, error=error_detail)
         error_msg = f"Task processing failed: {error_detail}"
         is_keygen_success = False  # 确保失败时不加入缓存
         KeySucc_Sn = ""
         
         if runtime.redis_client:
-            await runtime.redis_client.set(
-                f"task:{task_id}",
-                json.dumps({
-                    "status": "failed",
-                    "error": error_msg,
-                    "username": username,
-                    "start_time": start_time,
-                    "finish_time": datetime.now().isoformat()
-                }),
-                ex=settings.queue_wait_timeout,
-            )
+            await set_task_state(task_id, {
+                "status": "failed",
+                "error": error_msg,
+                "finish_time": datetime.now().isoformat()
+            })
             
     finally:
         # 【关键】无论成功还是失败，都必须清理 _processing_keys
@@ -345,124 +536,81 @@ async def process_job(job: dict):
             runtime.b_concurrency_sema.release()
 
 
-async def decrypt_with_retry(hex_data: str, server: ServerInfo):
+async def _request_decrypt(hex_data: str, server: ServerInfo) -> tuple:
     """
-    调用目标服务器解密数据
-    
-    Args:
-        hex_data: 16进制数据
-        server: 目标服务器信息对象（包含URL、账号、Token等）
+    请求目标服务器的解密接口（自动处理token失效重试），返回原始响应
+
+    Returns:
+        (response, result)：result 同 server_request_with_token_retry
     """
     # 使用缓存的URL，避免每次拼接
     if not hasattr(server, '_decrypt_url'):
         server._decrypt_url = f"{server.url}/api/yd/decryptl"
     decrypt_url = server._decrypt_url
 
-    # 打印完整的请求信息（hex数据截取前20字符）
-    print(f"请求服务器 {server.idx}: URL={decrypt_url}, hex={hex_data[:40]}...")
+    log.debug("请求服务器", server=server.idx, hex_len=len(hex_data))
     
     # 调用目标服务器，自动处理token失效重试
-    response = await server_request_with_token_retry(
-        server=server,
-        url=decrypt_url,
-        params={"hex": hex_data},
-        timeout=30,
-        max_retry=1
-    )
+    request_start = time.monotonic()
+    with span("upstream"):
+        response, result = await server_request_with_token_retry(
+            server=server,
+            url=decrypt_url,
+            params={"hex": hex_data},
+            timeout=30,
+            max_retry=1
+        )
+    upstream_seconds = time.monotonic() - request_start
+    _record_upstream_latency(server.idx, upstream_seconds)
+    STAGE_SECONDS.observe(upstream_seconds, "upstream")
+    UPSTREAM_REQUESTS.inc(server.idx, response.status_code)
     
-    # 打印完整的请求URL（包含参数，但token只显示前20字符）
-    actual_url = str(response.url)
-    if len(actual_url) > 300:
-        # 如果URL太长，截取关键部分显示
-        print(f"📡 实际请求: {actual_url[:150]}...{actual_url[-50:]}")
-    else:
-        print(f"📡 实际请求: {actual_url}")
-
-    # 检查HTTP状态码
+    # 检查HTTP状态码（不记录完整URL，其中带有token）
     if response.status_code != 200:
-        error_detail = f"服务器 {server.idx} 返回错误: HTTP {response.status_code}"
-        print(f" {error_detail}")
-        print(f"   响应内容: {response.text[:200]}")  # 只打印前200字符
+        log.warning("服务器返回错误", server=server.idx, status=response.status_code,
+                    body=response.content[:200], rate_limit=5)
 
-    # 解析响应
-    try:
-        result = response.json()
-        return result
-    except Exception as e:
-        print(f"服务器 {server.idx} 响应解析失败: {e}")
-        raise Exception(f"服务器响应格式错误: {str(e)}")
+    return response, result
 
 
-async def cleanup_old_server_keys(db_session):
+async def decrypt_with_retry(hex_data: str, server: ServerInfo):
     """
-    清理 server_key_relation 表中过期（30天前）的数据
+    调用目标服务器解密数据，返回解析后的响应JSON
+    
+    Args:
+        hex_data: 16进制数据
+        server: 目标服务器信息对象（包含URL、账号、Token等）
     """
-    threshold_date = datetime.now() - timedelta(days=30)
-    await db_session.execute(
-        delete(ServerKeyRelation).where(ServerKeyRelation.decrypt_time < threshold_date)
-    )
-    await db_session.commit()
+    response, result = await _request_decrypt(hex_data, server)
 
+    # 解析响应（检测token时已解析过则直接复用）
+    try:
+        if result is None:
+            result = codec.loads(response.content)
+        return result
+    except Exception as e:
+        log.error("服务器响应解析失败", server=server.idx, error=e)
+        raise Exception(f"服务器响应格式错误: {str(e)}")
 
-async def daily_cleanup_task():
-    """
-    每天凌晨前1秒自动清理 server_key_relation 表中过期（30天前）数据
-    """
-    while True:
-        now = datetime.now()
-        # 计算距离明天凌晨0点0分0秒还有多少秒
-        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        seconds_until_midnight = (tomorrow - now).total_seconds()
-        # 提前1秒
-        sleep_seconds = max(0, seconds_until_midnight - 1)
-        print(f"[定时清理] 距离下次清理还有 {sleep_seconds} 秒")
-        await asyncio.sleep(sleep_seconds)
-        try:
-            async with AsyncSessionLocal() as db_session:
-                await cleanup_old_server_keys(db_session)
-            print(f"[定时清理] {datetime.now()} 已完成 server_key_relation 30天数据清理")
-        except Exception as e:
-            print(f"[定时清理] 清理 server_key_relation 失败: {e}")
-        # 等待1秒，确保不会重复清理
-        await asyncio.sleep(1)
 
-async def cleanup_old_user_decrypt_log(db_session):
-    """
-    清理 user_decrypt_log 表中过期（3天前）的数据
-    """
-    threshold_date = datetime.now() - timedelta(days=3)
-    await db_session.execute(
-        delete(UserDecryptLog).where(UserDecryptLog.decrypt_time < threshold_date)
-    )
-    await db_session.commit()
+DEFAULT_CONTENT_TYPE = "application/json; charset=utf-8"
 
 
-async def daily_cleanup_user_decrypt_log_task():
-    """
-    每天凌晨前1秒自动清理 user_decrypt_log 表中过期（3天前）数据
+async def decrypt_passthrough(hex_data: str, server: ServerInfo) -> tuple:
     """
-    while True:
-        now = datetime.now()
-        # 计算距离明天凌晨0点0分0秒还有多少秒
-        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        seconds_until_midnight = (tomorrow - now).total_seconds()
-        # 提前1秒
-        sleep_seconds = max(0, seconds_until_midnight - 1)
-        print(f"[定时清理] 距离下次 user_decrypt_log 清理还有 {sleep_seconds} 秒")
-        await asyncio.sleep(sleep_seconds)
-        try:
-            async with AsyncSessionLocal() as db_session:
-                await cleanup_old_user_decrypt_log(db_session)
-            print(f"[定时清理] {datetime.now()} 已完成 user_decrypt_log 3天数据清理")
-        except Exception as e:
-            print(f"[定时清理] 清理 user_decrypt_log 失败: {e}")
-        # 等待1秒，确保不会重复清理
-        await asyncio.sleep(1)
+    调用目标服务器解密数据，不解析响应，原样返回响应体（透传模式）
 
-# 在主入口（如 worker_loop 启动前）加上：
-# asyncio.create_task(daily_cleanup_task())
-# 这样服务只需启动一次，每天凌晨前1秒自动清理，无需人工干预。
-
-# asyncio.create_task(daily_cleanup_user_decrypt_log_task())
-# 这样服务只需启动一次，每天凌晨前1秒自动清理 user_decrypt_log 表，无需人工干预。
+    Args:
+        hex_data: 16进制数据
+        server: 目标服务器信息对象
 
+    Returns:
+        (body, content_type)：原始响应字节和服务器返回的内容类型
+    """
+    response, _ = await _request_decrypt(hex_data, server)
+    body = response.content
+    # 只做字节级检查：非JSON响应（如网关错误页）不透传给客户端
+    if body.lstrip()[:1] not in (b"{", b"["):
+        log.error("服务器响应不是JSON", server=server.idx, body=body[:200])
+        raise Exception("服务器响应格式错误: 非JSON响应")
+    return body, response.headers.get("content-type", DEFAULT_CONTENT_TYPE)
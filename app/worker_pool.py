@@ -0,0 +1,216 @@
+"""
+Worker池自动扩缩容模块
+一个分发器按优先级把任务派发到各服务器的本地队列，每台服务器有自己的一组消费者（worker_loop），
+本模块根据共享队列深度、本地队列积压、空闲服务器数量和上游延迟动态调整每台服务器的消费者数量
+
+决策规则（每个周期、每台服务器一次）：
+1. 积压需求 = 正在处理的任务数 + 本地队列中等待的任务数 + 共享队列深度在空闲服务器间的平均份额
+2. 吞吐需求 = 近期处理速率 × 上游平均延迟（Little定律：并发 = 吞吐 × 延迟）
+3. 服务器繁忙（keygen_busy）时不再扩容，只保留最少消费者数
+4. 目标数 = max(积压需求, 吞吐需求)，并限制在 [每台服务器最少消费者数, worker_per_server] 之间，总数不超过 worker_max
+   （每台服务器最少消费者数 = worker_min 平均分到各服务器，至少1个）
+5. 扩容立即生效；缩容需连续多个周期低于当前数，且每次只减1个，避免抖动
+"""
+import asyncio
+import math
+import time
+from collections import defaultdict, deque
+from typing import Dict, List, Set, Tuple
+
+from .config import settings
+from . import runtime
+from .load_balancer import get_all_servers
+from .worker import worker_loop, dispatcher_loop, requeue_local_jobs, get_worker_metrics, QUEUE_KEY
+
+
+class WorkerPool:
+    """
+    按服务器划分的可伸缩Worker池
+
+    Attributes:
+        per_server_max: 每台服务器最多的消费者数
+        max_workers: 所有服务器消费者总数上限
+        interval: 决策周期（秒）
+        min_workers: 所有服务器消费者总数下限（平均分到各服务器）
+    """
+
+    def __init__(self, per_server_max: int, max_workers: int, interval: float = 1.0, min_workers: int = 1):
+        self.per_server_max = max(1, per_server_max)
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.interval = interval
+        # 每台服务器的消费者：{server_idx: [(任务, 停止信号)]}
+        self._workers: Dict[int, List[Tuple[asyncio.Task, asyncio.Event]]] = defaultdict(list)
+        # 已通知退出、仍在处理当前任务的消费者（关闭时一并取消并等待）
+        self._draining: Set[asyncio.Task] = set()
+        self._dispatcher: asyncio.Task | None = None
+        self._below_ticks: Dict[int, int] = defaultdict(int)  # 目标数连续低于当前数的周期数
+        self._last_processed: Dict[int, int] = defaultdict(int)
+        self._last_tick = time.monotonic()
+        # 最近的扩缩容决策记录
+        self._decisions: deque = deque(maxlen=20)
+        self._last_sample: dict = {}
+
+    @property
+    def size(self) -> int:
+        """当前存活的消费者总数"""
+        return sum(len(w) for w in self._workers.values())
+
+    def _spawn(self, server_idx: int) -> None:
+        """为指定服务器启动一个消费者"""
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(worker_loop(server_idx, stop_event))
+        self._workers[server_idx].append((task, stop_event))
+
+    def _retire(self, server_idx: int) -> None:
+        """通知指定服务器的最后一个消费者在处理完当前任务后退出"""
+        task, stop_event = self._workers[server_idx].pop()
+        stop_event.set()
+        self._draining.add(task)
+
+    def _reap(self) -> None:
+        """移除已意外退出的消费者和已退出的缩容消费者"""
+        for idx, workers in self._workers.items():
+            self._workers[idx] = [(t, e) for t, e in workers if not t.done()]
+        self._draining = {t for t in self._draining if not t.done()}
+
+    def _per_server_min(self, server_count: int) -> int:
+        """每台服务器最少的消费者数"""
+        return max(1, min(self.per_server_max, math.ceil(self.min_workers / max(server_count, 1))))
+
+    def _sample(self, server, elapsed: float, queue_share: int) -> dict:
+        """采集单台服务器的扩缩容决策指标"""
+        metrics = get_worker_metrics(server.idx)
+        rate = (metrics["processed_jobs"] - self._last_processed[server.idx]) / elapsed
+        self._last_processed[server.idx] = metrics["processed_jobs"]
+        busy = server.is_busy()
+        return {
+            "busy": busy,
+            "active_jobs": metrics["active_jobs"],
+            "local_queue": metrics["local_queue"],
+            "queue_share": 0 if busy else queue_share,
+            "rate": round(rate, 3),
+            "upstream_latency": round(metrics["upstream_latency"], 4),
+        }
+
+    def _desired(self, sample: dict, server_count: int = 1) -> int:
+        """根据单台服务器的指标计算目标消费者数"""
+        floor = self._per_server_min(server_count)
+        if sample["busy"]:
+            return floor
+        backlog_demand = sample["active_jobs"] + sample["local_queue"] + sample["queue_share"]
+        throughput_demand = math.ceil(sample["rate"] * sample["upstream_latency"])
+        desired = max(backlog_demand, throughput_demand)
+        return max(floor, min(self.per_server_max, desired))
+
+    def _record(self, action: str, server_idx: int, before: int, after: int, desired: int, sample: dict) -> None:
+        """记录一次扩缩容决策"""
+        self._decisions.append({
+            "time": time.time(),
+            "action": action,
+            "server_idx": server_idx,
+            "from": before,
+            "to": after,
+            "desired": desired,
+            **sample,
+        })
+        print(f"[Worker池] 服务器 {server_idx} {action}: {before} -> {after} (目标 {desired}, "
+              f"本地队列 {sample['local_queue']}, 共享队列份额 {sample['queue_share']}, "
+              f"上游延迟 {sample['upstream_latency']}s)")
+
+    async def _tick(self) -> None:
+        """执行一次扩缩容决策"""
+        self._reap()
+        now = time.monotonic()
+        elapsed = max(now - self._last_tick, 1e-3)
+        self._last_tick = now
+
+        queue_depth = 0
+        if runtime.redis_client:
+            queue_depth = await runtime.redis_client.zcard(QUEUE_KEY)
+
+        # 共享队列中的任务只能由空闲服务器消化，按空闲服务器平均分摊
+        servers = get_all_servers()
+        idle_servers = sum(1 for s in servers if not s.is_busy())
+        queue_share = math.ceil(queue_depth / idle_servers) if idle_servers else 0
+
+        samples = {}
+        for server in servers:
+            sample = self._sample(server, elapsed, queue_share)
+            desired = self._desired(sample, len(servers))
+            samples[server.idx] = {**sample, "desired": desired}
+            current = len(self._workers[server.idx])
+
+            if desired > current:
+                self._below_ticks[server.idx] = 0
+                room = self.max_workers - self.size
+                for _ in range(min(desired - current, room)):
+                    self._spawn(server.idx)
+                if len(self._workers[server.idx]) > current:
+                    self._record("scale_up", server.idx, current, len(self._workers[server.idx]), desired, sample)
+            elif desired < current:
+                self._below_ticks[server.idx] += 1
+                if self._below_ticks[server.idx] >= settings.worker_scale_down_ticks:
+                    self._below_ticks[server.idx] = 0
+                    self._retire(server.idx)
+                    self._record("scale_down", server.idx, current, current - 1, desired, sample)
+            else:
+                self._below_ticks[server.idx] = 0
+
+        self._last_sample = {"queue_depth": queue_depth, "idle_servers": idle_servers, "servers": samples}
+
+    async def run(self) -> None:
+        """监督主循环（作为后台任务运行，取消时停止分发器和所有消费者）"""
+        self._dispatcher = asyncio.create_task(dispatcher_loop())
+        servers = get_all_servers()
+        for server in servers:
+            for _ in range(self._per_server_min(len(servers))):
+                self._spawn(server.idx)
+        print(f"🚀 Worker池启动: {self.size} 个消费者 (每台服务器上限 {self.per_server_max}, 总上限 {self.max_workers})")
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self._tick()
+                except Exception as e:
+                    print(f"[Worker池] 扩缩容决策失败: {e}")
+        except asyncio.CancelledError:
+            tasks = [self._dispatcher] + [t for workers in self._workers.values() for t, _ in workers]
+            tasks += self._draining
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._workers.clear()
+            self._draining.clear()
+            # 已认领但未处理的任务放回共享队列
+            try:
+                returned = await requeue_local_jobs()
+                if returned:
+                    print(f"[Worker池] 已将 {returned} 个未处理任务放回队列")
+            except Exception as e:
+                print(f"[Worker池] 放回未处理任务失败: {e}")
+            raise
+
+    def stats(self) -> dict:
+        """获取Worker池统计信息"""
+        return {
+            "size": self.size,
+            "per_server": {idx: len(workers) for idx, workers in self._workers.items()},
+            "draining": len(self._draining),
+            "per_server_max": self.per_server_max,
+            "min": self.min_workers,
+            "max": self.max_workers,
+            "last_sample": self._last_sample,
+            "decisions": list(self._decisions),
+        }
+
+
+def create_worker_pool() -> WorkerPool:
+    """按配置创建Worker池（每台服务器至少1个消费者）"""
+    server_count = len(settings.server_list)
+    return WorkerPool(
+        per_server_max=settings.worker_per_server,
+        max_workers=max(server_count, settings.worker_max),
+        interval=settings.worker_scale_interval,
+        min_workers=settings.worker_min,
+    )
@@ -0,0 +1,76 @@
+"""
+JSON编解码单请求开销基准
+
+模拟一次密钥包请求在网关内的全部JSON操作，对比改造前（标准库，响应解析两次）与改造后（codec模块）：
+1. 入队：编码队列成员
+2. 分发：解码队列成员
+3. Worker：解析上游响应（改造前 token检测 + decrypt_with_retry 各解析一次）
+4. Worker：写入完成状态（编码服务器响应）
+5. 等待方：读取完成状态（解码服务器响应）
+6. 返回客户端：带缩进编码
+
+运行：python -m tests.bench_codec  （安装 orjson 后再运行一次对比快速路径）
+"""
+import json
+import time
+import uuid
+
+from app import codec
+
+
+TASK = {
+    "task_id": uuid.uuid4().hex,
+    "user_id": 1024,
+    "username": "bench_user",
+    "priority": 3,
+    "update_time": "2025-06-01 12:00:00",
+    "encrypted_data": "ab" * 176,
+    "packet_type": "key_packet",
+    "is_key_packet": True,
+    "drone_id": "a1b2c3d4",
+    "server_idx": 2,
+    "deadline": time.time() + 60,
+}
+UPSTREAM_BODY = json.dumps({
+    "success": True,
+    "msg": "keygen_succ",
+    "sn": "1581F5FKD229400A",
+    "data": {"lat": 22.5431, "lng": 114.0579, "height": 120.5, "speed": 8.2,
+             "drone_type": "Mavic 3", "home": {"lat": 22.5401, "lng": 114.0512}},
+}, ensure_ascii=False).encode("utf-8")
+
+
+def before() -> None:
+    member = json.dumps(TASK)
+    json.loads(member)
+    json.loads(UPSTREAM_BODY)
+    result = json.loads(UPSTREAM_BODY)
+    stored = json.dumps(result)
+    json.dumps(json.loads(stored), indent=2, ensure_ascii=False)
+
+
+def after() -> None:
+    member = codec.dumps(TASK)
+    codec.loads(member)
+    result = codec.loads(UPSTREAM_BODY)
+    stored = codec.dumps_bytes(result)
+    codec.dumps_pretty(codec.loads(stored))
+
+
+def bench(fn, rounds: int = 50000) -> float:
+    """返回单次调用耗时（微秒）"""
+    for _ in range(1000):
+        fn()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+if __name__ == "__main__":
+    print(f"codec后端: {codec.BACKEND}")
+    cost_before = bench(before)
+    cost_after = bench(after)
+    print(f"改造前: {cost_before:.2f} us/请求")
+    print(f"改造后: {cost_after:.2f} us/请求")
+    print(f"节省: {(1 - cost_after / cost_before) * 100:.1f}%")
@@ -0,0 +1,54 @@
+"""
+密钥路由查找基准
+
+对比数据包路由的缓存查找（find_key_in_cache，4096 个密钥，全部命中 / 全部未命中）：
+1. local：本进程 OrderedDict
+2. shm：共享内存哈希表（seqlock 无锁读）
+
+输出每次查找的平均耗时
+    python -m tests.bench_key_cache
+"""
+import asyncio
+import random
+import time
+import uuid
+
+from app import load_balancer
+from app.shm_key_cache import SharedKeyCache
+
+
+KEYS = 4096
+LOOKUPS = 200_000
+
+
+async def run(label: str, codes, misses) -> None:
+    for name, probe in (("hit", codes), ("miss", misses)):
+        seq = [random.choice(probe) for _ in range(LOOKUPS)]
+        start = time.perf_counter()
+        for code in seq:
+            await load_balancer.find_key_in_cache(code)
+        elapsed = time.perf_counter() - start
+        print(f"{label:6s} {name:5s} {elapsed / LOOKUPS * 1e9:8.0f} ns/次")
+
+
+async def main() -> None:
+    codes = [f"{random.getrandbits(32):08x}" for _ in range(KEYS)]
+    misses = [f"{random.getrandbits(32):08x}" for _ in range(KEYS)]
+    for i, code in enumerate(codes):
+        await load_balancer.add_key_to_cache(code, i % 3, f"SN{i:015d}")
+    await run("local", codes, misses)
+
+    cache = SharedKeyCache(f"bench_keys_{uuid.uuid4().hex[:8]}", slots=16384)
+    load_balancer._shm_key_cache = cache
+    try:
+        for i, code in enumerate(codes):
+            await load_balancer.add_key_to_cache(code, i % 3, f"SN{i:015d}")
+        await run("shm", codes, misses)
+    finally:
+        load_balancer._shm_key_cache = None
+        cache.unlink()
+        cache.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
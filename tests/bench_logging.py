@@ -0,0 +1,78 @@
+"""
+热路径日志吞吐基准
+
+模拟一次密钥包请求路径上的全部日志，对比事件循环线程中的开销：
+1. 改造前：10次 print() 同步写stdout（含URL和hex前缀）
+2. 改造后，INFO级别（默认）：调试日志直接返回，1条记录放入队列由后台线程写出
+3. 改造后，DEBUG级别：全部记录放入队列
+
+stdout 接到管道上（接近容器日志的写入方式）：
+    python -m tests.bench_logging | cat > /dev/null
+结果输出到 stderr
+"""
+import logging
+import sys
+import time
+
+from app.logger import get_logger, setup_logging, shutdown_logging
+
+
+N = 20000
+HEX = "ab" * 176
+
+
+def request_before() -> None:
+    """改造前一次密钥包请求路径上的 print()（quick_submit → 负载均衡 → Worker → 上游调用）"""
+    print(f" 数据包解析: 类型=key_packet, 无人机ID=a1b2c3d4, 密钥包=是")
+    print(f" 轮询分配服务器: 1 (上次: 0)")
+    print(f" 密钥 a1b2c3d4 加入处理队列，分配服务器: 1")
+    print(f" 密钥包已入队: task_id=0f1e2d3c, 队列位置=3")
+    print(f" 准备处理任务: task_id=0f1e2d3c, username=bench_user, server=1")
+    print(f"hex数据长度: {len(HEX)}, 前40字符: {HEX[:40]}...")
+    print(f"请求服务器 1: URL=https://example/api/yd/decryptl, hex={HEX[:40]}...")
+    print(f"📡 实际请求: https://example/api/yd/decryptl?hex={HEX[:150]}")
+    print(f"密钥包首次解密成功 (keygen_succ)，sn=1581F5FKD229400A")
+    print(f"密钥已缓存: hash_code=a1b2c3d4, server=1, sn=1581F5FKD229400A")
+
+
+def request_after(log) -> None:
+    """改造后同一路径上的日志调用（默认INFO级别下只有1条实际输出）"""
+    log.debug("数据包解析", packet_type="key_packet", drone_id="a1b2c3d4", is_key_packet=True)
+    log.debug("轮询分配服务器", server=1, previous=0)
+    log.debug("密钥加入处理队列", hash_code="a1b2c3d4", server=1)
+    log.debug("密钥包已入队", task_id="0f1e2d3c", position=3)
+    log.debug("准备处理任务", task_id="0f1e2d3c", username="bench_user", server=1, hex_len=len(HEX))
+    log.debug("请求服务器", server=1, hex_len=len(HEX))
+    log.info("密钥包首次解密成功 (keygen_succ)", task_id="0f1e2d3c", sn="1581F5FKD229400A")
+    log.debug("密钥已缓存", hash_code="a1b2c3d4", server=1, sn="1581F5FKD229400A")
+
+
+def bench_before() -> float:
+    start = time.perf_counter()
+    for _ in range(N):
+        request_before()
+    sys.stdout.flush()
+    return time.perf_counter() - start
+
+
+def bench_after(level: int) -> float:
+    log = get_logger("bench")
+    logging.getLogger("app").setLevel(level)
+    start = time.perf_counter()
+    for _ in range(N):
+        request_after(log)
+    return time.perf_counter() - start
+
+
+def _report(name: str, seconds: float) -> None:
+    print(f"{name}: {N / seconds:,.0f} 请求/秒, 日志开销 {seconds / N * 1e6:.2f} us/请求", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    _report("改造前 print()", bench_before())
+    setup_logging()
+    _report("改造后 INFO级别", bench_after(logging.INFO))
+    _report("改造后 DEBUG级别", bench_after(logging.DEBUG))
+    flush_start = time.perf_counter()
+    shutdown_logging()
+    print(f"后台线程写完剩余日志: {time.perf_counter() - flush_start:.2f}s", file=sys.stderr)
@@ -0,0 +1,75 @@
+"""
+速率限制器并发基准
+
+1000 个协程同时获取令牌（速率 2000/s，桶容量 50），对比：
+1. 改造前：在锁内 sleep，等待者排队逐个进入，放行后把令牌数直接清零
+2. 改造后：GCRA 预约放行时间，锁外等待
+
+输出总耗时、实际平均速率（理想值为限速值）以及每个请求实际放行时间相对理想放行时间的延迟
+    python -m tests.bench_rate_limiter
+"""
+import asyncio
+import statistics
+import time
+
+from app.rate_limiter import TokenBucketRateLimiter
+
+
+WAITERS = 1000
+RATE = 2000
+BURST = 50
+
+
+class LockedSleepLimiter:
+    """改造前的实现（锁内 sleep）"""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.tokens = BURST
+        self.last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.last_refill
+            self.tokens = min(BURST, self.tokens + elapsed * self.rate)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait_time = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait_time)
+            self.tokens = 0
+
+
+async def run(limiter) -> None:
+    start = time.monotonic()
+    released = []
+
+    async def waiter():
+        await limiter.acquire()
+        released.append(time.monotonic() - start)
+
+    await asyncio.gather(*(waiter() for _ in range(WAITERS)))
+    total = time.monotonic() - start
+
+    released.sort()
+    # 第 i 个请求的理想放行时间：桶内的 BURST 个立即放行，之后每 1/RATE 秒一个
+    lag = [(t - max(0, i - BURST + 1) / RATE) * 1000 for i, t in enumerate(released)]
+    lag.sort()
+    print(
+        f"{type(limiter).__name__:24s} 总耗时 {total:6.3f}s  速率 {WAITERS / total:7.0f}/s  "
+        f"放行延迟 p50 {statistics.median(lag):6.2f}ms  p99 {lag[int(len(lag) * 0.99)]:6.2f}ms  "
+        f"max {lag[-1]:6.2f}ms"
+    )
+
+
+async def main() -> None:
+    print(f"{WAITERS} 个并发等待者，限速 {RATE}/s，桶容量 {BURST}，理想总耗时 {(WAITERS - BURST) / RATE:.3f}s")
+    await run(LockedSleepLimiter(RATE))
+    await run(TokenBucketRateLimiter(RATE, burst=BURST))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+"""
+测试JSON编解码模块与标准库输出一致
+"""
+import json
+
+import pytest
+
+from app import codec
+
+
+SAMPLE = {"success": True, "msg": "keygen_succ", "sn": "序列号123", "data": {"lat": 22.5, "list": [1, 2]}}
+
+
+def test_pretty_matches_stdlib():
+    """带缩进输出与原 json.dumps(indent=2, ensure_ascii=False) 一致"""
+    assert codec.dumps_pretty(SAMPLE) == json.dumps(SAMPLE, indent=2, ensure_ascii=False)
+
+
+def test_roundtrip_str_and_bytes():
+    """str / bytes 编码都能还原"""
+    assert codec.loads(codec.dumps(SAMPLE)) == SAMPLE
+    assert codec.loads(codec.dumps_bytes(SAMPLE)) == SAMPLE
+
+
+def test_decode_error_is_value_error():
+    """非法JSON抛出 codec.JSONDecodeError"""
+    with pytest.raises(codec.JSONDecodeError):
+        codec.loads("not json")
@@ -0,0 +1,73 @@
+"""
+测试账号密码校验缓存
+
+验证：
+1. 同一账号密码再次校验时不查库、不解密
+2. 密码错误不缓存
+3. 用户被失效（修改密码、状态）后重新查库校验
+"""
+import base64
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from app import credentials, user_cache
+from app.config import settings
+from app.credentials import AUTH_BAD_PASSWORD, AUTH_NOT_FOUND, AUTH_OK, authenticate
+from app.models import SysUser
+
+
+def _encrypt(password: str) -> str:
+    cipher = AES.new(settings.aes_key.encode(), AES.MODE_CBC, settings.aes_iv.encode())
+    return base64.b64encode(cipher.encrypt(pad(password.encode(), AES.block_size))).decode()
+
+
+@pytest.fixture
+def rows(monkeypatch):
+    """替换数据库查询，记录查询次数"""
+    users = {"alice": SysUser(user_id=1, user_name="alice", status="0", priority=10,
+                              total_requests=100, password=_encrypt("secret"))}
+    calls = []
+
+    async def _load_user_row(username):
+        calls.append(username)
+        return users.get(username)
+
+    credentials._verified.clear()
+    user_cache.invalidate_local()
+    monkeypatch.setattr(credentials, "_load_user_row", _load_user_row)
+    yield calls
+    user_cache.invalidate_local()
+
+
+@pytest.mark.asyncio
+async def test_repeat_auth_skips_db(rows):
+    """第二次校验命中缓存"""
+    user, result = await authenticate("alice", "secret")
+    assert (user.user_id, result) == (1, AUTH_OK)
+    user, result = await authenticate("alice", "secret")
+    assert result == AUTH_OK
+    assert rows == ["alice"]
+
+
+@pytest.mark.asyncio
+async def test_bad_password_not_cached(rows):
+    """密码错误每次都重新校验，不影响正确密码"""
+    assert (await authenticate("alice", "wrong"))[1] == AUTH_BAD_PASSWORD
+    assert (await authenticate("alice", "wrong"))[1] == AUTH_BAD_PASSWORD
+    assert (await authenticate("nobody", "secret")) == (None, AUTH_NOT_FOUND)
+    assert rows == ["alice", "alice", "nobody"]
+
+
+@pytest.mark.asyncio
+async def test_invalidation_forces_recheck(rows):
+    """用户失效后此前的校验记录作废，其他用户不受影响"""
+    await authenticate("alice", "secret")
+    user_cache.invalidate_local("bob")
+    await authenticate("alice", "secret")
+    assert rows == ["alice"]
+
+    user_cache.invalidate_local("alice")
+    await authenticate("alice", "secret")
+    assert rows == ["alice", "alice"]
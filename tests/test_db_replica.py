@@ -0,0 +1,112 @@
+"""
+测试只读副本路由
+
+验证：
+1. 副本可用时只读查询发往副本
+2. 副本查询失败或连接池耗尽时在主库重试，并在 REPLICA_RETRY_INTERVAL 内直接走主库
+3. 复制延迟超过 REPLICA_MAX_LAG 或复制停止时回退到主库
+4. 未配置副本时只读查询走主库
+"""
+import asyncio
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+
+from app import db
+from app.config import settings
+
+
+class _FakeSession:
+    def __init__(self, name, calls, fail=None):
+        self.name = name
+        self.calls = calls
+        self.fail = fail
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        self.calls.append(self.name)
+        if self.fail:
+            raise self.fail
+        return self.name
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    calls = []
+    state = {"replica_fail": None}
+    monkeypatch.setattr(db, "AsyncSessionLocal", lambda: _FakeSession("primary", calls))
+    monkeypatch.setattr(db, "ReplicaSessionLocal",
+                        lambda: _FakeSession("replica", calls, state["replica_fail"]))
+    monkeypatch.setattr(db, "_replica_down_until", 0.0)
+    monkeypatch.setattr(db, "_replica_lag", None)
+    monkeypatch.setattr(settings, "replica_retry_interval", 10)
+    return calls, state
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_replica(sessions):
+    calls, _ = sessions
+    assert await db.execute_read("SELECT 1") == "replica"
+    assert calls == ["replica"]
+    assert db.get_replica_status()["usable"]
+
+
+@pytest.mark.asyncio
+async def test_replica_failure_falls_back(sessions, monkeypatch):
+    calls, state = sessions
+    state["replica_fail"] = OperationalError("SELECT 1", {}, ConnectionError("replica gone"))
+    assert await db.execute_read("SELECT 1") == "primary"
+    assert calls == ["replica", "primary"]
+
+    # 回退期内不再尝试副本
+    state["replica_fail"] = None
+    assert await db.execute_read("SELECT 1") == "primary"
+    assert calls[-1] == "primary" and calls.count("replica") == 1
+
+    # 回退期过后恢复使用副本
+    monkeypatch.setattr(db, "_replica_down_until", time.monotonic() - 1)
+    assert await db.execute_read("SELECT 1") == "replica"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("lag", [30.0, None])
+async def test_lag_check_marks_replica_down(sessions, monkeypatch, lag):
+    """延迟过大或复制停止时只读查询回退到主库"""
+    calls, _ = sessions
+
+    async def _read_replica_lag():
+        return lag
+
+    monkeypatch.setattr(db, "_read_replica_lag", _read_replica_lag)
+    monkeypatch.setattr(settings, "replica_max_lag", 5)
+    task = asyncio.ensure_future(db.replica_lag_check_task())
+    await asyncio.sleep(0)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert not db.replica_usable()
+    assert await db.execute_read("SELECT 1") == "primary"
+
+
+@pytest.mark.asyncio
+async def test_no_replica_configured(sessions, monkeypatch):
+    calls, _ = sessions
+    monkeypatch.setattr(db, "ReplicaSessionLocal", None)
+    assert await db.execute_read("SELECT 1") == "primary"
+    assert db.get_replica_status() == {"configured": False, "usable": False, "lag": None}
+
+
+@pytest.mark.asyncio
+async def test_replica_pool_exhausted_falls_back(sessions):
+    """副本连接池耗尽（获取连接超时）时回退到主库"""
+    calls, state = sessions
+    state["replica_fail"] = PoolTimeoutError("QueuePool limit of size 20 overflow 20 reached")
+    assert await db.execute_read("SELECT 1") == "primary"
+    assert calls == ["replica", "primary"]
+    assert not db.replica_usable()
@@ -0,0 +1,52 @@
+"""
+测试出队时丢弃过期/已放弃的任务
+
+验证：
+1. 超过截止时间的任务被判定为 expired
+2. 客户端已放弃（或状态key已过期）的任务被判定为 abandoned
+3. 丢弃时回滚处理中状态并计入统计
+"""
+import time
+
+import pytest
+
+from app import runtime
+from app import worker
+from app.load_balancer import add_to_processing, is_in_processing
+
+
+@pytest.mark.asyncio
+async def test_expired_task_dropped(redis_client):
+    """超过截止时间的任务不再发往服务器"""
+    runtime.redis_client = redis_client
+    job = {"task_id": "expired_task", "deadline": time.time() - 1}
+    await redis_client.hset("task:expired_task", "status", "queued")
+
+    assert await worker._drop_reason(job) == "expired"
+
+
+@pytest.mark.asyncio
+async def test_abandoned_task_dropped(redis_client):
+    """客户端放弃等待或状态已过期的任务被丢弃"""
+    runtime.redis_client = redis_client
+    deadline = time.time() + 60
+
+    await redis_client.hset("task:gone", "status", "abandoned")
+    assert await worker._drop_reason({"task_id": "gone", "deadline": deadline}) == "abandoned"
+    assert await worker._drop_reason({"task_id": "missing", "deadline": deadline}) == "abandoned"
+
+    await redis_client.hset("task:alive", "status", "queued")
+    assert await worker._drop_reason({"task_id": "alive", "deadline": deadline}) is None
+
+
+@pytest.mark.asyncio
+async def test_drop_rolls_back_processing(redis_client):
+    """丢弃任务时释放处理中的密钥并计数"""
+    runtime.redis_client = redis_client
+    await add_to_processing("a1b2c3d4", 0)
+    before = worker.get_dropped_stats()["abandoned"]
+
+    await worker._drop_job({"task_id": "t1", "drone_id": "a1b2c3d4", "server_idx": 0}, "abandoned")
+
+    assert not await is_in_processing("a1b2c3d4")
+    assert worker.get_dropped_stats()["abandoned"] == before + 1
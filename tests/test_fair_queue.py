@@ -0,0 +1,139 @@
+"""
+测试同一优先级内的用户公平排队
+
+验证：
+1. 同优先级下，重度用户先入队的大量任务不会挡住轻度用户
+2. 不同优先级之间仍严格按优先级排序
+3. 单用户排队数超过上限时返回429
+4. 档位长期不清空、轮次很大时仍按优先级排序，分数不超过2^53
+"""
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from app import runtime
+from app.config import settings
+from app.task_service import (
+    push_task_to_queue, claim_task, QUEUE_KEY, USER_COUNT_KEY, VCLOCK_KEY, VSTART_KEY_PREFIX,
+    PRIORITY_SCALE, ROUND_REBASE_AT, ROUND_WINDOW,
+)
+
+
+def _task(task_id: str, username: str, priority: int) -> dict:
+    return {
+        "task_id": task_id,
+        "username": username,
+        "priority": priority,
+        "update_time": "2025-01-01 00:00:00",
+        "encrypted_data": f"data_{task_id}",
+    }
+
+
+async def _queued_ids(redis_client) -> list:
+    members = await redis_client.zrange(QUEUE_KEY, 0, -1)
+    return [json.loads(m)["task_id"] for m in members]
+
+
+@pytest.mark.asyncio
+async def test_light_user_not_starved(redis_client):
+    """重度用户先入队5个任务，轻度用户后入队的任务排在第二位"""
+    runtime.redis_client = redis_client
+
+    for i in range(5):
+        await push_task_to_queue(_task(f"heavy_{i}", "heavy", 1), 1)
+    await push_task_to_queue(_task("light_0", "light", 1), 1)
+
+    ids = await _queued_ids(redis_client)
+    assert ids.index("light_0") <= 1, f"light user task should be served in the first round, got {ids}"
+    # 同一用户的任务保持先后顺序
+    heavy = [i for i in ids if i.startswith("heavy")]
+    assert heavy == [f"heavy_{i}" for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_priority_still_dominates(redis_client):
+    """公平轮次只在同一优先级内生效，高优先级任务始终在前"""
+    runtime.redis_client = redis_client
+
+    for i in range(3):
+        await push_task_to_queue(_task(f"low_{i}", "low_user", 5), 5)
+    for i in range(3):
+        await push_task_to_queue(_task(f"high_{i}", "high_user", 1), 1)
+
+    ids = await _queued_ids(redis_client)
+    assert ids[:3] == ["high_0", "high_1", "high_2"]
+
+
+@pytest.mark.asyncio
+async def test_claim_updates_user_count(redis_client):
+    """认领任务后该用户的排队计数减少"""
+    runtime.redis_client = redis_client
+
+    await push_task_to_queue(_task("c_0", "counter", 1), 1)
+    await push_task_to_queue(_task("c_1", "counter", 1), 1)
+    assert int(await redis_client.hget(USER_COUNT_KEY, "counter")) == 2
+
+    member, score = (await redis_client.zrange(QUEUE_KEY, 0, 0, withscores=True))[0]
+    assert await claim_task(member, score, "counter")
+    # 重复认领失败
+    assert not await claim_task(member, score, "counter")
+    assert int(await redis_client.hget(USER_COUNT_KEY, "counter")) == 1
+
+
+@pytest.mark.asyncio
+async def test_per_user_cap(redis_client):
+    """单用户排队数达到上限后拒绝"""
+    runtime.redis_client = redis_client
+
+    for i in range(settings.max_queue_per_user):
+        await push_task_to_queue(_task(f"cap_{i}", "capped", 1), 1)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await push_task_to_queue(_task("cap_overflow", "capped", 1), 1)
+    assert exc_info.value.status_code == 429
+
+    # 其他用户不受影响
+    await push_task_to_queue(_task("other_0", "other", 1), 1)
+
+
+@pytest.mark.asyncio
+async def test_large_rounds_keep_priority_order(redis_client):
+    """档位虚拟时钟接近重置阈值、用户轮次远超窗口时，任务仍留在本档位的分数区间内"""
+    runtime.redis_client = redis_client
+    await redis_client.hset(VCLOCK_KEY, "1", ROUND_REBASE_AT - 1)
+    await redis_client.hset(f"{VSTART_KEY_PREFIX}1", "heavy", 10 ** 7)
+
+    for i in range(3):
+        await push_task_to_queue(_task(f"heavy_{i}", "heavy", 1), 1)
+    await push_task_to_queue(_task("light_0", "light", 1), 1)
+    await push_task_to_queue(_task("next_band", "other", 2), 2)
+
+    items = await redis_client.zrange(QUEUE_KEY, 0, -1, withscores=True)
+    assert [json.loads(m)["task_id"] for m, _ in items][-1] == "next_band"
+    assert all(score < 2 * PRIORITY_SCALE for m, score in items[:-1])
+    assert all(score < 2 ** 53 for _, score in items)
+
+    # 认领轮次达到重置阈值的任务后，档位轮次整体前移，顺序不变
+    member, score = items[0]
+    assert json.loads(member)["task_id"] == "light_0"
+    assert await claim_task(member, score, "light")
+    heavy = [m for m, _ in items if json.loads(m)["task_id"].startswith("heavy")]
+    assert await claim_task(heavy[0], dict(items)[heavy[0]], "heavy")
+    assert int(await redis_client.hget(VCLOCK_KEY, "1")) < ROUND_REBASE_AT
+
+    items = await redis_client.zrange(QUEUE_KEY, 0, -1, withscores=True)
+    assert [json.loads(m)["task_id"] for m, _ in items] == ["heavy_1", "heavy_2", "next_band"]
+    assert all(PRIORITY_SCALE <= score < 2 * PRIORITY_SCALE for _, score in items[:2])
+    assert int(await redis_client.hget(f"{VSTART_KEY_PREFIX}1", "heavy")) <= ROUND_WINDOW
+
+
+@pytest.mark.asyncio
+async def test_lowest_priority_keeps_update_time_order(redis_client):
+    """最低档位的分数仍能区分相差一小时的账号更新时间"""
+    runtime.redis_client = redis_client
+    older = {**_task("older", "older_user", 999), "update_time": "2025-01-01 00:00:00"}
+    newer = {**_task("newer", "newer_user", 999), "update_time": "2025-01-01 01:00:00"}
+    await push_task_to_queue(older, 999)
+    await push_task_to_queue(newer, 999)
+    assert await _queued_ids(redis_client) == ["newer", "older"]
@@ -0,0 +1,120 @@
+"""
+测试用户请求频率限制
+
+验证：
+1. 按用户优先级选择速率档位
+2. 超过突发容量后拒绝并给出等待时长，超限请求不计数
+3. 超限时返回429和Retry-After
+4. redis模式下多个进程共享计数
+5. 错误密码只消耗 (用户名, 客户端IP) 的认证失败额度，不会把该用户限流
+6. 校验通过的账号密码请求不消耗认证失败额度，只受用户额度限制
+"""
+import pytest
+from fastapi import HTTPException
+
+from app import ingress_limit, runtime
+from app.credentials import AUTH_BAD_PASSWORD, AUTH_OK
+from app.ingress_limit import budget_for, check_auth_rate, check_user_rate, record_auth_failure
+from app.routes import task_routes
+from app.routes.task_routes import _enforce_user_rate
+from app.user_cache import CachedUser
+
+
+@pytest.fixture
+def budgets(monkeypatch):
+    monkeypatch.setattr(ingress_limit, "_budgets", [(9, 10.0, 3), (999, 1.0, 1)])
+    monkeypatch.setattr(ingress_limit.settings, "user_rate_limit_backend", "local")
+    ingress_limit._local_tat.clear()
+
+
+def test_budget_by_priority(budgets):
+    """优先级数字越小档位越高，未知优先级按最低档"""
+    assert budget_for(1) == (10.0, 3)
+    assert budget_for(9) == (10.0, 3)
+    assert budget_for(500) == (1.0, 1)
+    assert budget_for(None) == (1.0, 1)
+
+
+@pytest.mark.asyncio
+async def test_burst_then_reject(budgets):
+    """突发容量内放行，之后拒绝；被拒绝的请求不推后下一次放行时间"""
+    for _ in range(3):
+        assert await check_user_rate("alice", 1) == 0
+    wait = await check_user_rate("alice", 1)
+    assert 0 < wait <= 0.1
+    assert await check_user_rate("alice", 1) == pytest.approx(wait, abs=0.01)
+    # 其他用户不受影响
+    assert await check_user_rate("bob", 1) == 0
+
+
+@pytest.mark.asyncio
+async def test_429_with_retry_after(budgets):
+    """超限返回429，Retry-After向上取整到秒"""
+    await _enforce_user_rate("carol")
+    with pytest.raises(HTTPException) as exc:
+        await _enforce_user_rate("carol")
+    assert exc.value.status_code == 429
+    assert exc.value.headers["Retry-After"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_redis_shared(budgets, monkeypatch, redis_client):
+    """redis模式下计数保存在Redis，本进程计数清空后仍然超限"""
+    runtime.redis_client = redis_client
+    monkeypatch.setattr(ingress_limit.settings, "user_rate_limit_backend", "redis")
+    assert await check_user_rate("dave", 500) == 0
+    ingress_limit._local_tat.clear()
+    assert await check_user_rate("dave", 500) > 0.9
+
+
+@pytest.mark.asyncio
+async def test_auth_attempts_do_not_consume_user_budget(budgets, monkeypatch):
+    """认证失败额度按 (用户名, 客户端IP) 计数，检查本身不计数，与用户额度互不影响"""
+    monkeypatch.setattr(ingress_limit.settings, "auth_rate_limit", 1.0)
+    monkeypatch.setattr(ingress_limit.settings, "auth_rate_burst", 2)
+    for _ in range(5):
+        assert await check_auth_rate("erin", "10.0.0.1") == 0
+    await record_auth_failure("erin", "10.0.0.1")
+    await record_auth_failure("erin", "10.0.0.1")
+    assert await check_auth_rate("erin", "10.0.0.1") > 0
+
+    assert await check_auth_rate("erin", "10.0.0.2") == 0
+    assert await check_user_rate("erin", 1) == 0
+
+
+@pytest.mark.asyncio
+async def test_bad_password_returns_429_without_locking_user(budgets, monkeypatch, app_client):
+    """错误密码请求超过认证额度后返回429，该用户的用户额度不受影响"""
+    monkeypatch.setattr(ingress_limit.settings, "auth_rate_limit", 1.0)
+    monkeypatch.setattr(ingress_limit.settings, "auth_rate_burst", 2)
+    user = CachedUser(1, "frank", "0", 1, None, 100)
+
+    async def _authenticate(username, password):
+        return user, AUTH_BAD_PASSWORD
+
+    monkeypatch.setattr(task_routes, "authenticate", _authenticate)
+    params = {"hex": "00", "username": "frank", "password": "wrong"}
+    codes = [(await app_client.get("/api/yd/decryptl", params=params)).status_code for _ in range(3)]
+    assert codes == [401, 401, 429]
+
+    for _ in range(3):
+        assert await check_user_rate("frank", 1) == 0
+
+
+@pytest.mark.asyncio
+async def test_valid_password_not_capped_by_auth_rate(budgets, monkeypatch, app_client):
+    """校验通过的账号密码请求可以超过认证失败额度，直到用完该用户优先级的额度"""
+    monkeypatch.setattr(ingress_limit, "_budgets", [(9, 10.0, 5), (999, 1.0, 1)])
+    monkeypatch.setattr(ingress_limit.settings, "auth_rate_limit", 1.0)
+    monkeypatch.setattr(ingress_limit.settings, "auth_rate_burst", 2)
+    user = CachedUser(1, "grace", "0", 1, None, 100)
+
+    async def _authenticate(username, password):
+        return user, AUTH_OK
+
+    monkeypatch.setattr(task_routes, "authenticate", _authenticate)
+    params = {"hex": "00", "username": "grace", "password": "right"}
+    codes = [(await app_client.get("/api/yd/decryptl", params=params)).status_code for _ in range(6)]
+    assert 429 not in codes[:5]
+    assert codes[5] == 429
+    assert await check_auth_rate("grace", "127.0.0.1") == 0
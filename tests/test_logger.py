@@ -0,0 +1,66 @@
+"""
+测试结构化日志的级别过滤、采样和限流
+"""
+import logging
+
+import pytest
+
+from app.logger import StructFormatter, get_logger
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def captured():
+    """直接挂同步Handler收集记录（不经过后台线程）"""
+    handler = _ListHandler()
+    root = logging.getLogger("app")
+    old_level = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    yield handler.records
+    root.removeHandler(handler)
+    root.setLevel(old_level)
+
+
+def test_debug_disabled_is_dropped(captured):
+    """未开启DEBUG时调试日志不产生记录"""
+    log = get_logger("test.level")
+    log.debug("hidden", key=1)
+    log.info("shown", key=2)
+    assert [r.getMessage() for r in captured] == ["shown"]
+
+
+def test_rate_limit_reports_suppressed(captured):
+    """同一消息每秒超过上限的部分被抑制，下一窗口的首条附带抑制条数"""
+    log = get_logger("test.rate")
+    for _ in range(10):
+        log.info("burst", rate_limit=3)
+    assert len(captured) == 3
+
+    log._windows["burst"][0] -= 1.0  # 模拟进入下一个1秒窗口
+    log.info("burst", rate_limit=3)
+    assert captured[-1].fields["suppressed"] == 7
+
+
+def test_sampling(captured):
+    """sample=0 时全部丢弃"""
+    log = get_logger("test.sample")
+    for _ in range(100):
+        log.info("sampled", sample=0.0)
+    assert captured == []
+
+
+def test_formatter_fields():
+    """text 格式把附加字段输出为 key=value，json 格式合并到同一对象"""
+    record = logging.LogRecord("app.x", logging.INFO, __file__, 1, "msg", None, None)
+    record.fields = {"task_id": "t1", "server": 2}
+    assert StructFormatter("text").format(record).endswith("msg task_id=t1 server=2")
+    assert '"task_id":"t1"' in StructFormatter("json").format(record)
@@ -0,0 +1,65 @@
+"""
+测试运行指标的计数和 Prometheus 文本格式输出
+"""
+import pytest
+
+from app import runtime
+from app.metrics import RATE_LIMITED, Counter, Histogram, render_metrics
+
+
+def test_counter_render():
+    """计数器按标签分别累加"""
+    counter = Counter("t_requests_total", "测试", ("packet_type",))
+    counter.inc("key_packet")
+    counter.inc("key_packet")
+    counter.inc("data_packet", amount=3)
+
+    lines = counter.render()
+    assert "# TYPE t_requests_total counter" in lines
+    assert 't_requests_total{packet_type="key_packet"} 2' in lines
+    assert 't_requests_total{packet_type="data_packet"} 3' in lines
+
+
+def test_histogram_buckets_cumulative():
+    """直方图输出累积桶计数，边界值落入 le 等于该值的桶"""
+    hist = Histogram("t_seconds", "测试", ("stage",), buckets=(0.1, 1.0))
+    hist.observe(0.05, "auth")
+    hist.observe(0.1, "auth")
+    hist.observe(0.5, "auth")
+    hist.observe(5.0, "auth")
+
+    lines = hist.render()
+    assert 't_seconds_bucket{stage="auth",le="0.1"} 2' in lines
+    assert 't_seconds_bucket{stage="auth",le="1.0"} 3' in lines
+    assert 't_seconds_bucket{stage="auth",le="+Inf"} 4' in lines
+    assert 't_seconds_count{stage="auth"} 4' in lines
+    assert hist.count("auth") == 4
+
+
+def test_timer_records_observation():
+    """计时上下文退出时记录一次耗时"""
+    hist = Histogram("t_timer_seconds", "测试", ("stage",))
+    with hist.time("parse"):
+        pass
+    assert hist.count("parse") == 1
+
+
+@pytest.mark.asyncio
+async def test_render_includes_gauges():
+    """输出中包含抓取时读取的仪表盘"""
+    runtime.redis_client = None
+    text = await render_metrics()
+    assert "# TYPE gateway_queue_depth gauge" in text
+    assert "gateway_key_cache_size " in text
+    assert text.endswith("\n")
+
+
+@pytest.mark.asyncio
+async def test_render_includes_rate_limited(monkeypatch):
+    """限流拒绝计数出现在输出中"""
+    runtime.redis_client = None
+    monkeypatch.setattr(RATE_LIMITED, "_values", {})
+    RATE_LIMITED.inc("auth")
+    text = await render_metrics()
+    assert "# TYPE gateway_rate_limited_total counter" in text
+    assert 'gateway_rate_limited_total{priority_band="auth"} 1' in text
@@ -0,0 +1,71 @@
+"""
+测试解密结果透传模式
+
+使用 httpx.MockTransport 模拟解密服务器，验证：
+1. 透传模式原样返回服务器响应字节和内容类型
+2. 响应中含token失效信息时刷新token并重试
+3. 非JSON响应不透传
+"""
+import httpx
+import pytest
+
+from app import runtime
+from app.load_balancer import ServerInfo
+from app.worker import decrypt_passthrough, decrypt_with_retry
+
+
+def _server() -> ServerInfo:
+    server = ServerInfo(idx=0, url="http://decrypt.test", username="u", password="p")
+    server.update_token("tok_0")
+    return server
+
+
+def _client(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.asyncio
+async def test_passthrough_returns_raw_bytes():
+    """服务器响应字节原样返回，不重新序列化"""
+    body = b'{"success":true,"msg":"ok","data":{"lat":22.5}}'
+    runtime.http_b_client = _client(
+        lambda request: httpx.Response(200, content=body, headers={"content-type": "application/json"})
+    )
+
+    raw, content_type = await decrypt_passthrough("ab" * 176, _server())
+
+    assert raw == body
+    assert content_type == "application/json"
+    await runtime.http_b_client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_token_failure_retried():
+    """响应含token失效信息时刷新token后重试"""
+    calls = []
+
+    def handler(request):
+        if request.url.path == "/api/login":
+            return httpx.Response(200, json={"success": True, "data": {"token": "tok_1"}})
+        calls.append(request.url.params["token"])
+        if request.url.params["token"] == "tok_0":
+            return httpx.Response(200, json={"msg": "Token expired"})
+        return httpx.Response(200, json={"msg": "keygen_succ"})
+
+    runtime.http_b_client = _client(handler)
+
+    result = await decrypt_with_retry("ab" * 176, _server())
+
+    assert result == {"msg": "keygen_succ"}
+    assert calls == ["tok_0", "tok_1"]
+    await runtime.http_b_client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_non_json_not_passed_through():
+    """网关错误页等非JSON响应不透传给客户端"""
+    runtime.http_b_client = _client(lambda request: httpx.Response(502, content=b"<html>Bad Gateway</html>"))
+
+    with pytest.raises(Exception):
+        await decrypt_passthrough("ab" * 176, _server())
+    await runtime.http_b_client.aclose()
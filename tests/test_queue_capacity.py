@@ -179,5 +179,46 @@ async def test_queue_priority_consistency(redis_client):
             f"Priorities not sorted: {top_10_priorities}"
 
 
+@pytest.mark.asyncio
+async def test_concurrent_admission_exact(redis_client):
+    """并发入队超过容量时，准入数量恰好等于 max_queue_size"""
+    runtime.redis_client = redis_client
+
+    async def try_push(i):
+        task = {
+            "task_id": f"race_{i}",
+            "username": f"user_{i % 50}",
+            "priority": 1,
+            "encrypted_data": f"race_data_{i}",
+        }
+        try:
+            await push_task_to_queue(task, 1)
+            return True
+        except HTTPException:
+            return False
+
+    results = await asyncio.gather(*[try_push(i) for i in range(settings.max_queue_size + 50)])
+
+    assert sum(results) == settings.max_queue_size
+    assert await redis_client.zcard("queue:priority") == settings.max_queue_size
+
+
+@pytest.mark.asyncio
+async def test_enqueue_returns_position(redis_client):
+    """入队返回任务在队列中的位置，并同时写入任务状态"""
+    runtime.redis_client = redis_client
+
+    first = await push_task_to_queue(
+        {"task_id": "pos_low", "username": "u_low", "priority": 5, "encrypted_data": "a"}, 5
+    )
+    second = await push_task_to_queue(
+        {"task_id": "pos_high", "username": "u_high", "priority": 1, "encrypted_data": "b"}, 1
+    )
+
+    assert first == 0
+    assert second == 0  # 高优先级插到队首
+    assert await redis_client.hget("task:pos_low", "status") == "queued"
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "-s"])
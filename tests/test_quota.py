@@ -0,0 +1,150 @@
+"""
+测试Redis配额计数
+
+验证：
+1. 首次扣费从数据库初始化，达到总配额后拒绝
+2. 用量分批写回数据库，写回失败时退还增量
+3. Redis数据丢失后重新从数据库初始化
+4. 写回语句在真实表（sqlite）上执行成功
+"""
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app import runtime, quota
+from app.models import SysUser
+from app.quota import charge, flush_quota_usage, get_used, reset_quota
+
+
+@pytest.fixture
+def db(monkeypatch, redis_client):
+    """替换数据库读写：db["used"] 为数据库中的已用次数"""
+    runtime.redis_client = redis_client
+    state = {"used": {"alice": 3, "bob": 0}, "batches": [], "fail": False}
+
+    async def _load_used(username):
+        return state["used"].get(username)
+
+    async def _write_back(deltas):
+        if state["fail"]:
+            raise RuntimeError("db down")
+        state["batches"].append(sorted(deltas))
+        for name, delta in deltas:
+            state["used"][name] += delta
+
+    monkeypatch.setattr(quota, "_load_used", _load_used)
+    monkeypatch.setattr(quota, "_write_back", _write_back)
+    return state
+
+
+@pytest.mark.asyncio
+async def test_seed_and_limit(db):
+    """从数据库的已用次数开始计数，达到总配额后返回-1"""
+    assert await charge("alice", 5) == 4
+    assert await charge("alice", 5) == 5
+    assert await charge("alice", 5) == -1
+    assert await get_used("alice") == 5
+    # 总配额由调用方传入，调大后立即可用
+    assert await charge("alice", 6) == 6
+
+
+@pytest.mark.asyncio
+async def test_unknown_user_rejected(db):
+    assert await charge("nobody", 5) == -1
+
+
+@pytest.mark.asyncio
+async def test_flush_batches_deltas(db):
+    """写回的是增量，写回后不再重复写"""
+    for _ in range(2):
+        await charge("alice", 100)
+    await charge("bob", 100)
+
+    assert await flush_quota_usage() == 2
+    assert db["batches"] == [[("alice", 2), ("bob", 1)]]
+    assert db["used"] == {"alice": 5, "bob": 1}
+    assert await flush_quota_usage() == 0
+
+
+@pytest.mark.asyncio
+async def test_flush_failure_restores(db):
+    """写回失败时增量退还，下次写回不丢失"""
+    await charge("alice", 100)
+    db["fail"] = True
+    with pytest.raises(RuntimeError):
+        await flush_quota_usage()
+
+    db["fail"] = False
+    await charge("alice", 100)
+    assert await flush_quota_usage() == 1
+    assert db["used"]["alice"] == 5
+
+
+@pytest.mark.asyncio
+async def test_recover_after_redis_loss(db, redis_client):
+    """Redis数据丢失后，下次扣费从数据库中已写回的用量继续计数"""
+    await charge("alice", 100)
+    await flush_quota_usage()
+    await redis_client.flushdb()
+
+    assert await charge("alice", 100) == 5
+
+
+@pytest.mark.asyncio
+async def test_reset_writes_back_and_reseeds(db):
+    """管理员重置前未写回的用量先写回，之后从数据库重新初始化"""
+    await charge("alice", 100)
+    await reset_quota("alice")
+    assert db["used"]["alice"] == 4
+
+    db["used"]["alice"] = 0  # 管理员清零
+    assert await charge("alice", 100) == 1
+
+
+class _SyncSession:
+    """用同步 sqlite 会话模拟 AsyncSession 的 execute()/connection()/commit()（执行真实的写回语句）"""
+
+    def __init__(self, engine):
+        self._session = Session(engine)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._session.close()
+
+    async def execute(self, statement, params=None):
+        return self._session.execute(statement, params)
+
+    async def connection(self):
+        conn = self._session.connection()
+
+        class _Conn:
+            async def execute(self, statement, params=None):
+                return conn.execute(statement, params)
+
+        return _Conn()
+
+    async def commit(self):
+        self._session.commit()
+
+
+@pytest.mark.asyncio
+async def test_write_back_updates_table(monkeypatch):
+    """写回语句在真实表上按用户名批量累加已用次数"""
+    engine = create_engine("sqlite://")
+    SysUser.__table__.create(engine)
+    with Session(engine) as session:
+        session.add_all([
+            SysUser(user_id=1, user_name="alice", remaining_requests=3),
+            SysUser(user_id=2, user_name="bob", remaining_requests=0),
+            SysUser(user_id=3, user_name="carol", remaining_requests=7),
+        ])
+        session.commit()
+    monkeypatch.setattr(quota, "AsyncSessionLocal", lambda: _SyncSession(engine))
+
+    await quota._write_back([("alice", 2), ("bob", 5)])
+
+    with Session(engine) as session:
+        rows = dict(session.execute(select(SysUser.user_name, SysUser.remaining_requests)).all())
+    assert rows == {"alice": 5, "bob": 5, "carol": 7}
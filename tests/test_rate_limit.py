@@ -100,3 +100,47 @@ async def test_rate_limiter_state():
     
     # 应该剩余约5个token（考虑时间流逝可能补充）
     assert 4 <= limiter.tokens <= 10
+
+
+@pytest.mark.asyncio
+async def test_try_acquire_deadline():
+    """截止时间前无法放行时立即返回False，不占用令牌"""
+    limiter = TokenBucketRateLimiter(10, burst=1)
+    assert await limiter.try_acquire()
+    assert not await limiter.try_acquire()
+
+    now = time.monotonic()
+    assert not await limiter.try_acquire(deadline=now + 0.05)
+    start = time.monotonic()
+    assert await limiter.try_acquire(deadline=now + 0.2)
+    assert 0.05 < time.monotonic() - start < 0.2
+
+
+@pytest.mark.asyncio
+async def test_waiters_do_not_serialize():
+    """等待者各自按预约时间放行：先到的等待被取消不影响后面的放行时间"""
+    limiter = TokenBucketRateLimiter(10, burst=1)
+    await limiter.acquire()
+    first = asyncio.create_task(limiter.acquire())   # 约0.1秒后放行
+    second = asyncio.create_task(limiter.acquire())  # 约0.2秒后放行
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    start = time.monotonic()
+    await second
+    assert 0.1 < time.monotonic() - start < 0.3
+
+
+@pytest.mark.asyncio
+async def test_cancel_refunds_last_reservation():
+    """最后一个预约被取消时退还令牌"""
+    limiter = TokenBucketRateLimiter(10, burst=1)
+    await limiter.acquire()
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+
+    start = time.monotonic()
+    await limiter.acquire()
+    assert time.monotonic() - start < 0.15
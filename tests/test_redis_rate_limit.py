@@ -0,0 +1,99 @@
+"""
+测试跨进程Redis限速
+
+验证：
+1. 多个限速器实例（模拟多个进程）共享同一个速率
+2. 批量预约时本地使用已预约的令牌，不再访问Redis
+3. 截止时间前无法放行时不占用令牌
+4. Redis不可用时回退到本进程限速
+5. 不批量预约时并发请求各自预约，吞吐不受Redis往返时延限制
+"""
+import asyncio
+import time
+
+import pytest
+
+from app import runtime
+from app import rate_limiter
+from app.rate_limiter import RedisRateLimiter
+
+
+@pytest.mark.asyncio
+async def test_shared_rate_across_instances(redis_client):
+    """两个实例共享桶容量：容量用完后按速率放行"""
+    runtime.redis_client = redis_client
+    a = RedisRateLimiter("t_shared", rate=20, burst=5)
+    b = RedisRateLimiter("t_shared", rate=20, burst=5)
+
+    start = time.monotonic()
+    await asyncio.gather(*(limiter.acquire() for limiter in (a, b) * 5))
+    elapsed = time.monotonic() - start
+    # 10个请求，前5个立即放行，后5个每隔0.05秒一个
+    assert 0.2 < elapsed < 0.45
+
+
+@pytest.mark.asyncio
+async def test_lease_avoids_redis_calls(redis_client, monkeypatch):
+    """一次预约多个令牌，后续请求直接使用本地令牌"""
+    runtime.redis_client = redis_client
+    limiter = RedisRateLimiter("t_lease", rate=1000, burst=100, lease_size=10)
+    calls = []
+    lease = limiter._lease
+
+    async def counting_lease(count, max_wait):
+        calls.append(count)
+        return await lease(count, max_wait)
+
+    monkeypatch.setattr(limiter, "_lease", counting_lease)
+    await asyncio.gather(*(limiter.acquire() for _ in range(25)))
+    assert calls == [10, 10, 10]
+    assert len(limiter._slots) == 5
+
+
+@pytest.mark.asyncio
+async def test_try_acquire_deadline(redis_client):
+    """截止时间前无法放行时返回False，且不推后共享的放行时间"""
+    runtime.redis_client = redis_client
+    limiter = RedisRateLimiter("t_deadline", rate=10, burst=1)
+    assert await limiter.try_acquire()
+    assert not await limiter.try_acquire()
+    assert not await limiter.try_acquire(time.monotonic() + 0.02)
+
+    start = time.monotonic()
+    assert await limiter.try_acquire(time.monotonic() + 0.2)
+    assert time.monotonic() - start < 0.15
+
+
+@pytest.mark.asyncio
+async def test_fallback_without_redis():
+    """没有Redis时使用本进程令牌桶"""
+    runtime.redis_client = None
+    limiter = RedisRateLimiter("t_fallback", rate=10, burst=2)
+    await limiter.acquire()
+    assert await limiter.try_acquire()
+    assert not await limiter.try_acquire()
+
+
+@pytest.mark.asyncio
+async def test_single_token_reservations_overlap(redis_client, monkeypatch):
+    """lease_size=1 时并发请求的Redis预约互相重叠，不按往返时延串行"""
+    runtime.redis_client = redis_client
+    limiter = RedisRateLimiter("t_overlap", rate=10000, burst=100)
+    reserve = rate_limiter.gcra_reserve
+    in_flight = [0, 0]  # 当前并发数, 最大并发数
+
+    async def slow_reserve(*args, **kwargs):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        try:
+            await asyncio.sleep(0.05)  # 模拟Redis往返时延
+            return await reserve(*args, **kwargs)
+        finally:
+            in_flight[0] -= 1
+
+    monkeypatch.setattr(rate_limiter, "gcra_reserve", slow_reserve)
+    start = time.monotonic()
+    await asyncio.gather(*(limiter.acquire() for _ in range(20)))
+    # 串行预约需要 20 × 0.05 = 1 秒
+    assert time.monotonic() - start < 0.3
+    assert in_flight[1] == 20
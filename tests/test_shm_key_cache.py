@@ -0,0 +1,129 @@
+"""
+测试共享内存密钥缓存
+
+验证：
+1. 写入后其他进程（另一个映射同一段的实例 / 子进程）可以读到
+2. 同一 hash_code 重复写入时更新原槽位
+3. 探测窗口写满时覆盖最早的条目
+4. 槽位处于写入状态（版本号为奇数）时读取不返回半写入的数据
+5. 槽位数或服务器列表变化时重建共享内存段
+6. KEY_CACHE_BACKEND=shm 时负载均衡的密钥路由使用共享内存
+"""
+import multiprocessing
+import os
+import uuid
+
+import pytest
+
+from app import load_balancer
+from app.shm_key_cache import PROBE_WINDOW, SharedKeyCache, _SEQ, server_fingerprint
+
+
+@pytest.fixture
+def shm_cache():
+    cache = SharedKeyCache(f"t_keys_{uuid.uuid4().hex[:12]}", slots=64)
+    yield cache
+    cache.unlink()
+    cache.close()
+
+
+def _child_put(name: str) -> None:
+    cache = SharedKeyCache(name, slots=64)
+    cache.put("0badf00d", 2, "SN-FROM-CHILD")
+    cache.close()
+
+
+def test_put_and_get(shm_cache):
+    assert shm_cache.put("1a2b3c4d", 1, "1581F5FHD22B0001")
+    assert shm_cache.get("1a2b3c4d")[:2] == (1, "1581F5FHD22B0001")
+    assert shm_cache.get("00000000") is None
+    assert shm_cache.get("not-hex!") is None
+    assert not shm_cache.put("xyz", 1)
+    assert len(shm_cache) == 1
+
+
+def test_visible_to_other_mappings(shm_cache):
+    """另一个实例（模拟同机的其他网关进程）与子进程写入的条目互相可见"""
+    other = SharedKeyCache(shm_cache.name, slots=64)
+    try:
+        other.put("deadbeef", 3, "SN3")
+        assert shm_cache.get("deadbeef")[:2] == (3, "SN3")
+    finally:
+        other.close()
+
+    proc = multiprocessing.get_context("fork").Process(target=_child_put, args=(shm_cache.name,))
+    proc.start()
+    proc.join(10)
+    assert proc.exitcode == 0
+    assert shm_cache.get("0badf00d")[:2] == (2, "SN-FROM-CHILD")
+    # 子进程退出后共享内存段仍然存在
+    assert os.path.exists(f"/dev/shm/{shm_cache.name}")
+
+
+@pytest.mark.parametrize("slots, fingerprint", [(4096, 0), (64, server_fingerprint(["0 http://s1 u"]))])
+def test_recreate_on_config_change(shm_cache, slots, fingerprint):
+    """槽位数或服务器列表变化后重新启动的进程使用新建的空表，旧进程的映射不受影响"""
+    shm_cache.put("deadbeef", 3, "SN3")
+    fresh = SharedKeyCache(shm_cache.name, slots=slots, fingerprint=fingerprint)
+    try:
+        assert fresh.capacity == max(slots, 64)
+        assert fresh.get("deadbeef") is None
+        assert len(fresh) == 0
+        assert shm_cache.get("deadbeef") is not None
+        # 之后启动的进程与新表一致，不再重建
+        again = SharedKeyCache(shm_cache.name, slots=slots, fingerprint=fingerprint)
+        fresh.put("0badf00d", 1)
+        assert again.get("0badf00d") is not None
+        again.close()
+    finally:
+        fresh.close()
+
+
+def test_update_in_place(shm_cache):
+    shm_cache.put("1a2b3c4d", 1)
+    shm_cache.put("1a2b3c4d", 2, "SN2")
+    assert shm_cache.get("1a2b3c4d")[:2] == (2, "SN2")
+    assert len(shm_cache) == 1
+
+
+def test_full_window_overwrites_oldest(shm_cache, monkeypatch):
+    """同一起始槽位的条目超过探测窗口时，覆盖最早写入的条目"""
+    monkeypatch.setattr(shm_cache, "_home", lambda key: 0)
+    codes = [f"{i:08x}" for i in range(PROBE_WINDOW + 1)]
+    for code in codes:
+        shm_cache.put(code, 1)
+
+    assert shm_cache.get(codes[0]) is None
+    for code in codes[1:]:
+        assert shm_cache.get(code) is not None
+
+
+def test_torn_slot_not_returned(shm_cache):
+    shm_cache.put("1a2b3c4d", 1, "SN1")
+    offset = shm_cache._offset(shm_cache._home(0x1A2B3C4D))
+    seq = _SEQ.unpack_from(shm_cache._buf, offset)[0]
+    _SEQ.pack_into(shm_cache._buf, offset, seq | 1)  # 模拟写入中途
+    assert shm_cache.get("1a2b3c4d") is None
+
+    # 下次写入恢复版本号
+    shm_cache.put("1a2b3c4d", 2, "SN2")
+    assert _SEQ.unpack_from(shm_cache._buf, offset)[0] % 2 == 0
+    assert shm_cache.get("1a2b3c4d")[:2] == (2, "SN2")
+
+
+@pytest.mark.asyncio
+async def test_load_balancer_routes_via_shm(shm_cache, monkeypatch):
+    monkeypatch.setattr(load_balancer, "_shm_key_cache", shm_cache)
+    monkeypatch.setattr(load_balancer, "_servers", [
+        load_balancer.ServerInfo(idx=0, url="http://s0"),
+        load_balancer.ServerInfo(idx=1, url="http://s1"),
+    ])
+
+    assert (await load_balancer.handle_data_packet("cafebabe"))["action"] == "nokey"
+    await load_balancer.on_keygen_result("cafebabe", 1, True, "1581F5FHD22B0001")
+
+    result = await load_balancer.handle_data_packet("cafebabe")
+    assert result == {"action": "dispatch", "server_idx": 1, "server_url": "http://s1"}
+    assert "cafebabe" not in load_balancer._key_cache
+    assert await load_balancer.get_key_sn("cafebabe") == "1581F5FHD22B0001"
+    assert load_balancer.get_key_cache_size() == 1
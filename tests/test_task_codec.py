@@ -0,0 +1,88 @@
+"""
+测试队列任务的二进制编码
+
+验证：
+1. 二进制编码可无损还原任务字段
+2. 编码后体积明显小于JSON
+3. 兼容旧的JSON成员，不满足条件的任务回退为JSON
+"""
+import json
+import time
+import uuid
+
+import pytest
+import redis.asyncio as redis
+
+from app import runtime
+from app.config import settings
+from app.task_codec import encode_task, decode_task, resolve_username, _user_names
+from app.task_service import push_task_to_queue, QUEUE_KEY
+
+
+def _key_task() -> dict:
+    return {
+        "task_id": uuid.uuid4().hex,
+        "username": "ceshi1",
+        "user_id": 109,
+        "priority": 2,
+        "update_time": "2026-02-09 14:28:15",
+        "encrypted_data": "ab" * 176,
+        "packet_type": "key_packet",
+        "is_key_packet": True,
+        "drone_id": "a1b2c3d4",
+        "server_idx": 1,
+        "deadline": time.time() + 300,
+    }
+
+
+def test_binary_roundtrip():
+    """二进制编码后解码，字段与原任务一致"""
+    task = _key_task()
+    _user_names[task["user_id"]] = task["username"]
+
+    member = encode_task(task)
+    assert isinstance(member, bytes)
+    assert decode_task(member) == task
+
+
+def test_binary_is_compact():
+    """二进制成员比JSON小一半以上"""
+    task = _key_task()
+    assert len(encode_task(task)) * 2 < len(json.dumps(task))
+
+
+def test_legacy_json_member():
+    """滚动升级期间队列中残留的JSON成员仍可解码"""
+    task = _key_task()
+    assert decode_task(json.dumps(task)) == task
+    assert decode_task(json.dumps(task).encode()) == task
+
+
+def test_fallback_to_json():
+    """任务ID不是uuid等不满足二进制格式时回退为JSON"""
+    task = {"task_id": "task_00001", "username": "u", "priority": 1, "encrypted_data": "test"}
+    member = encode_task(task)
+    assert isinstance(member, str)
+    assert decode_task(member) == task
+
+
+@pytest.mark.asyncio
+async def test_binary_queue_member(redis_client):
+    """使用二进制队列客户端入队，其他进程可通过驻留表还原用户名"""
+    runtime.redis_client = redis_client
+    runtime.redis_queue_client = redis.from_url(settings.redis_url, decode_responses=False)
+    try:
+        task = _key_task()
+        await push_task_to_queue(task, task["priority"])
+
+        member = (await runtime.redis_queue_client.zrange(QUEUE_KEY, 0, 0))[0]
+        assert member[0] == 1
+
+        # 模拟另一个进程：本地驻留表为空
+        _user_names.clear()
+        job = decode_task(member)
+        assert await resolve_username(job) == task["username"]
+        assert job["encrypted_data"] == task["encrypted_data"]
+    finally:
+        await runtime.redis_queue_client.aclose()
+        runtime.redis_queue_client = None
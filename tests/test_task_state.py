@@ -0,0 +1,73 @@
+"""
+测试任务状态哈希
+
+验证：
+1. 状态流转只更新变化的字段，并续期TTL
+2. 等待方读取完成结果后删除状态key
+3. 只有排队中的任务会被标记为已放弃
+4. 已放弃、已完成或已过期的任务不会被状态更新"复活"
+"""
+import time
+
+import pytest
+
+from app import runtime
+from app.config import settings
+from app.routes.task_routes import _poll_task_result
+from app.task_service import set_task_state, mark_task_abandoned
+
+
+@pytest.mark.asyncio
+async def test_field_level_transition(redis_client):
+    """完成状态只写入变化字段，处理中写入的字段保留"""
+    runtime.redis_client = redis_client
+    await redis_client.hset("task:st_1", "status", "queued")
+    assert await set_task_state("st_1", {"status": "processing", "username": "alice", "server_idx": 2})
+    assert await set_task_state("st_1", {"status": "completed", "data": '{"msg": "ok"}'})
+
+    state = await redis_client.hgetall("task:st_1")
+    assert state["status"] == "completed"
+    assert state["username"] == "alice"
+    assert state["server_idx"] == "2"
+    assert 0 < await redis_client.ttl("task:st_1") <= settings.queue_wait_timeout
+
+
+@pytest.mark.asyncio
+async def test_result_deleted_after_read(redis_client):
+    """完成结果被读取一次后删除"""
+    runtime.redis_client = redis_client
+    await redis_client.hset("task:st_2", "status", "processing")
+    await set_task_state("st_2", {"status": "completed", "data": '{"msg": "keygen_succ"}'})
+
+    result = await _poll_task_result("st_2", time.time(), 5)
+
+    assert result["data"] == {"msg": "keygen_succ"}
+    assert await redis_client.exists("task:st_2") == 0
+
+
+@pytest.mark.asyncio
+async def test_abandon_only_queued(redis_client):
+    """处理中或已删除的任务不会被标记为已放弃"""
+    runtime.redis_client = redis_client
+    await redis_client.hset("task:st_q", "status", "queued")
+    await redis_client.hset("task:st_p", "status", "processing")
+
+    assert await mark_task_abandoned("st_q")
+    assert not await mark_task_abandoned("st_p")
+    assert not await mark_task_abandoned("st_missing")
+    assert await redis_client.hget("task:st_q", "status") == "abandoned"
+    assert await redis_client.hget("task:st_p", "status") == "processing"
+    assert await redis_client.exists("task:st_missing") == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", ["abandoned", "completed", "failed", None])
+async def test_terminal_state_not_overwritten(redis_client, status):
+    """终态或已过期的任务不会被改回处理中"""
+    runtime.redis_client = redis_client
+    if status:
+        await redis_client.hset("task:st_t", "status", status)
+
+    assert not await set_task_state("st_t", {"status": "processing", "server_idx": 1})
+    assert await redis_client.hget("task:st_t", "status") == status
+    assert await redis_client.hget("task:st_t", "server_idx") is None
@@ -0,0 +1,164 @@
+"""
+测试登录token本地校验
+
+验证：
+1. 本地校验签名和声明，不访问Redis
+2. 用户名可能被截断时查Redis取完整用户名
+3. 按用户吊销、单个吊销在同步后生效
+4. 登录复用用户当前的token
+"""
+import time
+
+import jwt
+import pytest
+
+from app.config import settings
+
+from app import runtime, token_auth
+from app.routes.task_routes import generate_user_token, validate_token
+from app.token_auth import (
+    JWT_SECRET_KEY,
+    issue_login_token,
+    revoke_token,
+    revoke_user_tokens,
+    sync_revocations,
+)
+
+
+@pytest.fixture
+def local_mode(monkeypatch, redis_client):
+    runtime.redis_client = redis_client
+    monkeypatch.setattr(token_auth.settings, "token_verify_mode", "local")
+    monkeypatch.setattr(token_auth, "_revoked_before", {})
+    monkeypatch.setattr(token_auth, "_revoked_jti", {})
+    monkeypatch.setattr(token_auth, "_revocation_version", None)
+    return redis_client
+
+
+@pytest.mark.asyncio
+async def test_local_verify_without_redis(local_mode):
+    """短用户名的token不需要Redis即可校验"""
+    token = await generate_user_token("alice")
+    runtime.redis_client = None
+    assert await validate_token(token) == "alice"
+
+
+@pytest.mark.asyncio
+async def test_rejects_bad_claims(local_mode):
+    """签名、签发者、过期时间不正确的token被拒绝"""
+    token = await generate_user_token("alice")
+    claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=["HS256"], audience="ApiStore")
+
+    assert await validate_token(token[:-2] + "xx") is None
+    assert await validate_token(jwt.encode({**claims, "iss": "other"}, JWT_SECRET_KEY)) is None
+    assert await validate_token(jwt.encode({**claims, "exp": int(time.time()) - 1}, JWT_SECRET_KEY)) is None
+
+
+@pytest.mark.asyncio
+async def test_truncated_name_falls_back_to_redis(local_mode):
+    """8个字符及以上的用户名从Redis取完整用户名"""
+    token = await generate_user_token("long_username")
+    assert await validate_token(token) == "long_username"
+
+    await local_mode.delete(f"user_token:{token}")
+    other = await generate_user_token("another_long_name")
+    await local_mode.delete(f"user_token:{other}")
+    assert await validate_token(other) is None
+
+
+@pytest.mark.asyncio
+async def test_revoke_user_tokens(local_mode):
+    """按用户吊销后，其他进程同步吊销信息后拒绝旧token"""
+    token = await generate_user_token("bob")
+    await revoke_user_tokens("bob")
+
+    token_auth._revoked_before = {}  # 模拟其他进程：本地尚未同步
+    assert await validate_token(token) == "bob"
+    assert await sync_revocations()
+    assert await validate_token(token) is None
+    assert not await sync_revocations()  # 版本未变化不重新加载
+
+
+@pytest.mark.asyncio
+async def test_revoke_single_token(local_mode):
+    """单个吊销只影响该token"""
+    first = await generate_user_token("carol")
+    second = await generate_user_token("carol")
+    assert await revoke_token(first)
+
+    await sync_revocations()
+    assert await validate_token(first) is None
+    assert await validate_token(second) == "carol"
+
+
+@pytest.mark.asyncio
+async def test_login_reuses_current_token(local_mode):
+    """剩余有效期足够时登录返回同一个token，吊销后签发新token"""
+    first = await issue_login_token("dave")
+    assert await issue_login_token("dave") == first
+    assert await validate_token(first) == "dave"
+    assert len(await local_mode.keys("user_token:*")) == 1
+
+    await revoke_user_tokens("dave")
+    second = await issue_login_token("dave")
+    assert second != first
+    assert await validate_token(second) == "dave"
+    assert await validate_token(first) is None
+
+
+@pytest.mark.asyncio
+async def test_login_mints_when_lifetime_short(local_mode, monkeypatch):
+    """当前token剩余有效期不足时签发新token"""
+    first = await issue_login_token("erin")
+    monkeypatch.setattr(token_auth.settings, "token_reuse_min_ttl", token_auth.TOKEN_EXPIRE_SECONDS + 1)
+    assert await issue_login_token("erin") != first
+
+
+@pytest.mark.asyncio
+async def test_login_skips_revoked_token(local_mode):
+    """单独吊销的当前token不再复用"""
+    first = await issue_login_token("frank")
+    await revoke_token(first)
+    assert await issue_login_token("frank") != first
+
+
+@pytest.mark.asyncio
+async def test_token_issued_right_after_revoke_is_valid(local_mode):
+    """吊销后同一秒内签发的token有效，吊销前同一秒签发的token失效"""
+    before = await generate_user_token("gina")
+    await revoke_user_tokens("gina")
+    after = await generate_user_token("gina")
+
+    assert await validate_token(before) is None
+    assert await validate_token(after) == "gina"
+    token_auth._revoked_before = {}
+    await sync_revocations()  # 其他进程同步后结果相同
+    assert await validate_token(before) is None
+    assert await validate_token(after) == "gina"
+
+
+@pytest.mark.asyncio
+async def test_login_reissues_when_revoked_by_other_process(local_mode):
+    """其他进程在本进程签发后、登记前吊销：不登记旧签发时间的token，按吊销点重新签发"""
+    await issue_login_token("hank")
+    await revoke_user_tokens("hank")
+    token_auth._revoked_before = {}  # 本进程尚未同步吊销信息，按当前时间签发
+    token = await issue_login_token("hank")
+
+    await sync_revocations()
+    assert await validate_token(token) == "hank"
+    assert await issue_login_token("hank") == token
+
+
+@pytest.mark.asyncio
+async def test_admin_revoke_single_token(local_mode, app_client):
+    """管理接口吊销单个token，无效token返回400"""
+    token = await issue_login_token("ivan")
+    params = {"admin_token": settings.admin_token, "token": token}
+    assert (await app_client.post("/api/admin/tokens/revoke", params=params)).status_code == 200
+    await sync_revocations()
+    assert await validate_token(token) is None
+    assert await issue_login_token("ivan") != token
+
+    params["token"] = token[:-2] + "xx"
+    assert (await app_client.post("/api/admin/tokens/revoke", params=params)).status_code == 400
@@ -0,0 +1,67 @@
+"""
+测试请求阶段计时
+
+验证：
+1. 解密接口的响应带 Server-Timing 头，包含各阶段耗时
+2. 每分钟只保留最慢的N个请求
+3. 慢请求管理接口需要管理员token
+"""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.routes.admin_routes import router as admin_router
+from app.tracing import ServerTimingMiddleware, SlowRequestLog, Trace, span, slow_requests
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware, path_prefix="/api/yd/")
+    app.include_router(admin_router)
+
+    @app.get("/api/yd/decryptl")
+    async def decrypt():
+        with span("auth"):
+            pass
+        with span("upstream"):
+            pass
+        return {"msg": "ok"}
+
+    @app.get("/other")
+    async def other():
+        return {}
+
+    return app
+
+
+def test_server_timing_header():
+    """解密接口返回各阶段耗时，其他接口不计时"""
+    client = TestClient(_app())
+
+    timing = client.get("/api/yd/decryptl").headers["server-timing"]
+    assert [part.split(";")[0] for part in timing.split(", ")] == ["auth", "upstream", "total"]
+    assert "server-timing" not in client.get("/other").headers
+
+
+def test_slow_log_keeps_top_n():
+    """当前分钟只保留耗时最长的N个请求，按耗时倒序输出"""
+    log = SlowRequestLog(top_n=2, minutes=5)
+    for total in (0.1, 0.5, 0.3, 0.2):
+        trace = Trace("/api/yd/decryptl")
+        trace.start -= total
+        log.record(trace, 200)
+
+    requests = log.snapshot()[0]["requests"]
+    assert [round(r["total_ms"] / 100) for r in requests] == [5, 3]
+
+
+def test_admin_requires_token():
+    """慢请求接口校验管理员token"""
+    client = TestClient(_app())
+    client.get("/api/yd/decryptl")
+
+    assert client.get("/api/admin/slow_requests", params={"admin_token": "wrong"}).status_code == 403
+    resp = client.get("/api/admin/slow_requests", params={"admin_token": settings.admin_token})
+    assert resp.status_code == 200
+    assert resp.json()["top_n"] == slow_requests.top_n
+    assert resp.json()["minutes"][0]["requests"][0]["path"] == "/api/yd/decryptl"
@@ -0,0 +1,70 @@
+"""
+测试有界TTL-LRU缓存
+
+验证：
+1. 超出容量时淘汰最久未访问的条目
+2. 过期条目不再返回，并计入统计
+3. 内存占用随增删同步更新
+"""
+import time
+
+from app.ttl_cache import TTLCache, get_cache_stats
+
+
+def test_lru_eviction():
+    """访问过的条目保留，淘汰最久未访问的"""
+    cache = TTLCache("t_lru", maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expiry(monkeypatch):
+    """过期条目返回默认值，并计入过期数和未命中数"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache("t_ttl", maxsize=10, ttl=5)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)
+
+    now[0] += 10
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_expired_head_cleared_before_evicting(monkeypatch):
+    """写入时先清理队首的过期条目，不淘汰未过期的"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = TTLCache("t_head", maxsize=2, ttl=5)
+    cache.set("old", 1)
+    now[0] += 3
+    cache.set("live", 2)
+    now[0] += 3
+    cache.set("new", 3)
+
+    assert cache.get("live") == 2
+    assert cache.stats()["evictions"] == 0
+
+
+def test_memory_accounting():
+    """内存占用随写入、覆盖、删除同步更新"""
+    cache = TTLCache("t_mem", maxsize=10, ttl=60)
+    cache.set("a", "x" * 100)
+    size_one = cache.memory_bytes
+    assert size_one > 100
+    cache.set("a", "x" * 100)
+    assert cache.memory_bytes == size_one
+    cache.pop("a")
+    assert cache.memory_bytes == 0
+    assert any(stats["name"] == "t_mem" for stats in get_cache_stats())
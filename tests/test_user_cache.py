@@ -0,0 +1,123 @@
+"""
+测试用户信息本地缓存
+
+验证：
+1. 命中缓存时不查数据库
+2. 失效通知删除指定用户，版本号连续时推进本地版本
+3. 漏收通知时版本比对清空缓存
+4. 查询期间发生失效，查询结果不写入缓存
+5. 按用户失效的记录有上限：过期后删除，记录已满时按清空全部处理
+"""
+import asyncio
+
+import pytest
+
+from app import runtime, user_cache
+from app.user_cache import (
+    CachedUser,
+    USER_CACHE_VERSION_KEY,
+    get_cached_user,
+    invalidate_user,
+)
+
+
+def _user(name: str, priority: int = 10) -> CachedUser:
+    return CachedUser(user_id=1, user_name=name, status="0", priority=priority,
+                      update_time=None, total_requests=100)
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """替换数据库查询，记录查询次数"""
+    calls = []
+
+    async def _load_user(username):
+        calls.append(username)
+        return _user(username, priority=len(calls))
+
+    user_cache.invalidate_local()
+    monkeypatch.setattr(user_cache, "_load_user", _load_user)
+    yield calls
+    user_cache.invalidate_local()
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_skips_db(loads):
+    """第二次获取同一用户不查数据库"""
+    first = await get_cached_user("alice")
+    second = await get_cached_user("alice")
+    assert first is second
+    assert loads == ["alice"]
+
+
+@pytest.mark.asyncio
+async def test_message_invalidates_user(redis_client, loads):
+    """收到通知后只删除该用户，版本号连续时推进本地版本"""
+    runtime.redis_client = redis_client
+    await user_cache._check_version()
+    await get_cached_user("alice")
+    await get_cached_user("bob")
+
+    user_cache._handle_message(f"{user_cache._version + 1}:alice")
+    assert user_cache._version == 1
+
+    await get_cached_user("alice")
+    await get_cached_user("bob")
+    assert loads == ["alice", "bob", "alice"]
+
+
+@pytest.mark.asyncio
+async def test_missed_message_clears_cache(redis_client, loads):
+    """其他进程的修改通知漏收时，版本比对发现不一致并清空缓存"""
+    runtime.redis_client = redis_client
+    await user_cache._check_version()
+    await get_cached_user("alice")
+
+    await redis_client.incr(USER_CACHE_VERSION_KEY)
+    await user_cache._check_version()
+
+    await get_cached_user("alice")
+    assert loads == ["alice", "alice"]
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_load_not_cached(redis_client, monkeypatch):
+    """查询进行中发生失效，本次结果返回但不写入缓存"""
+    runtime.redis_client = redis_client
+    user_cache.invalidate_local()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def _slow_load(username):
+        started.set()
+        await release.wait()
+        return _user(username)
+
+    monkeypatch.setattr(user_cache, "_load_user", _slow_load)
+    task = asyncio.create_task(get_cached_user("alice"))
+    await started.wait()
+    await invalidate_user("alice")
+    release.set()
+
+    assert (await task).user_name == "alice"
+    assert user_cache.get_user_cache_size() == 0
+    assert await redis_client.get(USER_CACHE_VERSION_KEY) == "1"
+
+
+def test_invalidation_history_bounded(monkeypatch):
+    """失效记录过期后不再保留；记录已满时清空全部，仍然使此前的校验记录作废"""
+    history = user_cache.TTLCache("t_invalidation", maxsize=2, ttl=60)
+    monkeypatch.setattr(user_cache, "_invalidated_at", history)
+    monkeypatch.setattr(user_cache, "_INVALIDATION_HISTORY_SIZE", 2)
+
+    generation = user_cache.current_generation()
+    user_cache.invalidate_local("a")
+    user_cache.invalidate_local("b")
+    assert len(history) == 2
+    assert user_cache.changed_since("a", generation)
+
+    user_cache.invalidate_local("c")
+    assert len(history) == 0
+    assert user_cache.changed_since("a", generation)
+    assert user_cache.changed_since("c", generation)
+    assert not user_cache.changed_since("c", user_cache.current_generation())
@@ -0,0 +1,68 @@
+"""
+测试启动预热与就绪检查
+
+验证：
+1. 并发登录所有服务器，并为每台服务器建立配置数量的保活连接
+2. 单台服务器登录失败不阻止就绪，失败原因记录在预热结果中
+3. /ready 在预热完成前返回503，完成后返回200
+"""
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from httpx import Request, Response
+
+from app import load_balancer, runtime, warmup
+from app.config import settings
+
+
+def _login_response(url, **kwargs):
+    request = Request("GET", url)
+    if url.startswith("http://bad"):
+        return Response(200, json={"success": False, "msg": "密码错误"}, request=request)
+    return Response(200, json={"success": True, "data": {"token": "t" * 60}}, request=request)
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    servers = [
+        load_balancer.ServerInfo(idx=0, url="http://good", username="u", password="p"),
+        load_balancer.ServerInfo(idx=1, url="http://bad", username="u", password="p"),
+    ]
+    monkeypatch.setattr(load_balancer, "_servers", servers)
+    client = MagicMock()
+    client.get = AsyncMock(side_effect=_login_response)
+    client.head = AsyncMock(return_value=Response(200))
+    monkeypatch.setattr(runtime, "http_b_client", client)
+    monkeypatch.setattr(runtime, "ready", False)
+    monkeypatch.setattr(settings, "warmup_connections_per_server", 3)
+    return servers
+
+
+@pytest.mark.asyncio
+async def test_warm_up_logs_in_and_opens_connections(servers):
+    await warmup.warm_up()
+
+    assert warmup.is_ready()
+    assert servers[0].token == "t" * 60
+    assert servers[1].token is None
+    assert runtime.http_b_client.head.await_count == 6
+
+    good, bad = warmup.get_warmup_report()["servers"]
+    assert good == {"idx": 0, "login": True, "connections": 3, "error": None}
+    assert bad["login"] is False and bad["error"]
+    assert bad["connections"] == 3
+
+
+@pytest.mark.asyncio
+async def test_ready_endpoint(app_client, monkeypatch):
+    monkeypatch.setattr(runtime, "ready", False)
+    resp = await app_client.get("/ready")
+    assert resp.status_code == 503
+    assert resp.json()["ready"] is False
+
+    runtime.ready = True
+    resp = await app_client.get("/ready")
+    assert resp.status_code == 200
+
+    warmup.mark_not_ready()
+    assert (await app_client.get("/ready")).status_code == 503
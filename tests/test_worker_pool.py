@@ -0,0 +1,196 @@
+"""
+测试Worker池扩缩容决策和按服务器分发
+
+扩缩容决策只验证目标消费者数的计算，不依赖Redis和上游服务器
+"""
+import asyncio
+import json
+
+import pytest
+
+from app import runtime
+from app import worker
+from app.worker_pool import WorkerPool
+
+
+def _sample(busy=False, active_jobs=0, local_queue=0, queue_share=0, rate=0.0, upstream_latency=0.0):
+    return {
+        "busy": busy,
+        "active_jobs": active_jobs,
+        "local_queue": local_queue,
+        "queue_share": queue_share,
+        "rate": rate,
+        "upstream_latency": upstream_latency,
+    }
+
+
+def test_desired_respects_bounds():
+    """目标数始终在 [1, per_server_max] 之间"""
+    pool = WorkerPool(per_server_max=4, max_workers=32)
+    assert pool._desired(_sample()) == 1
+    assert pool._desired(_sample(active_jobs=10, local_queue=10)) == 4
+
+
+def test_desired_busy_server_not_scaled():
+    """服务器繁忙时只保留1个消费者"""
+    pool = WorkerPool(per_server_max=4, max_workers=32)
+    assert pool._desired(_sample(busy=True, active_jobs=3, local_queue=1)) == 1
+
+
+def test_desired_follows_upstream_latency():
+    """上游延迟升高时按 吞吐 × 延迟 扩容"""
+    pool = WorkerPool(per_server_max=100, max_workers=100)
+    assert pool._desired(_sample(rate=2.0, upstream_latency=2.5)) == 5
+
+
+def test_desired_follows_shared_queue_depth():
+    """共享队列积压时按空闲服务器分摊的份额扩容"""
+    pool = WorkerPool(per_server_max=8, max_workers=32)
+    assert pool._desired(_sample(active_jobs=1, local_queue=1, queue_share=3)) == 5
+    assert pool._desired(_sample(queue_share=100)) == 8
+
+
+def test_desired_respects_worker_min():
+    """worker_min 平均分到各服务器，繁忙服务器也保留该下限"""
+    pool = WorkerPool(per_server_max=4, max_workers=32, min_workers=6)
+    assert pool._desired(_sample(), server_count=2) == 3
+    assert pool._desired(_sample(busy=True), server_count=2) == 3
+    assert pool._desired(_sample(), server_count=12) == 1
+    # 下限不超过每台服务器的上限
+    assert pool._desired(_sample(), server_count=1) == 4
+
+
+@pytest.mark.asyncio
+async def test_tick_shares_queue_depth_among_idle_servers(redis_client, monkeypatch):
+    """共享队列深度只分摊给空闲服务器，繁忙服务器不因积压扩容"""
+    from app import worker_pool
+    from app.load_balancer import ServerInfo
+
+    runtime.redis_client = redis_client
+    await redis_client.zadd(worker.QUEUE_KEY, {f"job{i}": i for i in range(4)})
+    servers = [ServerInfo(idx=i, url=f"http://s{i}", username="u", password="p") for i in range(3)]
+    monkeypatch.setattr(servers[2], "is_busy", lambda: True)
+    monkeypatch.setattr(worker_pool, "get_all_servers", lambda: servers)
+
+    pool = WorkerPool(per_server_max=8, max_workers=32)
+    monkeypatch.setattr(pool, "_spawn", lambda idx: pool._workers[idx].append((None, None)))
+    await pool._tick()
+
+    sample = pool._last_sample
+    assert sample["queue_depth"] == 4 and sample["idle_servers"] == 2
+    assert sample["servers"][0]["queue_share"] == 2
+    assert sample["servers"][2]["queue_share"] == 0
+    assert pool.stats()["per_server"] == {0: 2, 1: 2, 2: 1}
+
+
+def _servers(count):
+    from app.load_balancer import ServerInfo
+    return [ServerInfo(idx=i, url=f"http://s{i}", username="u", password="p") for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_skips_full_server_queue(redis_client, monkeypatch):
+    """慢服务器的本地队列已满时，后面其他服务器的任务照常派发"""
+    from app import load_balancer
+
+    runtime.redis_client = redis_client
+    monkeypatch.setattr(load_balancer, "_servers", _servers(2))
+    worker._server_queues.clear()
+
+    # 服务器0的本地队列已被占满（模拟慢服务器）
+    slow_queue = worker.get_server_queue(0)
+    while not slow_queue.full():
+        slow_queue.put_nowait(({"task_id": "stuck", "server_idx": 0}, 0, "stuck"))
+
+    await redis_client.zadd(worker.QUEUE_KEY, {
+        json.dumps({"task_id": "slow_job", "server_idx": 0}): 1,
+        json.dumps({"task_id": "fast_job", "server_idx": 1}): 2,
+    })
+
+    dispatcher = asyncio.create_task(worker.dispatcher_loop())
+    try:
+        job, _, _ = await asyncio.wait_for(worker.get_server_queue(1).get(), timeout=2)
+    finally:
+        dispatcher.cancel()
+        await asyncio.gather(dispatcher, return_exceptions=True)
+
+    assert job["task_id"] == "fast_job"
+    # 服务器0的任务仍留在共享队列中，等待其消费者空出位置
+    remaining = await redis_client.zrange(worker.QUEUE_KEY, 0, -1)
+    assert [json.loads(m)["task_id"] for m in remaining] == ["slow_job"]
+    worker._server_queues.clear()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_cancels_retired_worker_mid_job(monkeypatch):
+    """缩容后仍在处理任务的消费者在关闭时被取消并等待结束"""
+    from app import worker_pool
+    from app.load_balancer import ServerInfo
+
+    started = asyncio.Event()
+    cancelled = []
+
+    async def _busy_worker(server_idx, stop_event=None):
+        # 模拟正在处理一个长任务，处理完之前不检查停止信号
+        started.set()
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(server_idx)
+            raise
+
+    async def _idle_dispatcher():
+        await asyncio.sleep(3600)
+
+    async def _requeue():
+        return 0
+
+    servers = [ServerInfo(idx=0, url="http://s0", username="u", password="p")]
+    monkeypatch.setattr(worker_pool, "get_all_servers", lambda: servers)
+    monkeypatch.setattr(worker_pool, "worker_loop", _busy_worker)
+    monkeypatch.setattr(worker_pool, "dispatcher_loop", _idle_dispatcher)
+    monkeypatch.setattr(worker_pool, "requeue_local_jobs", _requeue)
+
+    pool = WorkerPool(per_server_max=2, max_workers=4, interval=3600)
+    runner = asyncio.create_task(pool.run())
+    await asyncio.wait_for(started.wait(), timeout=2)
+    (retired, _), = pool._workers[0]
+    pool._retire(0)
+    pool._reap()
+    assert pool.stats()["draining"] == 1 and pool.size == 0
+
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    assert retired.done() and cancelled == [0]
+    assert pool.stats()["draining"] == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_fails_job_for_removed_server(redis_client, monkeypatch):
+    """目标服务器已不在服务器列表中的任务被标记失败，不放入无人消费的本地队列"""
+    from app import load_balancer
+    from app.task_service import task_state_key
+
+    runtime.redis_client = redis_client
+    monkeypatch.setattr(load_balancer, "_servers", _servers(1))
+    worker._server_queues.clear()
+
+    await redis_client.zadd(worker.QUEUE_KEY, {
+        json.dumps({"task_id": "orphan_job", "server_idx": 5}): 1,
+        json.dumps({"task_id": "live_job", "server_idx": 0}): 2,
+    })
+    await redis_client.hset(task_state_key("orphan_job"), "status", "queued")
+
+    dispatcher = asyncio.create_task(worker.dispatcher_loop())
+    try:
+        job, _, _ = await asyncio.wait_for(worker.get_server_queue(0).get(), timeout=2)
+    finally:
+        dispatcher.cancel()
+        await asyncio.gather(dispatcher, return_exceptions=True)
+
+    assert job["task_id"] == "live_job"
+    assert 5 not in worker._server_queues
+    assert await redis_client.zcard(worker.QUEUE_KEY) == 0
+    state = await redis_client.hgetall(task_state_key("orphan_job"))
+    assert state["status"] == "failed" and "5" in state["error"]
+    worker._server_queues.clear()